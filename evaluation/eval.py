@@ -9,7 +9,7 @@ import psutil
 import sys
 sys.path.append("./kimina-lean-server")
 
-from client.client import Lean4Client
+from client.client import Lean4Client, batch_verify_early_stop, batch_verify_proof
 from client.infotree import extract_data
 from utils.proof_utils import split_proof_header, parse_client_response
 
@@ -19,6 +19,8 @@ BASE_URL = "http://127.0.0.1:12332"
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Evaluate Lean proofs from a JSON file, classified by header import')
     parser.add_argument('--input_file', type=str, help='Path to the input JSON file')
+    parser.add_argument('--strip_comments', action='store_true', help='Verify once the proofs which only differ by their comments')
+    parser.add_argument('--early_stop', action='store_true', help='Skip the remaining proofs of a problem once one passes')
     args = parser.parse_args()
 
     # Load input data
@@ -56,53 +58,68 @@ if __name__ == "__main__":
             os.environ["REPL_WORKING_PATH"] = "./lean-rademacher"
         codes = []
         problem_id_map = []
+        problems = []  # Candidate codes of each problem
         for problem in category_data:
             problem_id = problem["problem_id"]
             proofs = problem["full_proof"]
+            problems.append([])
             for i, proof in enumerate(proofs):
                 codes.append({"custom_id": f"{problem_id}_{i}", "proof": proof})
+                problems[-1].append(codes[-1])
                 problem_id_map.append((problem_id, i))
         if not codes:
             print(f"No problems in category {category_name}.")
             return None
         
-        # if out of mem, reduce batch_size
+        # Upper bounds, the client shrinks the batches and their concurrency when the server is overloaded
         batch_size = 128
-        all_results = []
+        num_proc = 4
+        # Let the server evict REPLs to keep 20G of memory available instead of restarting it
+        os.environ.setdefault(
+            "LEANSERVER_MAX_REPL_MEMORY_MB",
+            str(max(psutil.virtual_memory().total // 2**20 - 20 * 1024, 1024)),
+        )
         os.system("python -m server &")
         time.sleep(20)  
         print('server started')
         client = Lean4Client(base_url=BASE_URL)
         
-        for batch_start in tqdm(range(0, len(codes), batch_size), desc=f"Verifying {category_name}"):
-            batch_codes = codes[batch_start:batch_start+batch_size]
-            mem = psutil.virtual_memory()
-            if mem.available < 200 * 1024 * 1024 * 1024:
-                print('Available memory < 20G, restarting server...')
-                os.system('pkill -9 -f "python -m server"')
-                os.system("pkill -9 -f repl")
-                time.sleep(2)
-                os.system("python -m server &")
-                time.sleep(20)
-                print('server restarted')
-                
-                client = Lean4Client(base_url=BASE_URL)
-            try:
-                response = client.verify(batch_codes, timeout=60)
-                #print(response)
-            except Exception as e:
-                print(f"Error in batch {batch_start//batch_size}: {e}")
-                response = {"results": [None] * len(batch_codes)}
-                exit()
-            
-            all_results.extend(response["results"])
-        print('kill server')
-        os.system('pkill -9 -f "python -m server"')
-        os.system("pkill -9 -f repl")
-        time.sleep(2)
+        # Results are streamed as each proof completes, in completion order, and
+        # checkpointed so that running again after a crash skips the verified proofs
+        results_by_id = {}
+        checkpoint = args.input_file.replace(".json", f"_{category_name}_checkpoint.jsonl")
+        verify_kwargs = dict(
+            timeout=60,
+            num_proc=num_proc,
+            batch_size=batch_size,
+            stream=True,
+            adaptive=True,
+            on_result=lambda result: results_by_id.__setitem__(result["custom_id"], result),
+            strip_comments=args.strip_comments,
+            checkpoint=checkpoint,
+        )
+        verification_stats = None
+        try:
+            if args.early_stop:
+                # pass@k only needs one passing proof per problem, the others are skipped
+                _, verification_stats = batch_verify_early_stop(client, problems, **verify_kwargs)
+            else:
+                batch_verify_proof(client, codes, **verify_kwargs)
+        except Exception as e:
+            print(f"Error while verifying {category_name} after {len(results_by_id)} results: {e}")
+            print(f"The results are kept in {checkpoint}, run again to resume")
+            raise
+        finally:
+            client.close()
+            print('kill server')
+            os.system('pkill -9 -f "python -m server"')
+            os.system("pkill -9 -f repl")
+            time.sleep(2)
+        # The proofs skipped by early stopping have no result
+        all_results = [results_by_id.get(code["custom_id"]) for code in codes]
         # exit()
         verification_results = [
-            parse_client_response(item)
+            parse_client_response(item) if item is not None else None
             for item in all_results
         ]
         
@@ -117,7 +134,7 @@ if __name__ == "__main__":
             problem_id = problem["problem_id"]
             proofs = problem["full_proof"]
             proof_results = sorted(problem_results[problem_id], key=lambda x: x[0])
-            passed_list = [result["is_valid_no_sorry"] for (_, result) in proof_results]
+            passed_list = [result["is_valid_no_sorry"] if result is not None else None for (_, result) in proof_results]
 
             results.append({
                 "problem_id": problem_id,
@@ -130,7 +147,8 @@ if __name__ == "__main__":
             "statistics": {
                 "total_problems": total_problems,
                 "passed_problems": passed_problems,
-                "pass_rate": pass_rate
+                "pass_rate": pass_rate,
+                "early_stop": verification_stats,
             },
             "results": results
         }
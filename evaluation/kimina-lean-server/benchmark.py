@@ -52,13 +52,13 @@ if __name__ == "__main__":
     logger.info("Testing cached mode")
 
     # Test cached mode
-    client = Lean4Client(base_url=url, disable_cache=False)
+    client = Lean4Client(base_url=url, disable_cache=False, include_timing=True)
 
     benchmark_api(client, n, timeout, batch_size, num_proc)
 
     logger.info("Testing non-cached mode")
 
     # Test non-cached mode
-    client = Lean4Client(base_url=url, disable_cache=True)
+    client = Lean4Client(base_url=url, disable_cache=True, include_timing=True)
 
     benchmark_api(client, n, timeout, batch_size, num_proc)
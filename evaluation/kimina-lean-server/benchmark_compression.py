@@ -0,0 +1,89 @@
+import argparse
+import os
+import time
+
+from datasets import load_dataset
+from loguru import logger
+
+from client.client import Lean4Client, batch_verify_proof
+
+
+def benchmark_compression(
+    url: str,
+    n: int,
+    timeout: int,
+    batch_size: int,
+    num_proc: int,
+    infotree_type: str | None,
+):
+    """Compare the bytes on the wire and the latency of compressed and plain transport.
+
+    The proofs are verified once to fill the result cache of the server, so that
+    the measured runs only differ by their transport. Each run then verifies all
+    the proofs, with the infotrees of `infotree_type`, with and without compression.
+
+    Args:
+        url (str): URL of the Lean4 server.
+        n (int): Number of samples to test from the dataset.
+        timeout (int): Maximum time in seconds allowed for each verification.
+        batch_size (int): Number of samples to process in each batch.
+        num_proc (int): Number of concurrent batches.
+        infotree_type (str, optional): Type of info tree to request.
+
+    Returns:
+        None: Results are printed to stdout.
+    """
+    dataset = load_dataset("Goedel-LM/Lean-workbook-proofs", split="train")
+    dataset = dataset.select(range(n))
+
+    samples = [
+        {"custom_id": sample["problem_id"], "proof": sample["full_proof"]}
+        for sample in dataset
+    ]
+
+    def run(compression):
+        client = Lean4Client(base_url=url, compression=compression)
+        start_time = time.perf_counter()
+        batch_verify_proof(
+            client,
+            samples,
+            timeout=timeout,
+            num_proc=num_proc,
+            batch_size=batch_size,
+            infotree_type=infotree_type,
+        )
+        elapsed = time.perf_counter() - start_time
+        client.close()
+        return client.wire_bytes, elapsed
+
+    logger.info("Filling the result cache")
+    run(compression=True)
+
+    for compression in (False, True):
+        wire_bytes, elapsed = run(compression)
+        print(
+            f"{'compressed' if compression else 'plain'}: "
+            f"sent {wire_bytes['sent'] / 2**20:.2f} MB, "
+            f"received {wire_bytes['received'] / 2**20:.2f} MB, "
+            f"{elapsed:.2f}s for {n} proofs"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the compressed transport")
+    parser.add_argument("--url", type=str, default="http://localhost:80")
+    parser.add_argument("--n", type=int, default=100)
+    parser.add_argument("--timeout", type=int, default=60)
+    parser.add_argument("--batch_size", type=int, default=128)
+    parser.add_argument("--num_proc", type=int, default=os.cpu_count() or 16)
+    parser.add_argument("--infotree_type", type=str, default="original")
+    args = parser.parse_args()
+
+    benchmark_compression(
+        args.url,
+        args.n,
+        args.timeout,
+        args.batch_size,
+        args.num_proc,
+        args.infotree_type,
+    )
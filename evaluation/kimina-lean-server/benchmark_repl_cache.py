@@ -0,0 +1,78 @@
+import argparse
+import asyncio
+import random
+import time
+
+from utils.repl_cache import LRUReplCache
+
+
+class FakeREPL:
+    """Stand-in for a LeanREPL, the cache never talks to the process."""
+
+
+class BenchmarkReplCache(LRUReplCache):
+    """REPL cache which does not schedule pre-warms, they do not count in the benchmark."""
+
+    def create(self, header, amount=1, predecessor=None):
+        pass
+
+
+async def benchmark_repl_cache(n_repls: int, n_headers: int, n_ops: int, n_workers: int):
+    """Benchmark the acquire/release throughput of the REPL cache.
+
+    The cache is filled with `n_repls` idle REPLs spread over `n_headers` headers,
+    then `n_workers` coroutines lease and release REPLs of random headers.
+
+    Args:
+        n_repls (int): Number of pooled REPLs.
+        n_headers (int): Number of distinct headers.
+        n_ops (int): Total number of acquire/release pairs.
+        n_workers (int): Number of concurrent coroutines.
+
+    Returns:
+        None: Results are printed to stdout.
+    """
+    cache = BenchmarkReplCache(max_size=n_repls)
+    headers = [f"import Mathlib\nimport Header{i}" for i in range(n_headers)]
+    for i in range(n_repls):
+        await cache.put(headers[i % n_headers], FakeREPL())
+
+    async def worker(n):
+        rng = random.Random(n)
+        for _ in range(n):
+            header = rng.choice(headers)
+            id, repl = await cache.get(header)
+            if id is not None:
+                await cache.release(header, id, repl)
+            # Let the other workers interleave like concurrent requests do
+            await asyncio.sleep(0)
+
+    ops_per_worker = n_ops // n_workers
+    start_time = time.perf_counter()
+    await asyncio.gather(*(worker(ops_per_worker) for _ in range(n_workers)))
+    elapsed = time.perf_counter() - start_time
+
+    n_done = ops_per_worker * n_workers
+    print(
+        f"{n_repls} REPLs / {n_headers} headers: "
+        f"{n_done} acquire+release in {elapsed:.3f}s "
+        f"({n_done / elapsed:,.0f} ops/s, {cache.stats['cache_hits']} hits)"
+    )
+
+    start_time = time.perf_counter()
+    for _ in range(100):
+        cache.snapshot()
+    print(f"snapshot: {(time.perf_counter() - start_time) * 10:.3f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the LRUReplCache")
+    parser.add_argument("--n_repls", type=int, default=10000)
+    parser.add_argument("--n_headers", type=int, default=100)
+    parser.add_argument("--n_ops", type=int, default=200000)
+    parser.add_argument("--n_workers", type=int, default=1000)
+    args = parser.parse_args()
+
+    asyncio.run(
+        benchmark_repl_cache(args.n_repls, args.n_headers, args.n_ops, args.n_workers)
+    )
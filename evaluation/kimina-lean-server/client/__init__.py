@@ -1,3 +1,4 @@
 from .client import Lean4Client
+from .sharded import ShardedLean4Client
 
-__ALL__ = [Lean4Client]
+__ALL__ = [Lean4Client, ShardedLean4Client]
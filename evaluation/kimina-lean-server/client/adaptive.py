@@ -0,0 +1,86 @@
+import time
+
+
+class AIMDController:
+    """
+    Additive increase / multiplicative decrease of the batch size and of the
+    number of concurrent batches, like TCP congestion control.
+
+    Every batch completed without congestion grows the batch size by one
+    sample and the concurrency by about one batch per round of batches. A
+    congestion signal halves both:
+
+    - a request which failed,
+    - a batch slower than the verification timeout, i.e. its proofs mostly
+      waited for a slot,
+    - a batch during which the server refused requests as overloaded, with
+      a status that `retry.classify_exception` classes as OVERLOAD,
+    - a server queue holding more than two rounds of its active slots.
+
+    Growth pauses while the server queue holds a full round, as more
+    concurrency then only adds queued requests. Only the batches started
+    after the last decrease can trigger a new one, and a deep queue only
+    once a round trip and a poll of the queue passed since the last
+    decrease, so that one congestion episode halves the window once.
+    """
+
+    def __init__(
+        self,
+        max_batch_size,
+        max_concurrency,
+        timeout,
+        decrease_factor=0.5,
+        status_interval=0,
+    ):
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout  # Latency above which a batch is congested
+        self.decrease_factor = decrease_factor
+        self.status_interval = status_interval  # Seconds between two polls of the queue
+        self.rtt = 0.0  # Smoothed latency of the batches
+        # Start from a quarter of the limits and probe upwards
+        self.batch_size = max(1.0, self.max_batch_size / 4)
+        self.concurrency = max(1.0, self.max_concurrency / 4)
+        self.queue_full = False  # The server has a full round of requests queued
+        self.last_decrease = float("-inf")
+        self.stats = {
+            "increases": 0,
+            "decreases": 0,
+        }
+
+    def next_batch_size(self):
+        return int(self.batch_size)
+
+    def max_in_flight(self):
+        return int(self.concurrency)
+
+    def on_batch(self, started, latency, failed=False, overloaded=False):
+        """Adapt to a completed batch, started at `time.monotonic()` `started`."""
+        # Smoothed like the round trip time of TCP
+        self.rtt = latency if self.rtt == 0 else 0.875 * self.rtt + 0.125 * latency
+        congested = failed or overloaded or latency > self.timeout
+        if congested:
+            if started >= self.last_decrease:
+                self._decrease()
+        elif not self.queue_full:
+            self.batch_size = min(self.batch_size + 1, self.max_batch_size)
+            self.concurrency = min(
+                self.concurrency + 1 / self.concurrency, self.max_concurrency
+            )
+            self.stats["increases"] += 1
+
+    def on_queue(self, waiting, active):
+        """Adapt to the queue depth reported by the server."""
+        self.queue_full = waiting > active
+        # The queue only reflects a decrease once the batches in flight completed
+        since_decrease = time.monotonic() - self.last_decrease
+        if waiting > 2 * max(active, 1) and since_decrease >= max(
+            self.rtt, self.status_interval
+        ):
+            self._decrease()
+
+    def _decrease(self):
+        self.batch_size = max(1.0, self.batch_size * self.decrease_factor)
+        self.concurrency = max(1.0, self.concurrency * self.decrease_factor)
+        self.last_decrease = time.monotonic()
+        self.stats["decreases"] += 1
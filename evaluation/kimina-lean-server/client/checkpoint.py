@@ -0,0 +1,62 @@
+import json
+import os
+
+from .retry import REPL_FAILURE, classify_result
+
+
+class ResultCheckpoint:
+    """
+    Append-only JSONL file of verification results, one line per custom id.
+
+    Each result is written and flushed as soon as it is received, so a run
+    which dies, or whose server restarts, resumes from the results already
+    in the file instead of verifying them again. The results of REPLs which
+    crashed say nothing about their proof: they are not written, and those
+    found in the file are not restored, so that their proofs are verified
+    again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.results = {}  # Checkpointed results by custom id
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        result = json.loads(line)
+                    except json.JSONDecodeError:
+                        # The last line of a run killed while writing it
+                        continue
+                    if classify_result(result) != REPL_FAILURE:
+                        self.results[result["custom_id"]] = result
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = open(path, "a", encoding="utf-8")
+        if self.file.tell() > 0 and not _ends_with_newline(path):
+            # Do not append to a truncated line
+            self.file.write("\n")
+
+    def __contains__(self, custom_id):
+        return custom_id in self.results
+
+    def __len__(self):
+        return len(self.results)
+
+    def append(self, result):
+        """Write a result, unless its custom id is already checkpointed or its REPL failed."""
+        if (
+            result["custom_id"] in self.results
+            or classify_result(result) == REPL_FAILURE
+        ):
+            return
+        self.file.write(json.dumps(result, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.results[result["custom_id"]] = result
+
+    def close(self):
+        self.file.close()
+
+
+def _ends_with_newline(path):
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
@@ -1,8 +1,14 @@
+import abc
 import asyncio
+import json
 import logging
 import os
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
 from urllib.parse import urljoin, urlparse, urlunparse
-from typing import List
+from typing import Callable, List
 
 import aiohttp
 from loguru import logger
@@ -10,22 +16,120 @@ from tenacity import (
     RetryError,
     before_sleep_log,
     retry,
+    retry_if_exception,
     stop_after_attempt,
     wait_exponential,
 )
 
 from tqdm.asyncio import tqdm_asyncio
 
+from utils.compression import ENCODINGS, Decompressor, compress, negotiate
+from utils.proof_utils import parse_client_response
 
-class Lean4Client(object):
+from .adaptive import AIMDController
+from .checkpoint import ResultCheckpoint
+from .infotree import remove_lean_comments
+from .retry import (
+    OVERLOAD,
+    OVERLOAD_STATUSES,
+    REPL_FAILURE,
+    TRANSPORT,
+    RetryPolicy,
+    classify_exception,
+    classify_result,
+    is_transient,
+)
+
+# Request bodies smaller than this are sent uncompressed
+MINIMUM_COMPRESSED_SIZE = 1024
+
+
+class SyncLoopMixin(abc.ABC):
+    """Private event loop running the synchronous methods of a client.
+
+    The loop runs in a daemon thread, so that the synchronous methods work the
+    same from a thread already running an event loop, e.g. in Jupyter, and
+    all the calls share the connections of one HTTP session. The client sets
+    `self._loop = None` in its constructor.
+    """
+
+    _loop: asyncio.AbstractEventLoop | None
+    _loop_thread: threading.Thread | None = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    @abc.abstractmethod
+    async def aclose(self):
+        """Release the connections of the client."""
+
+    def close(self):
+        """Close the connections and the private event loop of the client."""
+        if self._loop is not None and not self._loop.is_closed():
+            asyncio.run_coroutine_threadsafe(self.aclose(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            if self._loop_thread is not None:
+                self._loop_thread.join()
+            self._loop.close()
+        self._loop = None
+        self._loop_thread = None
+
+    def _run(self, coro):
+        """Run a coroutine from a synchronous method, on the private event loop of the client."""
+        if self._loop is None or self._loop.is_closed():
+            self._loop = asyncio.new_event_loop()
+            self._loop_thread = threading.Thread(
+                target=self._loop.run_forever, daemon=True
+            )
+            self._loop_thread.start()
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        try:
+            return future.result()
+        except BaseException:
+            # Do not leave the coroutine running on an interrupt
+            future.cancel()
+            raise
+
+
+class Lean4Client(SyncLoopMixin):
     """Client for interacting with the Lean 4 verification server.
 
     This client handles communication with a Lean 4 server for verifying proofs
     and retrieving results. It handles authentication, connection testing,
     and provides methods for synchronous and asynchronous verification.
+
+    All the requests share one HTTP session, so connections are kept alive
+    between requests. The synchronous methods run on a private event loop
+    reused across calls. Use the client as an async context manager, or call
+    `close()`, to release its connections.
+
+    Responses are requested gzip or zstd compressed, and once the server has
+    advertised the codings it accepts, large requests are compressed too.
+
+    A verification only sends again the codes which failed transiently: those
+    of a request lost on the way or refused by an overloaded server, and the
+    codes whose REPL crashed, each code with its own budget of retries per
+    failure class. A proof which timed out is not retried, it would time out
+    again.
     """
 
-    def __init__(self, base_url, api_key=None, disable_cache=False) -> None:
+    def __init__(
+        self,
+        base_url,
+        api_key=None,
+        disable_cache=False,
+        include_timing=False,
+        client_id=None,
+        priority=0,
+        test_connection=True,
+        connection_limit=100,
+        dns_cache_ttl=300,
+        compression=True,
+        retries=None,
+    ) -> None:
         """Initialize the Lean4Client.
 
         Args:
@@ -33,6 +137,19 @@ class Lean4Client(object):
             api_key (str, optional): API key for authentication. If None, will try
                 to load from LEANSERVER_API_KEY environment variable. Defaults to None.
             disable_cache (bool, optional): Whether to disable result and header caching. Defaults to False.
+            include_timing (bool, optional): Whether the server adds a latency breakdown to each result. Defaults to False.
+            client_id (str, optional): Tenant the server shares its capacity fairly with the other tenants by.
+                Defaults to None, in which case the server uses the API key or the client address.
+            priority (int, optional): Priority level of the requests, higher levels are served first. Defaults to 0.
+            test_connection (bool, optional): Whether to check that the server is available. Defaults to True.
+            connection_limit (int, optional): Maximum number of simultaneous connections to the server.
+                Defaults to 100.
+            dns_cache_ttl (int, optional): Seconds the resolved address of the server is cached for.
+                Defaults to 300.
+            compression (bool, optional): Whether to compress the request and response bodies.
+                Defaults to True.
+            retries (dict, optional): Retries of each code per failure class ("transport",
+                "overload" or "repl"), overriding `retry.DEFAULT_RETRIES`. Defaults to None.
 
         Raises:
             Exception: If the Lean server cannot be connected to or is unavailable.
@@ -43,8 +160,76 @@ class Lean4Client(object):
 
         self.api_key = api_key
         self.disable_cache = disable_cache
+        self.include_timing = include_timing
+        self.client_id = client_id
+        self.priority = priority
+        self.connection_limit = connection_limit
+        self.dns_cache_ttl = dns_cache_ttl
+        self.compression = compression
+        self.request_encoding = (
+            None  # Coding of the requests, once the server accepts one
+        )
+        self.wire_bytes = {"sent": 0, "received": 0}  # Body bytes on the wire
+        self.retries = retries
+        # Codes retried per failure class
+        self.retry_stats = {TRANSPORT: 0, OVERLOAD: 0, REPL_FAILURE: 0}
+        self._session = None  # HTTP session
+        self._session_loop = None  # Event loop the session is bound to
+        self._loop = None  # Event loop of the synchronous methods
+
+        if test_connection:
+            self._test_connection()
 
-        self._test_connection()
+    async def aclose(self):
+        """Close the HTTP session of the client."""
+        if self._session is not None:
+            # The session of another event loop can not be closed from this one
+            if self._session_loop is asyncio.get_running_loop():
+                await self._session.close()
+            self._session = None
+
+    def _get_session(self):
+        """Return the HTTP session of the running event loop, creating it if needed."""
+        loop = asyncio.get_running_loop()
+        if (
+            self._session is None
+            or self._session.closed
+            or self._session_loop is not loop
+        ):
+            # A session can not be used outside of its event loop
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.connection_limit,
+                    use_dns_cache=True,
+                    ttl_dns_cache=self.dns_cache_ttl,
+                ),
+                trust_env=True,
+                timeout=aiohttp.ClientTimeout(total=3600),
+                # The bodies are decoded by the client, zstd included
+                auto_decompress=False,
+            )
+            self._session_loop = loop
+        return self._session
+
+    def _encode_request(self, headers, json_data):
+        """Add the content negotiation headers, and return the encoded request body."""
+        headers["Accept-Encoding"] = (
+            ", ".join(ENCODINGS) if self.compression else "identity"
+        )
+        if json_data is None:
+            return None
+        body = json.dumps(json_data, ensure_ascii=False).encode()
+        if self.request_encoding is not None and len(body) >= MINIMUM_COMPRESSED_SIZE:
+            body = compress(body, self.request_encoding)
+            headers["Content-Encoding"] = self.request_encoding
+        self.wire_bytes["sent"] += len(body)
+        return body
+
+    def _decoder(self, response):
+        """Learn the request codings accepted by the server, and return the response decoder."""
+        if self.compression:
+            self.request_encoding = negotiate(response.headers.get("Accept-Encoding"))
+        return Decompressor(response.headers.get("Content-Encoding"))
 
     def verify(self, codes, timeout, infotree_type=None):
         """Synchronous wrapper for verifying proof codes.
@@ -63,7 +248,7 @@ class Lean4Client(object):
         Returns:
             dict: The response from the server with verification results.
         """
-        return asyncio.run(self.async_verify(codes, timeout, infotree_type))
+        return self._run(self.async_verify(codes, timeout, infotree_type))
 
     async def async_verify(self, codes, timeout, infotree_type=None):
         """verify the proof code and get result
@@ -87,14 +272,251 @@ class Lean4Client(object):
             >>> client.one_pass_verify("import Mathlib\n\nexample : 2 = 2 := rfl", timeout=60)
             {'results': [{'code': 'test_connection', 'error': None, 'response': {'env': 0}}]}
         """
-        json_data = {
+        policy = RetryPolicy(self.retries, stats=self.retry_stats)
+        results = [None] * len(codes)
+        pending = list(range(len(codes)))
+        attempt = 0
+        while pending:
+            if attempt > 0:
+                await asyncio.sleep(policy.delay(attempt))
+            attempt += 1
+            try:
+                response = await self._request(
+                    "post",
+                    "/verify",
+                    self._verify_body(
+                        [codes[idx] for idx in pending], timeout, infotree_type
+                    ),
+                )
+            except Exception as e:
+                kind = classify_exception(e)
+                if kind is None or not policy.retry_all(pending, kind):
+                    raise
+                logger.warning(
+                    f"Retrying {len(pending)} codes after a failure of class {kind}: {e!r}"
+                )
+                continue
+            if "results" not in response:
+                # An error reported by the server, e.g. a rejected API key
+                if attempt == 1:
+                    return response
+                # Keep the results of the previous rounds, the retried codes get the error
+                error = str(response.get("detail", response))
+                for idx in pending:
+                    results[idx] = {
+                        "custom_id": codes[idx].get("custom_id"),
+                        "error": error,
+                        "response": None,
+                    }
+                break
+
+            failed = []
+            for idx, result in zip(pending, response["results"]):
+                results[idx] = result
+                if classify_result(result) == REPL_FAILURE and policy.retry(
+                    idx, REPL_FAILURE
+                ):
+                    failed.append(idx)
+            if failed:
+                logger.warning(f"Retrying {len(failed)} codes whose REPL failed")
+            pending = failed
+
+        return {"results": results}
+
+    async def async_verify_stream(self, codes, timeout, infotree_type=None):
+        """verify the proof code, yielding each result as soon as the server completes it
+
+        Args:
+            codes (list): The list of lean 4 code to verify.
+                Each code is a dict of:
+                    - code: The lean 4 code to verify.
+                    - custom_id: The custom id of the proof.
+            timeout (int): The timeout in seconds.
+            infotree_type (str, optional): Type of info tree to use. Defaults to None.
+
+        Yields:
+            result (dict): A dictionary with the keys custom_id, error and response,
+                in completion order rather than in the order of `codes`.
+
+        Example:
+            >>> async for result in client.async_verify_stream(codes, timeout=60):
+            ...     print(result["custom_id"], result["error"])
+        """
+        policy = RetryPolicy(self.retries, stats=self.retry_stats)
+        pending = {code["custom_id"]: code for code in codes}
+        attempt = 0
+        while pending:
+            if attempt > 0:
+                await asyncio.sleep(policy.delay(attempt))
+            attempt += 1
+            failed = []
+            try:
+                async for result in self._stream_verify(
+                    list(pending.values()), timeout, infotree_type
+                ):
+                    code = pending.pop(result["custom_id"], None)
+                    if code is None:
+                        continue
+                    if classify_result(result) == REPL_FAILURE and policy.retry(
+                        result["custom_id"], REPL_FAILURE
+                    ):
+                        failed.append(code)
+                    else:
+                        yield result
+                if pending:
+                    raise aiohttp.ClientPayloadError(
+                        f"The stream ended with {len(pending)} codes unanswered"
+                    )
+            except Exception as e:
+                kind = classify_exception(e)
+                if kind is None or not policy.retry_all(pending, kind):
+                    raise
+                logger.warning(
+                    f"Retrying {len(pending)} codes after a failure of class {kind}: {e!r}"
+                )
+            if failed:
+                logger.warning(f"Retrying {len(failed)} codes whose REPL failed")
+                pending.update((code["custom_id"], code) for code in failed)
+
+    async def _stream_verify(self, codes, timeout, infotree_type=None):
+        """Send the codes to `/verify/stream` once, yielding the results as they arrive."""
+        json_data = self._verify_body(codes, timeout, infotree_type)
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/x-ndjson",
+            "Authorization": f"Bearer {self.api_key}",
+        }
+        if self.client_id is not None:
+            headers["X-Client-Id"] = self.client_id
+
+        body = self._encode_request(headers, json_data)
+        async with self._get_session().post(
+            self._ensure_url_has_scheme(str(urljoin(self.url, "/verify/stream"))),
+            headers=headers,
+            data=body,
+        ) as response:
+            response.raise_for_status()
+            decoder = self._decoder(response)
+
+            # Split the NDJSON stream manually, infotree lines can exceed aiohttp's line limit
+            buffer = bytearray()
+            search_start = 0
+            async for chunk in response.content.iter_any():
+                self.wire_bytes["received"] += len(chunk)
+                buffer.extend(decoder.decompress(chunk))
+                while (end := buffer.find(b"\n", search_start)) != -1:
+                    line = bytes(buffer[:end])
+                    del buffer[: end + 1]
+                    search_start = 0
+                    if line.strip():
+                        yield json.loads(line)
+                search_start = len(buffer)
+            if buffer.strip():
+                yield json.loads(bytes(buffer))
+
+    def _verify_body(self, codes, timeout, infotree_type=None):
+        return {
             "codes": codes,
             "timeout": timeout,
             "infotree_type": infotree_type,
             "disable_cache": self.disable_cache,
+            "include_timing": self.include_timing,
+            "priority": self.priority,
         }
-        response = await self._query("post", "/verify", json_data)
-        return response
+
+    async def async_queue_depth(self):
+        """Get the verifications waiting for and holding a slot of the server.
+
+        Returns:
+            tuple: (waiting, active), or None if the server does not report them.
+        """
+        try:
+            status = await self._query("get", "/status", n_retries=1)
+        except Exception:
+            return None
+        scheduler = status.get("scheduler")
+        if not scheduler:
+            return None
+        return scheduler["waiting"], scheduler["active"]
+
+    async def async_submit_job(self, codes, timeout, infotree_type=None):
+        """Submit the codes as a job which the server verifies in the background
+
+        The job is stored on the server and survives its restarts, so very large
+        runs do not need a connection held open until they complete.
+
+        Args:
+            codes (list): The list of lean 4 code to verify, as for `async_verify`.
+            timeout (int): The timeout in seconds.
+            infotree_type (str, optional): Type of info tree to use. Defaults to None.
+
+        Returns:
+            job_id (str): The id to poll the job with.
+        """
+        json_data = self._verify_body(codes, timeout, infotree_type)
+        response = await self._query("post", "/jobs", json_data)
+        return response["job_id"]
+
+    async def async_job_status(self, job_id):
+        """Get the status (submitting, queued, running, completed or failed) and the progress of a job."""
+        return await self._query("get", f"/jobs/{job_id}")
+
+    async def async_job_results(self, job_id, offset=0, limit=1000):
+        """Get a page of the results of a job in code order, None for the pending codes."""
+        return await self._query(
+            "get", f"/jobs/{job_id}/results?offset={offset}&limit={limit}"
+        )
+
+    async def async_retry_job(self, job_id):
+        """Resume a failed job from its stored results, and return its status."""
+        return await self._query("post", f"/jobs/{job_id}/retry")
+
+    async def async_wait_job(
+        self, job_id, poll_interval=10, page_size=1000, max_retries=3
+    ):
+        """Wait for a job to complete, and return all its results in code order.
+
+        A failed job is resumed up to `max_retries` times before giving up.
+        """
+        retries = 0
+        while True:
+            status = await self.async_job_status(job_id)
+            if status["status"] == "completed":
+                break
+            if status["status"] == "failed":
+                if retries >= max_retries:
+                    raise RuntimeError(
+                        f"Job {job_id} failed {retries + 1} times, resume it with `async_retry_job`"
+                    )
+                retries += 1
+                logger.warning(
+                    f"Job {job_id} failed, retrying ({retries}/{max_retries})"
+                )
+                await self.async_retry_job(job_id)
+                continue
+            logger.info(f"Job {job_id}: {status['done']} / {status['total']} verified")
+            await asyncio.sleep(poll_interval)
+
+        results = []
+        offset = 0
+        while offset is not None:
+            page = await self.async_job_results(job_id, offset, page_size)
+            results.extend(page["results"])
+            offset = page["next_offset"]
+        return results
+
+    def verify_job(self, codes, timeout, infotree_type=None, poll_interval=10):
+        """Synchronous wrapper submitting a job and waiting for its results.
+
+        Returns:
+            list: The results of the codes, in the order of `codes`.
+        """
+
+        async def run():
+            job_id = await self.async_submit_job(codes, timeout, infotree_type)
+            return await self.async_wait_job(job_id, poll_interval)
+
+        return self._run(run())
 
     async def _query(
         self,
@@ -122,34 +544,46 @@ class Lean4Client(object):
                 n_retries
             ),  # Dynamic retries based on the caller's argument
             wait=wait_exponential(multiplier=1, min=1, max=10),  # Exponential backoff
+            retry=retry_if_exception(is_transient),  # Other failures are final
             before_sleep=before_sleep_log(
                 logger, logging.ERROR
             ),  # Optional logging of each retry
         )
-        async def query_with_retries(url):
-            headers = {
-                "Content-Type": "application/json",
-                "Accept": "application/json",
-                "Authorization": f"Bearer {self.api_key}",
-            }
-
-            # Create a session with trust_env set to True
-            async with aiohttp.ClientSession(
-                trust_env=True, timeout=aiohttp.ClientTimeout(total=3600)
-            ) as session:
-                async with session.request(
-                    method,
-                    self._ensure_url_has_scheme(str(urljoin(url, endpoint))),
-                    headers=headers,
-                    json=json_data,  # Directly send the JSON data
-                ) as response:
-                    # Get the response body asynchronously and parse it as JSON
-                    res = await response.json()
-
-            return res
+        async def query_with_retries():
+            return await self._request(method, endpoint, json_data)
 
         # Call the query function with retries
-        return await query_with_retries(self.url)
+        return await query_with_retries()
+
+    async def _request(self, method, endpoint, json_data=None):
+        """Send a request once, and return its parsed JSON response.
+
+        Raises:
+            aiohttp.ClientResponseError: If the server answered with a 5xx status, or was
+                too busy to answer.
+        """
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+            "Authorization": f"Bearer {self.api_key}",
+        }
+        if self.client_id is not None:
+            headers["X-Client-Id"] = self.client_id
+
+        body = self._encode_request(headers, json_data)
+        # Reuse the kept-alive connections of the client session
+        async with self._get_session().request(
+            method,
+            self._ensure_url_has_scheme(str(urljoin(self.url, endpoint))),
+            headers=headers,
+            data=body,
+        ) as response:
+            # Get the response body asynchronously, decode it and parse it as JSON
+            content = await response.read()
+            self.wire_bytes["received"] += len(content)
+            if response.status >= 500 or response.status in OVERLOAD_STATUSES:
+                response.raise_for_status()
+            return json.loads(self._decoder(response).decompress(content))
 
     def _ensure_url_has_scheme(self, url, default_scheme="http"):
         """Ensure URL has a scheme (http/https) prefix.
@@ -179,7 +613,7 @@ class Lean4Client(object):
             bool: True if connection test passed.
         """
         try:
-            response = asyncio.run(self._query("get", "/"))
+            response = self._run(self._query("get", "/"))
         except RetryError:
             raise Exception(f"The lean server {self.url} cannot be connected.")
 
@@ -189,7 +623,15 @@ class Lean4Client(object):
             )
 
 
-async def process_batch(batch, client: Lean4Client, timeout, infotree_type, semaphore):
+async def process_batch(
+    batch,
+    client: Lean4Client,
+    timeout,
+    infotree_type,
+    semaphore,
+    stream=False,
+    on_result: Callable[[dict], None] | None = None,
+):
     """Process a single batch of proofs with the Lean4 client.
 
     Args:
@@ -198,14 +640,31 @@ async def process_batch(batch, client: Lean4Client, timeout, infotree_type, sema
         timeout (int): Timeout in seconds for verification.
         infotree_type (str, optional): Type of info tree to use.
         semaphore (asyncio.Semaphore): Semaphore to limit concurrent executions.
+        stream (bool, optional): Whether to receive the results as soon as each one
+            completes. Defaults to False.
+        on_result (Callable, optional): Called with each result as soon as it is received.
+            Defaults to None.
 
     Returns:
         dict: The verification response from the Lean4 client.
     """
     async with semaphore:
+        if stream:
+            results = []
+            async for result in client.async_verify_stream(
+                batch, timeout=timeout, infotree_type=infotree_type
+            ):
+                results.append(result)
+                if on_result is not None:
+                    on_result(result)
+            return {"results": results}
+
         response = await client.async_verify(
             batch, timeout=timeout, infotree_type=infotree_type
         )
+        if on_result is not None:
+            for result in response["results"]:
+                on_result(result)
         return response
 
 
@@ -215,6 +674,8 @@ async def process_batches(
     timeout=60,
     num_proc=os.cpu_count(),
     infotree_type=None,
+    stream=False,
+    on_result: Callable[[dict], None] | None = None,
 ):
     """Process multiple batches of proofs concurrently.
 
@@ -224,6 +685,9 @@ async def process_batches(
         timeout (int, optional): Timeout in seconds for each batch. Defaults to 60.
         num_proc (int, optional): Maximum number of concurrent processes. Defaults to CPU count.
         infotree_type (str, optional): Type of info tree to use. Defaults to None.
+        stream (bool, optional): Whether to stream the results of each batch. Defaults to False.
+        on_result (Callable, optional): Called with each result as soon as it is received.
+            Defaults to None.
 
     Returns:
         List[dict]: Combined results from all batches.
@@ -233,7 +697,9 @@ async def process_batches(
     results = []
 
     coros = [
-        process_batch(batche, client, timeout, infotree_type, semaphore)
+        process_batch(
+            batche, client, timeout, infotree_type, semaphore, stream, on_result
+        )
         for batche in batches
     ]
 
@@ -246,6 +712,156 @@ async def process_batches(
     return results
 
 
+async def process_batches_adaptive(
+    client,
+    samples: List[dict],
+    timeout=60,
+    max_batch_size=128,
+    max_concurrency=os.cpu_count(),
+    infotree_type=None,
+    stream=False,
+    on_result: Callable[[dict], None] | None = None,
+    status_interval=5,
+    max_failures=3,
+):
+    """Process the samples in batches sized by an `AIMDController`.
+
+    The batch size and the number of concurrent batches grow while the server
+    keeps up, and are halved as soon as it shows congestion: failed requests,
+    batches slower than `timeout`, requests refused by an overloaded server, or
+    a deep queue in its `/status`. A failed batch is sent again, minus the results
+    already received.
+
+    Args:
+        client (Lean4Client): The Lean4 client instance.
+        samples (List[dict]): The samples to verify.
+        timeout (int, optional): Timeout in seconds for each proof. Defaults to 60.
+        max_batch_size (int, optional): Largest batch size. Defaults to 128.
+        max_concurrency (int, optional): Largest number of concurrent batches. Defaults to CPU count.
+        infotree_type (str, optional): Type of info tree to use. Defaults to None.
+        stream (bool, optional): Whether to stream the results of each batch. Defaults to False.
+        on_result (Callable, optional): Called with each result as soon as it is received.
+            Defaults to None.
+        status_interval (float, optional): Seconds between two polls of the server queue.
+            Defaults to 5.
+        max_failures (int, optional): Number of consecutive failed requests after which
+            the verification is aborted. Defaults to 3.
+
+    Returns:
+        List[dict]: Combined results from all batches.
+    """
+    controller = AIMDController(
+        max_batch_size, max_concurrency, timeout, status_interval=status_interval
+    )
+    pending = deque(samples)
+    # Batch of each running task, its start time and the overloads before it
+    running: dict[asyncio.Task, tuple[List[dict], float, int]] = {}
+    results = {}
+    failures = 0  # Consecutive failed requests
+    last_status = float("-inf")
+
+    def receive(result):
+        if result["custom_id"] in results:
+            return
+        results[result["custom_id"]] = result
+        progress.update(1)
+        if on_result is not None:
+            on_result(result)
+
+    progress = tqdm_asyncio(total=len(samples), desc="Verifying proofs")
+    try:
+        while pending or running:
+            if time.monotonic() - last_status > status_interval:
+                last_status = time.monotonic()
+                queue_depth = await client.async_queue_depth()
+                if queue_depth is not None:
+                    controller.on_queue(*queue_depth)
+
+            while pending and len(running) < controller.max_in_flight():
+                size = min(controller.next_batch_size(), len(pending))
+                batch = [pending.popleft() for _ in range(size)]
+                task = asyncio.create_task(
+                    process_batch(
+                        batch,
+                        client,
+                        timeout,
+                        infotree_type,
+                        nullcontext(),
+                        stream,
+                        receive,
+                    )
+                )
+                running[task] = batch, time.monotonic(), client.retry_stats[OVERLOAD]
+
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                batch, started, overloads = running.pop(task)
+                latency = time.monotonic() - started
+                # Requests refused by an overloaded server were resent meanwhile
+                overloaded = client.retry_stats[OVERLOAD] > overloads
+                try:
+                    response = task.result()
+                except Exception as e:
+                    failures += 1
+                    if failures >= max_failures:
+                        raise
+                    logger.error(f"Batch of {len(batch)} samples failed, retrying: {e}")
+                    controller.on_batch(started, latency, failed=True)
+                    pending.extendleft(
+                        reversed(
+                            [
+                                sample
+                                for sample in batch
+                                if sample["custom_id"] not in results
+                            ]
+                        )
+                    )
+                    continue
+                failures = 0
+                controller.on_batch(started, latency, overloaded=overloaded)
+    finally:
+        progress.close()
+        for task in running:
+            task.cancel()
+
+    logger.info(
+        f"Final batch size {controller.next_batch_size()}, "
+        f"concurrency {controller.max_in_flight()}, {controller.stats}"
+    )
+    return list(results.values())
+
+
+def canonicalize_proof(proof, strip_comments=False):
+    """Canonical form of a proof, shared by the copies which verify the same way.
+
+    Trailing whitespace is dropped, which keeps the line numbers of the messages.
+    Comments are only dropped with `strip_comments`, as the messages of the
+    canonical proof may then point to other positions than in each copy.
+    """
+    if strip_comments:
+        proof = remove_lean_comments(proof)
+    return "\n".join(line.rstrip() for line in proof.splitlines()).rstrip()
+
+
+def deduplicate_samples(samples: List[dict], strip_comments=False):
+    """Keep the first sample of each canonical proof.
+
+    Returns:
+        tuple: (unique samples, custom ids of the copies of each unique custom id)
+    """
+    unique: dict[str, dict] = {}  # First sample of each canonical proof
+    copies: dict[str, List[str]] = {}
+    for sample in samples:
+        proof = sample.get("proof", sample.get("code")) or ""
+        key = canonicalize_proof(proof, strip_comments)
+        if key in unique:
+            copies[unique[key]["custom_id"]].append(sample["custom_id"])
+        else:
+            unique[key] = sample
+            copies[sample["custom_id"]] = []
+    return list(unique.values()), copies
+
+
 def batch_verify_proof(
     client,
     samples: List[dict],
@@ -253,6 +869,12 @@ def batch_verify_proof(
     num_proc=os.cpu_count(),
     batch_size=8,
     infotree_type=None,
+    stream=False,
+    on_result: Callable[[dict], None] | None = None,
+    dedup=True,
+    strip_comments=False,
+    adaptive=False,
+    checkpoint: str | None = None,
 ):
     """Verify multiple proofs in batches using the Lean4 server.
 
@@ -266,6 +888,20 @@ def batch_verify_proof(
         num_proc (int, optional): Number of concurrent processes. Defaults to CPU count.
         batch_size (int, optional): Number of samples in each batch. Defaults to 8.
         infotree_type (str, optional): Type of info tree to use. Defaults to None.
+        stream (bool, optional): Whether to stream the results of each batch, so that a
+            slow proof does not hold back the rest of its batch. Defaults to False.
+        on_result (Callable, optional): Called with each result as soon as it is received,
+            to consume the results incrementally. Defaults to None.
+        dedup (bool, optional): Whether to verify the copies of a proof once, and give its
+            result to all of them. Defaults to True.
+        strip_comments (bool, optional): Whether proofs which only differ by their comments
+            are copies of each other. Defaults to False.
+        adaptive (bool, optional): Whether to adapt the batch size and the concurrency to the
+            load of the server, up to `batch_size` and `num_proc`. Defaults to False.
+        checkpoint (str, optional): JSONL file each result is appended to as soon as it is
+            received. The samples whose custom_id is already in the file are not verified
+            again, their checkpointed results are returned and passed to `on_result`.
+            The results of crashed REPLs are not checkpointed. Defaults to None.
 
     Returns:
         List[dict]: List of verification results. Each result contains:
@@ -279,24 +915,172 @@ def batch_verify_proof(
     Note:
         Each sample in the input list must have both 'custom_id' and 'proof' keys.
         The 'custom_id' values must be unique across all samples.
+        Results are returned in the order of the samples, whatever the order they completed in.
     """
     custom_ids = [sample["custom_id"] for sample in samples]
     assert len(custom_ids) == len(set(custom_ids)), "Custom id must be unique"
 
+    store = None
+    if checkpoint is not None:
+        store = ResultCheckpoint(checkpoint)
+        restored = [
+            store.results[custom_id] for custom_id in custom_ids if custom_id in store
+        ]
+        samples = [sample for sample in samples if sample["custom_id"] not in store]
+        logger.info(
+            f"Resuming from {len(restored)} checkpointed results, {len(samples)} samples left"
+        )
+        if on_result is not None:
+            for result in restored:
+                on_result(result)
+
+    copies = {}
+    if dedup:
+        n_samples = len(samples)
+        samples, copies = deduplicate_samples(samples, strip_comments)
+        logger.info(
+            f"Deduplicated {n_samples} samples to {len(samples)} unique proofs "
+            f"(dedup ratio {1 - len(samples) / max(n_samples, 1):.1%})"
+        )
+
+    def fan_out(result):
+        """The result of a unique proof, followed by the results of its copies."""
+        yield result
+        for custom_id in copies.get(result["custom_id"], []):
+            yield {**result, "custom_id": custom_id}
+
+    def on_unique_result(result):
+        for copy in fan_out(result):
+            if store is not None:
+                store.append(copy)
+            if on_result is not None:
+                on_result(copy)
+
     logger.info(
         f"Processing {len(samples)} samples in {len(samples)/batch_size} batches of size {batch_size}"
     )
 
-    batches = [samples[i : i + batch_size] for i in range(0, len(samples), batch_size)]
-
-    results = asyncio.run(
-        process_batches(
-            client,
-            batches,
-            timeout=timeout,
-            num_proc=num_proc,
-            infotree_type=infotree_type,
-        )
+    callback = (
+        on_unique_result if on_result is not None or store is not None else None
     )
 
+    try:
+        if adaptive:
+            results = client._run(
+                process_batches_adaptive(
+                    client,
+                    samples,
+                    timeout=timeout,
+                    max_batch_size=batch_size,
+                    max_concurrency=num_proc,
+                    infotree_type=infotree_type,
+                    stream=stream,
+                    on_result=callback,
+                )
+            )
+        else:
+            batches = [
+                samples[i : i + batch_size] for i in range(0, len(samples), batch_size)
+            ]
+            results = client._run(
+                process_batches(
+                    client,
+                    batches,
+                    timeout=timeout,
+                    num_proc=num_proc,
+                    infotree_type=infotree_type,
+                    stream=stream,
+                    on_result=callback,
+                )
+            )
+    finally:
+        if store is not None:
+            store.close()
+
+    if copies:
+        results = [copy for result in results for copy in fan_out(result)]
+    if store is not None:
+        results = restored + results
+    order = {custom_id: i for i, custom_id in enumerate(custom_ids)}
+    results.sort(key=lambda result: order[result["custom_id"]])
     return results
+
+
+def batch_verify_early_stop(
+    client,
+    problems: List[List[dict]],
+    passes=1,
+    wave_size=4,
+    is_passed: Callable[[dict], bool] | None = None,
+    **kwargs,
+):
+    """Verify the candidate proofs of each problem until enough of them pass.
+
+    The candidates are verified in waves: every problem still short of `passes`
+    passing proofs sends its next `wave_size` candidates, and the wave size
+    doubles after each wave. The candidates of a problem left once it has
+    enough passes are skipped, so pass@k only costs the verifications up to
+    its first passing proofs.
+
+    Args:
+        client (Lean4Client): The Lean4 client instance to use for verification.
+        problems (List[List[dict]]): The candidate samples of each problem, in the
+            order to try them. Custom ids must be unique across all the problems.
+        passes (int, optional): Passing proofs after which a problem stops. Defaults to 1.
+        wave_size (int, optional): Candidates per problem in the first wave. Defaults to 4.
+        is_passed (Callable, optional): Whether a result is a passing proof. Defaults to
+            a valid proof without `sorry`.
+        **kwargs: Passed to `batch_verify_proof` for each wave.
+
+    Returns:
+        tuple[List[dict], dict]: The results of the verified candidates, the skipped
+            ones have none, and the statistics of the run:
+            - candidates: Number of candidate proofs.
+            - verified: Number of candidates verified.
+            - skipped: Number of candidates skipped.
+            - saved_ratio: Share of the candidates skipped.
+            - waves: Number of waves.
+    """
+    if is_passed is None:
+        is_passed = lambda result: parse_client_response(result)["is_valid_no_sorry"]
+
+    n_passed = [0] * len(problems)
+    tried = [0] * len(problems)  # Candidates sent per problem
+    results = []
+    waves = 0
+    while True:
+        wave = []
+        owner = {}
+        for i, candidates in enumerate(problems):
+            if n_passed[i] >= passes:
+                continue
+            for sample in candidates[tried[i] : tried[i] + wave_size]:
+                wave.append(sample)
+                owner[sample["custom_id"]] = i
+            tried[i] = min(tried[i] + wave_size, len(candidates))
+        if not wave:
+            break
+
+        waves += 1
+        logger.info(
+            f"Wave {waves}: verifying {len(wave)} candidates of {len(set(owner.values()))} problems"
+        )
+        for result in batch_verify_proof(client, wave, **kwargs):
+            results.append(result)
+            if is_passed(result):
+                n_passed[owner[result["custom_id"]]] += 1
+        wave_size *= 2
+
+    n_candidates = sum(len(candidates) for candidates in problems)
+    stats = {
+        "candidates": n_candidates,
+        "verified": len(results),
+        "skipped": n_candidates - len(results),
+        "saved_ratio": (n_candidates - len(results)) / max(n_candidates, 1),
+        "waves": waves,
+    }
+    logger.info(
+        f"Verified {stats['verified']} of {n_candidates} candidates in {waves} waves, "
+        f"skipped {stats['skipped']} ({stats['saved_ratio']:.1%} of the work saved)"
+    )
+    return results, stats
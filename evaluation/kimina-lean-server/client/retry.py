@@ -0,0 +1,101 @@
+import asyncio
+import random
+
+import aiohttp
+
+from utils.proof_utils import has_error_response
+
+# Failure classes of a verification
+TRANSPORT = "transport"  # The request failed on the way, no result was received
+OVERLOAD = "overload"  # The server, or its proxy, was too busy to answer
+REPL_FAILURE = "repl"  # The REPL running the proof crashed
+LEAN_ERROR = "lean"  # Lean rejected the proof, which no retry can change
+
+# Error of a proof which ran out of time
+TIMEOUT_ERROR = "Lean process timed out"
+
+# HTTP statuses of a server too busy to answer
+OVERLOAD_STATUSES = {429, 502, 503, 504}
+
+# Retries of each code per transient failure class
+DEFAULT_RETRIES = {TRANSPORT: 3, OVERLOAD: 5, REPL_FAILURE: 1}
+
+
+def classify_exception(error):
+    """Failure class of a request which raised `error`, or None if retrying it can not help."""
+    if isinstance(error, aiohttp.ClientResponseError):
+        if error.status in OVERLOAD_STATUSES:
+            return OVERLOAD
+        return TRANSPORT if error.status >= 500 else None
+    if isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError)):
+        return TRANSPORT
+    return None
+
+
+def classify_result(result):
+    """Failure class of a verification result, or None if the proof is valid.
+
+    The server reports the REPLs which timed out or crashed with an error
+    starting with "Lean process". A timeout is an outcome of the proof, which
+    would time out again, so like any other error it is final.
+    """
+    error = result.get("error")
+    if (
+        isinstance(error, str)
+        and error.startswith("Lean process")
+        and error != TIMEOUT_ERROR
+    ):
+        return REPL_FAILURE
+    if error or has_error_response(result.get("response") or {}):
+        return LEAN_ERROR
+    return None
+
+
+def is_transient(error):
+    """Whether a request which raised `error` may succeed on a retry."""
+    return classify_exception(error) is not None
+
+
+class RetryPolicy:
+    """
+    Retry budget of each code per failure class, with exponential backoff
+    between the rounds of retries.
+
+    Only the codes which failed transiently are retried, each one with its
+    own budget, so a code failing again and again does not hold back the
+    others, and the codes which completed are never sent again.
+    """
+
+    def __init__(self, retries=None, backoff=1, max_backoff=10, stats=None):
+        self.retries = {**DEFAULT_RETRIES, **(retries or {})}
+        self.backoff = backoff  # Seconds before the first round of retries
+        self.max_backoff = max_backoff
+        self.used = {}  # Retries used per code and class
+        self.stats = (
+            stats if stats is not None else {TRANSPORT: 0, OVERLOAD: 0, REPL_FAILURE: 0}
+        )
+
+    def retry(self, key, kind):
+        """Spend a retry of the code `key` for a failure of class `kind`, if any is left."""
+        used = self.used.setdefault(key, {})
+        if used.get(kind, 0) >= self.retries.get(kind, 0):
+            return False
+        used[kind] = used.get(kind, 0) + 1
+        self.stats[kind] += 1
+        return True
+
+    def retry_all(self, keys, kind):
+        """Spend a retry of each code for a failed request, if every code has one left."""
+        if any(
+            self.used.get(key, {}).get(kind, 0) >= self.retries.get(kind, 0)
+            for key in keys
+        ):
+            return False
+        for key in keys:
+            self.retry(key, kind)
+        return True
+
+    def delay(self, attempt):
+        """Seconds to wait before the `attempt`-th round of retries, with jitter."""
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        return random.uniform(delay / 2, delay)
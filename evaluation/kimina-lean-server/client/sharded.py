@@ -0,0 +1,316 @@
+import asyncio
+import bisect
+import hashlib
+import math
+import time
+
+from loguru import logger
+
+from utils.proof_utils import split_proof_header
+
+from .client import Lean4Client, SyncLoopMixin
+from .retry import OVERLOAD, REPL_FAILURE, TRANSPORT, classify_exception
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring of endpoints, with virtual nodes to even out the shares."""
+
+    def __init__(self, endpoints, replicas=100):
+        self.ring = sorted(
+            (_hash(f"{endpoint}#{i}"), endpoint)
+            for endpoint in endpoints
+            for i in range(replicas)
+        )
+        self.hashes = [h for h, _ in self.ring]
+        self.n_endpoints = len(set(endpoints))
+
+    def preference(self, key):
+        """Return the distinct endpoints in ring order, starting from the owner of `key`."""
+        start = bisect.bisect(self.hashes, _hash(key))
+        endpoints = []
+        for i in range(len(self.ring)):
+            endpoint = self.ring[(start + i) % len(self.ring)][1]
+            if endpoint not in endpoints:
+                endpoints.append(endpoint)
+                if len(endpoints) == self.n_endpoints:
+                    break
+        return endpoints
+
+
+class ShardedLean4Client(SyncLoopMixin):
+    """Client spreading the verifications over several Lean servers.
+
+    Each code is routed by consistent hashing on its import header, so every
+    server keeps warm REPLs for its own set of headers. An endpoint failing
+    its `/health` check or a request is skipped until it recovers, and an
+    endpoint loaded far above the average (codes in flight plus its server
+    side queue) hands its codes to the next endpoint of the ring.
+
+    It has the same verification methods as `Lean4Client`, so that it can
+    be passed to `batch_verify_proof` unchanged, and closes the sessions of
+    all its endpoints the same way.
+    """
+
+    def __init__(
+        self,
+        base_urls,
+        api_key=None,
+        disable_cache=False,
+        include_timing=False,
+        client_id=None,
+        priority=0,
+        replicas=100,
+        load_factor=1.25,
+        health_interval=30,
+        retries=None,
+    ) -> None:
+        """Initialize the ShardedLean4Client.
+
+        Args:
+            base_urls (list[str]): Base URLs of the Lean 4 servers.
+            api_key, disable_cache, include_timing, client_id, priority: As for `Lean4Client`.
+            replicas (int, optional): Virtual nodes per endpoint on the hash ring. Defaults to 100.
+            load_factor (float, optional): Load above which an endpoint, relative to the
+                average load, hands its codes to the next one. Defaults to 1.25.
+            health_interval (float, optional): Seconds between two health checks of the
+                endpoints. Defaults to 30.
+            retries (dict, optional): Retries of each code whose REPL failed, as for
+                `Lean4Client`. A failed request is sent to the next endpoint instead of
+                being retried. Defaults to None.
+
+        Raises:
+            Exception: If none of the Lean servers can be connected to.
+        """
+        self.clients = {
+            url: Lean4Client(
+                url,
+                api_key,
+                disable_cache,
+                include_timing,
+                client_id,
+                priority,
+                test_connection=False,
+                # A failed request is rerouted rather than retried on the same endpoint
+                retries={**(retries or {}), TRANSPORT: 0, OVERLOAD: 0},
+            )
+            for url in base_urls
+        }
+        self.healthy: set[str] = set()  # Endpoints codes are routed to
+        self.ring = HashRing(base_urls, replicas)
+        self.load_factor = load_factor
+        self.health_interval = health_interval
+        self.last_health_check = 0.0
+        self.in_flight = {url: 0 for url in base_urls}  # Codes sent and not answered
+        self.queue_depth = {url: 0 for url in base_urls}  # Server side waiting codes
+        # Rerouted codes per failure class of their endpoint
+        self.retry_stats = {TRANSPORT: 0, OVERLOAD: 0, REPL_FAILURE: 0}
+        self._loop = None  # Event loop of the synchronous methods
+
+        self._run(self.check_health())
+        if not self.healthy:
+            raise Exception(f"None of the lean servers {base_urls} can be connected.")
+
+    def verify(self, codes, timeout, infotree_type=None):
+        """Synchronous wrapper for verifying proof codes, see `Lean4Client.verify`."""
+        return self._run(self.async_verify(codes, timeout, infotree_type))
+
+    async def aclose(self):
+        """Close the HTTP sessions of the endpoints."""
+        # The endpoint clients are only used from the loop of the sharded client
+        await asyncio.gather(*(client.aclose() for client in self.clients.values()))
+
+    async def check_health(self):
+        """Probe the `/health` and the queue depth of every endpoint."""
+
+        async def check(url):
+            client = self.clients[url]
+            try:
+                health = await client._query("get", "/health", n_retries=1)
+                status = await client._query("get", "/status", n_retries=1)
+            except Exception as e:
+                health = {"detail": str(e)}
+                status = {}
+            if health.get("status") == "healthy":
+                if url not in self.healthy:
+                    logger.info(f"Lean server {url} is back")
+                self.healthy.add(url)
+                self.queue_depth[url] = status.get("scheduler", {}).get("waiting", 0)
+            elif url in self.healthy:
+                logger.error(f"Lean server {url} failed its health check: {health}")
+                self.healthy.discard(url)
+
+        self.last_health_check = time.monotonic()
+        await asyncio.gather(*(check(url) for url in self.clients))
+
+    async def _refresh_health(self):
+        if time.monotonic() - self.last_health_check > self.health_interval:
+            await self.check_health()
+        if not self.healthy:
+            # Give every endpoint another chance before giving up
+            await self.check_health()
+            if not self.healthy:
+                raise Exception("None of the lean servers is available.")
+
+    async def async_queue_depth(self):
+        """Get the verifications waiting for and holding a slot, summed over the healthy endpoints."""
+        depths = await asyncio.gather(
+            *(self.clients[url].async_queue_depth() for url in self.healthy)
+        )
+        depths = [depth for depth in depths if depth is not None]
+        if not depths:
+            return None
+        return sum(waiting for waiting, _ in depths), sum(
+            active for _, active in depths
+        )
+
+    def _load(self, url):
+        return self.in_flight[url] + self.queue_depth[url]
+
+    def route(self, code, exclude=()):
+        """Pick the endpoint of a code, or None if every endpoint is excluded."""
+        proof = code.get("proof", code.get("code")) or ""
+        header, _ = split_proof_header(proof)
+        candidates = [
+            url
+            for url in self.ring.preference(header)
+            if url in self.healthy and url not in exclude
+        ]
+        if not candidates:
+            return None
+
+        # Consistent hashing with bounded loads
+        average = sum(self._load(url) for url in candidates) / len(candidates)
+        bound = math.ceil(self.load_factor * (average + 1))
+        for url in candidates:
+            if self._load(url) < bound:
+                return url
+        return candidates[0]
+
+    def _shard(self, indices, codes, exclude=()):
+        """Group the `(index, code)` of the codes at `indices` by endpoint, reserving their load."""
+        shards = {}
+        for index in indices:
+            url = self.route(codes[index], exclude)
+            if url is None:
+                for url, shard in shards.items():
+                    self.in_flight[url] -= len(shard)
+                raise Exception("None of the lean servers is available.")
+            shards.setdefault(url, []).append((index, codes[index]))
+            self.in_flight[url] += 1
+        return shards
+
+    async def _refresh_queue_depth(self, url):
+        """Update the server side queue of an endpoint after a batch, keeping the last one if it is unknown."""
+        if url not in self.healthy:
+            return
+        try:
+            depth = await self.clients[url].async_queue_depth()
+        except Exception:
+            return
+        if depth is not None:
+            self.queue_depth[url] = depth[0]
+
+    def _fail(self, url, error, n_codes):
+        logger.error(f"Lean server {url} failed, rerouting its codes: {error}")
+        self.healthy.discard(url)
+        kind = classify_exception(error)
+        if kind is not None:
+            self.retry_stats[kind] += n_codes
+
+    async def async_verify(self, codes, timeout, infotree_type=None):
+        """verify the proof codes on their endpoints, see `Lean4Client.async_verify`.
+
+        Returns:
+            dict: {"results": [...]} in the order of `codes`.
+        """
+        await self._refresh_health()
+        results = {}  # Results by index in `codes`
+        failed = set()
+
+        async def run(url, shard):
+            indices = [index for index, _ in shard]
+            try:
+                response = await self.clients[url].async_verify(
+                    [code for _, code in shard], timeout, infotree_type
+                )
+                if len(response.get("results", [])) != len(shard):
+                    raise Exception(f"Unexpected response {str(response)[:200]}")
+                for index, result in zip(indices, response["results"]):
+                    results[index] = result
+            except Exception as e:
+                self._fail(url, e, len(shard))
+                failed.add(url)
+            finally:
+                self.in_flight[url] -= len(shard)
+            await self._refresh_queue_depth(url)
+
+        pending = list(range(len(codes)))
+        while pending:
+            shards = self._shard(pending, codes, exclude=failed)
+            await asyncio.gather(*(run(url, shard) for url, shard in shards.items()))
+            pending = [index for index in pending if index not in results]
+
+        return {"results": [results[index] for index in range(len(codes))]}
+
+    async def async_verify_stream(self, codes, timeout, infotree_type=None):
+        """verify the proof codes on their endpoints, yielding each result as soon as it completes.
+
+        Codes an endpoint failed to answer are sent again to the next endpoints.
+        """
+        await self._refresh_health()
+        # The streamed results are matched to the codes by their custom_id
+        indices_of = {}
+        for index, code in enumerate(codes):
+            indices_of.setdefault(code["custom_id"], []).append(index)
+        answered = set()  # Indices of the codes answered
+        failed = set()
+        completed = asyncio.Queue()
+
+        async def run(url, shard):
+            remaining = len(shard)
+            try:
+                async for result in self.clients[url].async_verify_stream(
+                    [code for _, code in shard], timeout, infotree_type
+                ):
+                    remaining -= 1
+                    self.in_flight[url] -= 1
+                    completed.put_nowait(result)
+                if remaining > 0:
+                    raise Exception(
+                        f"The stream ended with {remaining} codes unanswered"
+                    )
+            except Exception as e:
+                self._fail(url, e, remaining)
+                failed.add(url)
+            finally:
+                self.in_flight[url] -= remaining
+            await self._refresh_queue_depth(url)
+            completed.put_nowait(None)
+
+        pending = list(range(len(codes)))
+        while pending:
+            shards = self._shard(pending, codes, exclude=failed)
+            tasks = [
+                asyncio.create_task(run(url, shard)) for url, shard in shards.items()
+            ]
+            try:
+                running = len(tasks)
+                while running:
+                    result = await completed.get()
+                    if result is None:
+                        running -= 1
+                        continue
+                    indices = indices_of.get(result["custom_id"], [])
+                    index = next((i for i in indices if i not in answered), None)
+                    if index is not None:
+                        answered.add(index)
+                        yield result
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+            pending = [index for index in pending if index not in answered]
@@ -0,0 +1,169 @@
+import asyncio
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import PlainTextResponse
+
+from utils.compression import (
+    ENCODINGS,
+    Compressor,
+    DecompressedSizeError,
+    Decompressor,
+    negotiate,
+)
+
+# Bodies smaller than this are sent uncompressed
+MINIMUM_SIZE = 1024
+# Bodies larger than this are (de)compressed off the event loop
+THREAD_SIZE = 2**20
+# Largest decompressed request body
+MAX_BODY_SIZE = 256 * 2**20
+
+
+class CompressionMiddleware:
+    """
+    Negotiated gzip / zstd compression of the request and response bodies.
+
+    A request body in a supported `Content-Encoding` is decompressed before
+    it reaches the endpoints, up to `max_body_size` decompressed bytes past
+    which it is refused with 413, and a response is compressed in the preferred
+    coding of the `Accept-Encoding` header. Every response advertises the
+    supported request codings in its own `Accept-Encoding` header, which is
+    how clients know they can compress their requests. Streamed responses
+    are flushed chunk by chunk, so each result is delivered as soon as it is
+    sent.
+    """
+
+    def __init__(self, app, minimum_size=MINIMUM_SIZE, max_body_size=MAX_BODY_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.max_body_size = max_body_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        content_encoding = headers.get("content-encoding", "identity")
+        if content_encoding != "identity":
+            try:
+                decompressor = Decompressor(content_encoding, self.max_body_size)
+            except ValueError as e:
+                response = PlainTextResponse(
+                    str(e),
+                    status_code=415,
+                    headers={"Accept-Encoding": ", ".join(ENCODINGS)},
+                )
+                await response(scope, receive, send)
+                return
+            try:
+                receive = await _decompressed_receive(receive, decompressor)
+            except DecompressedSizeError as e:
+                response = PlainTextResponse(str(e), status_code=413)
+                await response(scope, receive, send)
+                return
+            scope = {
+                **scope,
+                "headers": [
+                    (name, value)
+                    for name, value in scope["headers"]
+                    if name not in (b"content-encoding", b"content-length")
+                ],
+            }
+
+        responder = _CompressingResponder(
+            send, negotiate(headers.get("accept-encoding")), self.minimum_size
+        )
+        await self.app(scope, receive, responder.send)
+
+
+async def _run(function, data):
+    if len(data) > THREAD_SIZE:
+        return await asyncio.to_thread(function, data)
+    return function(data)
+
+
+async def _decompressed_receive(receive, decompressor):
+    """Read the whole request body decompressing it chunk by chunk, and replay it.
+
+    Raises:
+        DecompressedSizeError: If the body decompresses past the limit of the decompressor.
+    """
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        chunks.append(await _run(decompressor.decompress, message.get("body", b"")))
+        if not message.get("more_body", False):
+            break
+    body = b"".join(chunks)
+    sent = False
+
+    async def decompressed_receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+
+    return decompressed_receive
+
+
+class _CompressingResponder:
+    def __init__(self, send, encoding, minimum_size):
+        self._send = send
+        self.encoding = encoding  # None to send the response as is
+        self.minimum_size = minimum_size
+        self.start = None  # Response start, held until the first body chunk
+        self.compressor = None
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            self.start = message
+            headers = MutableHeaders(scope=message)
+            headers["Accept-Encoding"] = ", ".join(ENCODINGS)
+            if "content-encoding" in headers:
+                self.encoding = None
+            return
+        if message["type"] != "http.response.body":
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.start is not None:
+            start, self.start = self.start, None
+            if self.encoding is None or (
+                not more_body and len(body) < self.minimum_size
+            ):
+                await self._send(start)
+                await self._send(message)
+                self.encoding = None
+                return
+            headers = MutableHeaders(scope=start)
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            del headers["content-length"]
+            self.compressor = Compressor(self.encoding)
+            body = await _run(
+                lambda data: self.compressor.compress(data, final=not more_body), body
+            )
+            if not more_body:
+                headers["Content-Length"] = str(len(body))
+            await self._send(start)
+            await self._send(
+                {"type": "http.response.body", "body": body, "more_body": more_body}
+            )
+            return
+
+        if self.compressor is not None:
+            body = await _run(
+                lambda data: self.compressor.compress(data, final=not more_body), body
+            )
+            message = {
+                "type": "http.response.body",
+                "body": body,
+                "more_body": more_body,
+            }
+        await self._send(message)
@@ -1,7 +1,9 @@
+import json
 import os
+from typing import Annotated
 
 from pydantic import Field, ValidationError, field_validator
-from pydantic_settings import BaseSettings, SettingsConfigDict
+from pydantic_settings import BaseSettings, NoDecode, SettingsConfigDict
 
 
 class Settings(BaseSettings):
@@ -13,6 +15,20 @@ class Settings(BaseSettings):
     WORKSPACE: str = Field(default_factory=os.getcwd)
     MAX_REPLS: int = Field(os.cpu_count() or 1)
     MAX_CONCURRENT_REQUESTS: int = Field(os.cpu_count() or 1)
+    MAX_CONCURRENT_CREATES: int = Field(os.cpu_count() or 1)
+    CLEAN_REPLS: int = Field(os.cpu_count() or 1)
+    MAX_REPL_MEMORY_MB: int | None = Field(None)
+    REPL_MAX_COMMANDS: int | None = Field(None)
+    REPL_MAX_ELABORATION_TIME: float | None = Field(None)
+    REPL_MAX_MEMORY_GROWTH_MB: int | None = Field(None)
+    MAX_RESPONSE_MB: int = Field(1024)
+    MAX_REQUEST_MB: int = Field(256)
+    RESULT_CACHE_PATH: str | None = Field(None)
+    RESULT_CACHE_SIZE: int = Field(100000)
+    RESULT_CACHE_DISK_SIZE: int | None = Field(10000000)
+    ENV_CACHE_DIR: str | None = Field(None)
+    JOB_STORE_PATH: str | None = Field("./jobs.sqlite")
+    TENANT_WEIGHTS: Annotated[dict[str, float], NoDecode] = Field(default_factory=dict)
 
     model_config = SettingsConfigDict(
         env_file=".env", env_file_encoding="utf-8", env_prefix="LEANSERVER_"
@@ -32,6 +48,58 @@ class Settings(BaseSettings):
             return None
         return v
 
+    @field_validator("JOB_STORE_PATH", mode="before")
+    @classmethod
+    def validate_job_store_path(cls, v):
+        # An empty path disables the jobs
+        if v == "":
+            return None
+        return v
+
+    @field_validator("RESULT_CACHE_PATH", mode="before")
+    @classmethod
+    def validate_result_cache_path(cls, v):
+        if v == "":
+            return None
+        return v
+
+    @field_validator("RESULT_CACHE_DISK_SIZE", mode="before")
+    @classmethod
+    def validate_result_cache_disk_size(cls, v):
+        if v == "":
+            return 10000000
+        return v
+
+    @field_validator("ENV_CACHE_DIR", mode="before")
+    @classmethod
+    def validate_env_cache_dir(cls, v):
+        if v == "":
+            return None
+        return v
+
+    @field_validator("TENANT_WEIGHTS", mode="before")
+    @classmethod
+    def validate_tenant_weights(cls, v):
+        if v == "":
+            return {}
+        if isinstance(v, str):
+            return json.loads(v)
+        return v
+
+    @field_validator("MAX_RESPONSE_MB", mode="before")
+    @classmethod
+    def validate_max_response_mb(cls, v):
+        if v == "":
+            return 1024
+        return v
+
+    @field_validator("MAX_REQUEST_MB", mode="before")
+    @classmethod
+    def validate_max_request_mb(cls, v):
+        if v == "":
+            return 256
+        return v
+
     @field_validator("MAX_REPLS", mode="before")
     @classmethod
     def validate_max_repls(cls, v):
@@ -46,6 +114,33 @@ class Settings(BaseSettings):
             return os.cpu_count() or 1
         return v
 
+    @field_validator(
+        "MAX_REPL_MEMORY_MB",
+        "REPL_MAX_COMMANDS",
+        "REPL_MAX_ELABORATION_TIME",
+        "REPL_MAX_MEMORY_GROWTH_MB",
+        mode="before",
+    )
+    @classmethod
+    def validate_optional_limits(cls, v):
+        if v == "":
+            return None
+        return v
+
+    @field_validator("MAX_CONCURRENT_CREATES", mode="before")
+    @classmethod
+    def validate_max_concurrent_creates(cls, v):
+        if v == "":
+            return os.cpu_count() or 1
+        return v
+
+    @field_validator("CLEAN_REPLS", mode="before")
+    @classmethod
+    def validate_clean_repls(cls, v):
+        if v == "":
+            return os.cpu_count() or 1
+        return v
+
 
 try:
     settings = Settings()
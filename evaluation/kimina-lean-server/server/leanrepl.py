@@ -1,14 +1,17 @@
+import asyncio
+import codecs
 import json
 import os
 import signal
 import subprocess
-import tempfile
 import threading
 import time
 
+import psutil
 from func_timeout import FunctionTimedOut, func_timeout  # type: ignore
 from loguru import logger
 
+from utils import repl_protocol
 from utils.proof_utils import get_error_msg
 
 from .config import settings
@@ -18,18 +21,93 @@ base = settings.WORKSPACE
 path_to_repl = f"{base}/repl/.lake/build/bin/repl"
 path_to_mathlib = os.getenv("REPL_WORKING_PATH")
 
+# Upper bound of a REPL response, infotrees can be large
+MAX_RESPONSE_SIZE = settings.MAX_RESPONSE_MB * 2**20
+
+
+# Stderr markers of a Lean process which can not be trusted anymore, any
+# other stderr output (e.g. a lake warning) is logged and tolerated
+FATAL_STDERR_MARKERS = (
+    "PANIC",
+    "Stack overflow",
+    "uncaught exception",
+    "out of memory",
+    "Segmentation fault",
+)
+
+
+def is_fatal_stderr(content):
+    """Whether stderr output reports a failure of the Lean process."""
+    return any(marker in content for marker in FATAL_STDERR_MARKERS)
+
+
+def _check_stderr(command, content, exited):
+    """Raise a LeanCrashError if the command killed or broke the Lean process."""
+    if exited or is_fatal_stderr(content):
+        logger.error(f"Error from stderr: {content}")
+        raise LeanCrashError(f"Lean process encountered an error: {content}")
+    if content.strip():
+        logger.warning(f"Stderr of command {str(command)[:100]}: {content}")
+
+
+class StderrBuffer:
+    """
+    Stderr output of a REPL process not yet attributed to a command.
+
+    A background reader feeds the output as it arrives, and each command
+    takes what was written while it ran, so checking a command only costs
+    its own output instead of everything the process ever logged.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.lock = threading.Lock()
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def feed(self, chunk):
+        if isinstance(chunk, bytes):
+            chunk = self.decoder.decode(chunk)
+        with self.lock:
+            self.chunks.append(chunk)
+
+    def take(self):
+        """Return and forget the output read since the last call."""
+        with self.lock:
+            content = "".join(self.chunks)
+            self.chunks.clear()
+        return content
+
 
 # error for lean crashes
 class LeanCrashError(Exception):
     pass
 
 
+# error for lean timeouts, the process is killed when it is raised
+class LeanTimeoutError(LeanCrashError):
+    pass
+
+
+def _decode_response(response_bytes):
+    try:
+        return repl_protocol.loads(response_bytes)
+    except json.JSONDecodeError as e:
+        logger.error(f"Error decoding JSON: {e}")
+        logger.error(f"Response received: {response_bytes[:1000]}")
+        return {
+            "messages": [
+                {
+                    "severity": "error",
+                    "data": "error decoding json response in leanrepl",
+                }
+            ]
+        }
+
+
 class LeanREPL:
     def __init__(self):
         # Start the REPL process
-        self.error_file = tempfile.TemporaryFile(
-            "w+",
-        )
+        self.stderr = StderrBuffer()
         self.start_process()
         # Create a lock for thread safety
         self.lock = threading.Lock()
@@ -42,55 +120,40 @@ class LeanREPL:
 
         with self.lock:
             try:
-                # Convert the command to JSON and add two newlines
-                json_command = json.dumps(command, ensure_ascii=False) + "\n\n"
                 # Send the command to the REPL
                 time_elapsed = time.time()
-                self.process.stdin.write(json_command)
+                self.process.stdin.write(repl_protocol.dumps(command))
                 self.process.stdin.flush()
 
                 # Read the response until a blank line is encountered
-                response_lines = []
-                stderr_lines = []
-
-                while True:
-                    # Read from both stdout and stderr
-                    stdout_line = self.process.stdout.readline()
-
-                    if stdout_line.strip() == "":
-                        break
-
-                    if stdout_line:
-                        response_lines.append(stdout_line)
+                response_bytes = self.stdout.read_frame()
             except BrokenPipeError:
                 raise LeanCrashError("Lean process broken pipe error")
+            except repl_protocol.ResponseTooLargeError as e:
+                # The rest of the response can not be skipped cheaply
+                self.close()
+                raise LeanCrashError(str(e))
 
-            # Combine the response lines and parse the JSON
-            response_str = "".join(response_lines)
             time_elapsed = time.time() - time_elapsed
-            try:
-                response_json = json.loads(response_str)
-            except json.JSONDecodeError as e:
-                logger.error("Error decoding JSON:", e)
-                logger.error("Response received:", response_str)
-                response_json = {
-                    "messages": [
-                        {
-                            "severity": "error",
-                            "data": "error decoding json response in leanrepl",
-                        }
-                    ]
-                }
+            response_json = _decode_response(response_bytes)
 
-            error_content = self.get_error_content()
-            if len(error_content.strip()) > 0:
-                logger.error("Error from stderr: %s", error_content)
-                raise LeanCrashError(
-                    f"Lean process encountered an error: {error_content}"
-                )
+            exited = self.stdout.eof
+            if exited:
+                # Wait for the last words of the process
+                self.stderr_reader.join(1)
+            _check_stderr(command, self.stderr.take(), exited)
             response_json["time"] = time_elapsed
             return response_json
 
+    def _send_command_with_timeout(self, command, timeout):
+        try:
+            return func_timeout(timeout, self._send_command, args=(command,))
+        except FunctionTimedOut:
+            # The worker thread keeps waiting on the process, kill it so that
+            # Lean stops elaborating and the thread releases the lock.
+            self.close()
+            raise LeanTimeoutError("Lean process timed out")
+
     def one_pass_verify(self, code, timeout, infotree_type=None):
         """
         Send code to verify in one pass.
@@ -99,21 +162,14 @@ class LeanREPL:
             command = {"cmd": code}
         else:
             command = {"cmd": code, "infotree": infotree_type}
-        try:
-            response = func_timeout(timeout, self._send_command, args=(command,))
-        except FunctionTimedOut:
-            raise LeanCrashError("Lean process timed out")
-        return response
+        return self._send_command_with_timeout(command, timeout)
 
     def create_env(self, code, timeout=150):
         """
         Send code to create a new context.
         """
         command = {"cmd": code}
-        try:
-            response = func_timeout(timeout, self._send_command, args=(command,))
-        except FunctionTimedOut:
-            raise LeanCrashError("Lean process timed out")
+        response = self._send_command_with_timeout(command, timeout)
         if get_error_msg(response) is None:
             self.header = code
         return response
@@ -126,31 +182,30 @@ class LeanREPL:
             command = {"cmd": code, "env": context_id}
         else:
             command = {"cmd": code, "env": context_id, "infotree": infotree_type}
-        try:
-            response = func_timeout(timeout, self._send_command, args=(command,))
-        except FunctionTimedOut:
-            raise LeanCrashError("Lean process timed out")
-        return response
+        return self._send_command_with_timeout(command, timeout)
 
     def start_process(self):
         self.process = subprocess.Popen(
             ["lake", "env", path_to_repl],
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
-            stderr=self.error_file,
-            text=True,
-            bufsize=1,  # Line-buffered
+            stderr=subprocess.PIPE,
+            bufsize=0,  # Commands are written in one call
             cwd=path_to_mathlib,  # Set the working directory to 'mathlib4'
             env=os.environ,  # Inherit environment variables
             preexec_fn=os.setsid,
         )
+        self.stdout = repl_protocol.FrameReader(
+            self.process.stdout.fileno(), MAX_RESPONSE_SIZE
+        )
+        self.stderr_reader = threading.Thread(
+            target=self._read_stderr, args=(self.process.stderr,), daemon=True
+        )
+        self.stderr_reader.start()
 
-    def get_error_content(self):
-        # Ensure that we seek back to the beginning of the file before reading
-        if self.error_file is None:
-            print("Error file is None")
-        self.error_file.seek(0)
-        return self.error_file.read()
+    def _read_stderr(self, stream):
+        for line in stream:
+            self.stderr.feed(line)
 
     def close(self):
         """
@@ -170,3 +225,202 @@ class LeanREPL:
 
     def __del__(self):
         self.close()
+
+
+class AsyncLeanREPL:
+    """
+    asyncio-native Lean REPL driver.
+
+    Commands are written to the REPL's stdin and the blank-line framed JSON
+    response is read without blocking the event loop, so an in-flight
+    verification costs a coroutine instead of an OS thread.
+    """
+
+    def __init__(self):
+        self.process = None
+        self.stderr = StderrBuffer()
+        self.stderr_reader = None  # Task feeding `stderr` from the process
+        # Create a lock to serialize the commands sent to the REPL
+        self.lock = asyncio.Lock()
+        self.header = None
+        self.header_env = 0  # Environment holding the imported header
+        # Usage counters for the recycling policy of the REPL cache, counting
+        # the proofs elaborated on the header environment but not its import
+        self.num_commands = 0
+        self.elaboration_time = 0.0
+        # Time spent encoding the last command and decoding its response
+        self.serialization_time = 0.0
+
+    @classmethod
+    async def spawn(cls):
+        """Create a REPL instance and start its process."""
+        repl = cls()
+        await repl.start_process()
+        return repl
+
+    async def _send_command(self, command):
+        """
+        Send a JSON command to the REPL and return the JSON response.
+        """
+
+        async with self.lock:
+            self.serialization_time = 0.0
+            try:
+                # Convert the command to JSON and add two newlines
+                start_time = time.time()
+                json_command = repl_protocol.dumps(command)
+                self.serialization_time = time.time() - start_time
+                # Send the command to the REPL
+                time_elapsed = time.time()
+                self.process.stdin.write(json_command)
+                await self.process.stdin.drain()
+
+                # Read the response until a blank line is encountered
+                response_bytes, exited = await repl_protocol.read_frame(
+                    self.process.stdout
+                )
+            except (BrokenPipeError, ConnectionResetError):
+                raise LeanCrashError("Lean process broken pipe error")
+            except repl_protocol.ResponseTooLargeError as e:
+                # The rest of the response can not be skipped cheaply
+                self.kill()
+                raise LeanCrashError(str(e))
+
+            # Parse the JSON response
+            time_elapsed = time.time() - time_elapsed
+            start_time = time.time()
+            response_json = _decode_response(response_bytes)
+            self.serialization_time += time.time() - start_time
+
+            if exited:
+                # Wait for the last words of the process
+                await asyncio.wait([self.stderr_reader], timeout=1)
+            _check_stderr(command, self.stderr.take(), exited)
+            response_json["time"] = time_elapsed
+            return response_json
+
+    async def _send_command_with_timeout(self, command, timeout):
+        try:
+            return await asyncio.wait_for(self._send_command(command), timeout)
+        except asyncio.TimeoutError:
+            # Kill the process group so that Lean stops elaborating abandoned work
+            self.kill()
+            raise LeanTimeoutError("Lean process timed out")
+
+    async def one_pass_verify(self, code, timeout, infotree_type=None):
+        """
+        Send code to verify in one pass.
+        """
+        if infotree_type is None:
+            command = {"cmd": code}
+        else:
+            command = {"cmd": code, "infotree": infotree_type}
+        return await self._send_command_with_timeout(command, timeout)
+
+    async def create_env(self, code, timeout=150):
+        """
+        Send code to create a new context.
+        """
+        command = {"cmd": code}
+        response = await self._send_command_with_timeout(command, timeout)
+        if get_error_msg(response) is None:
+            self.header = code
+            self.header_env = response.get("env", 0)
+        return response
+
+    async def pickle_env(self, path, timeout=150):
+        """
+        Save the header environment to the `.olean` file at `path`.
+        """
+        command = {"pickleTo": path, "env": self.header_env}
+        return await self._send_command_with_timeout(command, timeout)
+
+    async def unpickle_env(self, header, path, timeout=150):
+        """
+        Restore a header environment saved by `pickle_env` instead of importing the header.
+        """
+        command = {"unpickleEnvFrom": path}
+        response = await self._send_command_with_timeout(command, timeout)
+        if "env" in response:
+            self.header = header
+            self.header_env = response["env"]
+        return response
+
+    async def extend_env(self, context_id, code, timeout=150, infotree_type=None):
+        """
+        Send code to extend a context.
+        """
+        if infotree_type is None:
+            command = {"cmd": code, "env": context_id}
+        else:
+            command = {"cmd": code, "env": context_id, "infotree": infotree_type}
+        response = await self._send_command_with_timeout(command, timeout)
+        self.num_commands += 1
+        self.elaboration_time += response["time"]
+        return response
+
+    async def start_process(self):
+        self.process = await asyncio.create_subprocess_exec(
+            "lake",
+            "env",
+            path_to_repl,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=path_to_mathlib,  # Set the working directory to 'mathlib4'
+            env=os.environ,  # Inherit environment variables
+            start_new_session=True,
+            limit=MAX_RESPONSE_SIZE,
+        )
+        self.stderr_reader = asyncio.create_task(self._read_stderr(self.process.stderr))
+
+    async def _read_stderr(self, stream):
+        while chunk := await stream.read(2**16):
+            self.stderr.feed(chunk)
+
+    def rss(self):
+        """
+        Resident memory in bytes of the REPL process and all its child processes.
+        """
+        if self.process is None or self.process.returncode is not None:
+            return 0
+        try:
+            parent = psutil.Process(self.process.pid)
+            processes = [parent] + parent.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return 0
+        rss = 0
+        for process in processes:
+            try:
+                rss += process.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        return rss
+
+    def kill(self):
+        """
+        Kill the REPL process and all its child processes without waiting.
+        """
+        if self.process is None or self.process.returncode is not None:
+            return
+        try:
+            # The process leads its own session, so its pid is the process group id
+            os.killpg(self.process.pid, signal.SIGKILL)
+            # stop input to repl (which will result in the program loop for lean repl terminating)
+            self.process.stdin.close()
+        except ProcessLookupError:
+            # Process already terminated
+            pass
+
+    async def close(self):
+        """
+        Terminate the REPL process and all its child processes.
+        """
+        if self.process is None:
+            return
+        self.kill()
+        # Wait for the process to exit
+        await self.process.wait()
+
+    def __del__(self):
+        self.kill()
@@ -0,0 +1,209 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import PlainTextResponse
+
+from utils.metrics import Histogram, PrometheusWriter
+
+router = APIRouter()
+
+# Seconds to import a header into a REPL, pre-warmed or on a cache miss
+import_latency = Histogram([0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600])
+# Seconds to verify a proof once its REPL is ready
+verify_latency = Histogram([0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300])
+# Seconds to restore a header environment from its pickled snapshot
+restore_latency = Histogram([0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600])
+
+
+def collect_status(state):
+    """Gather the server metrics from the caches registered on the app state."""
+    repl_cache = state.repl_cache.snapshot()
+    lookups = repl_cache["cache_hits"] + repl_cache["cache_misses"]
+    return {
+        "repl_cache": {
+            **repl_cache,
+            "hit_ratio": repl_cache["cache_hits"] / lookups if lookups else 0.0,
+            "import_latency": state.repl_cache.create_queue.import_latency,
+        },
+        "clean_repls": {
+            "ready": len(state.clean_repl_pool),
+            **state.clean_repl_pool.stats,
+        },
+        "result_cache": dict(state.result_cache.stats),
+        "env_cache": dict(state.env_cache.stats),
+        "scheduler": {
+            "active": state.scheduler.active,
+            "waiting": state.scheduler.waiting(),
+            **state.scheduler.stats,
+        },
+        "import_latency": import_latency.to_dict(),
+        "verify_latency": verify_latency.to_dict(),
+        "restore_latency": restore_latency.to_dict(),
+    }
+
+
+def render_prometheus(status):
+    """Render the server metrics in the Prometheus text format."""
+    writer = PrometheusWriter("leanserver")
+    repl_cache = status["repl_cache"]
+
+    writer.metric(
+        "repls",
+        "gauge",
+        "Pooled REPLs by state.",
+        [
+            ({"state": "idle"}, repl_cache["idle"]),
+            ({"state": "leased"}, repl_cache["leased"]),
+        ],
+    )
+    writer.metric(
+        "repl_pool_size",
+        "gauge",
+        "Idle pooled REPLs per header.",
+        [({"header": header}, size) for header, size in repl_cache["headers"].items()],
+    )
+    writer.gauge(
+        "create_queue_depth",
+        "REPL creations queued or in progress.",
+        repl_cache["create_queue"],
+    )
+    writer.gauge(
+        "close_queue_depth", "REPLs waiting to be closed.", repl_cache["close_queue"]
+    )
+    writer.gauge(
+        "retiring_repls", "REPLs waiting for their successor.", repl_cache["retiring"]
+    )
+    writer.gauge(
+        "repl_memory_bytes",
+        "Resident memory of the pooled REPLs.",
+        repl_cache["memory"],
+    )
+    writer.gauge(
+        "repl_cache_hit_ratio",
+        "Hit ratio of the REPL cache since start.",
+        repl_cache["hit_ratio"],
+    )
+    writer.counter(
+        "repl_cache_hits", "REPLs leased from the cache.", repl_cache["cache_hits"]
+    )
+    writer.counter(
+        "repl_cache_misses",
+        "REPL cache lookups without an idle REPL.",
+        repl_cache["cache_misses"],
+    )
+    writer.counter(
+        "repl_timeouts", "Commands killed on timeout.", repl_cache["timeouts"]
+    )
+    writer.counter(
+        "repl_crashes", "REPLs which crashed or failed to start.", repl_cache["crashes"]
+    )
+    writer.counter(
+        "repl_evictions",
+        "Idle REPLs evicted over the pool size.",
+        repl_cache["evictions"],
+    )
+    writer.counter(
+        "repl_memory_evictions",
+        "REPLs evicted over the memory budget.",
+        repl_cache["memory_evictions"],
+    )
+    writer.counter(
+        "repl_destroyed",
+        "REPLs destroyed after a crash, a timeout or a failed request.",
+        repl_cache["destroyed"],
+    )
+    writer.counter(
+        "repl_recycled",
+        "REPLs retired by the recycling policy.",
+        repl_cache["recycled"],
+    )
+
+    clean_repls = status["clean_repls"]
+    writer.gauge(
+        "clean_repls",
+        "Clean REPLs ready for one-shot verifications.",
+        clean_repls["ready"],
+    )
+    writer.counter(
+        "clean_repl_hits", "Clean REPLs leased from the pool.", clean_repls["hits"]
+    )
+    writer.counter(
+        "clean_repl_misses",
+        "Clean REPLs spawned on the request path.",
+        clean_repls["misses"],
+    )
+
+    result_cache = status["result_cache"]
+    writer.counter(
+        "result_cache_hits",
+        "Verification results served from the cache.",
+        result_cache["hits"],
+    )
+    writer.counter(
+        "result_cache_disk_hits",
+        "Verification results read from disk.",
+        result_cache["disk_hits"],
+    )
+    writer.counter(
+        "result_cache_misses",
+        "Verification result cache lookups that missed.",
+        result_cache["misses"],
+    )
+
+    env_cache = status["env_cache"]
+    writer.counter(
+        "env_snapshot_hits",
+        "Header environments restored from a snapshot.",
+        env_cache["hits"],
+    )
+    writer.counter(
+        "env_snapshot_misses",
+        "Header imports without a snapshot.",
+        env_cache["misses"],
+    )
+    writer.counter(
+        "env_snapshot_saved", "Header environment snapshots saved.", env_cache["saved"]
+    )
+    writer.counter(
+        "env_snapshot_failures",
+        "Snapshots which failed to save or to restore.",
+        env_cache["failures"],
+    )
+
+    scheduler = status["scheduler"]
+    writer.gauge(
+        "scheduler_active", "Verifications holding a slot.", scheduler["active"]
+    )
+    writer.gauge(
+        "scheduler_waiting", "Verifications waiting for a slot.", scheduler["waiting"]
+    )
+    writer.counter(
+        "scheduler_granted", "Slots granted by the scheduler.", scheduler["granted"]
+    )
+    writer.counter(
+        "scheduler_waited",
+        "Verifications which had to wait for a slot.",
+        scheduler["waited"],
+    )
+
+    writer.histogram("import_latency_seconds", "Header import latency.", import_latency)
+    writer.histogram(
+        "verify_latency_seconds", "Proof verification latency.", verify_latency
+    )
+    writer.histogram(
+        "restore_latency_seconds",
+        "Header environment restore latency.",
+        restore_latency,
+    )
+    return writer.render()
+
+
+@router.get("/status")
+async def status(request: Request):
+    return collect_status(request.app.state)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics(request: Request):
+    return PlainTextResponse(
+        render_prometheus(collect_status(request.app.state)),
+        media_type="text/plain; version=0.0.4",
+    )
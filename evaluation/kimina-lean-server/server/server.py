@@ -1,59 +1,213 @@
 import asyncio
+import json
+import time
 import uuid
-from collections import Counter
-from concurrent.futures import ThreadPoolExecutor
-from contextlib import asynccontextmanager
+from collections import deque
+from contextlib import aclosing, asynccontextmanager
 from datetime import datetime
-from typing import Annotated
+from typing import Annotated, Callable
 
 from fastapi import Depends, FastAPI, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from loguru import logger
 from pydantic import BaseModel, Field
-from tqdm import tqdm
 
+from utils.env_cache import EnvSnapshotCache
+from utils.job_store import JobStore
 from utils.proof_utils import split_proof_header
-from utils.repl_cache import LRUReplCache
+from utils.repl_cache import CleanReplPool, LRUReplCache
+from utils.result_cache import ResultCache, project_revision
+from utils.scheduler import FairScheduler
 
+from .compression import CompressionMiddleware
 from .config import settings
 from .healthcheck import router
-from .leanrepl import LeanCrashError, LeanREPL
+from .metrics import import_latency, restore_latency, verify_latency
+from .metrics import router as metrics_router
+from .timing import Timing
+from .leanrepl import (
+    AsyncLeanREPL,
+    LeanCrashError,
+    LeanTimeoutError,
+    path_to_mathlib,
+)
 
 time_stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
 logger.remove()
 logger.add(f"{settings.LOG_DIR}/server_{time_stamp}.log")
 
 repls = {}
-semaphore = asyncio.Semaphore(settings.MAX_CONCURRENT_REQUESTS)
-repl_cache = LRUReplCache(max_size=settings.MAX_REPLS)
+scheduler = FairScheduler(
+    settings.MAX_CONCURRENT_REQUESTS, weights=settings.TENANT_WEIGHTS
+)
+repl_cache = LRUReplCache(
+    max_size=settings.MAX_REPLS,
+    max_memory=(
+        settings.MAX_REPL_MEMORY_MB * 2**20
+        if settings.MAX_REPL_MEMORY_MB is not None
+        else None
+    ),
+    max_commands=settings.REPL_MAX_COMMANDS,
+    max_elaboration_time=settings.REPL_MAX_ELABORATION_TIME,
+    max_memory_growth=(
+        settings.REPL_MAX_MEMORY_GROWTH_MB * 2**20
+        if settings.REPL_MAX_MEMORY_GROWTH_MB is not None
+        else None
+    ),
+)
+
+
+clean_repl_pool = CleanReplPool(max_size=settings.CLEAN_REPLS)
+
+
+revision = project_revision(path_to_mathlib) + project_revision(
+    f"{settings.WORKSPACE}/repl"
+)
+result_cache = ResultCache(
+    path=settings.RESULT_CACHE_PATH,
+    max_size=settings.RESULT_CACHE_SIZE,
+    revision=revision,
+    max_disk_size=settings.RESULT_CACHE_DISK_SIZE,
+)
+env_cache = EnvSnapshotCache(settings.ENV_CACHE_DIR, revision=revision)
+
+
+job_store: JobStore | None = None  # Opened by the lifespan, unless jobs are disabled
+job_tasks: dict[str, asyncio.Task] = {}  # Running jobs by id
+JOB_CHUNK_SIZE = 100  # Codes of a job verified together
+JOB_WINDOW = 10  # Chunks of a job in flight, a slow chunk never holds back the others
+JOB_SAVE_BATCH_SIZE = 100  # Results of a job stored in one transaction
+JOB_SAVE_INTERVAL = 1  # Seconds before the results of a job are stored anyway
+
+
+async def _import_header(repl, header, timeout):
+    """Import the header into a fresh REPL, restoring its pickled environment if there is one.
+
+    Returns:
+        tuple: (response, whether the environment was restored)
+    """
+    path = env_cache.lookup(header)
+    if path is not None:
+        start_time = time.perf_counter()
+        try:
+            response = await repl.unpickle_env(header, path, timeout)
+        except LeanCrashError:
+            env_cache.invalidate(header)
+            raise
+        if "env" in response:
+            restore_latency.observe(time.perf_counter() - start_time)
+            return response, True
+        logger.error(
+            f"Failed to restore {str([header])[:50]} from {path}: {str(response)[:200]}"
+        )
+        env_cache.invalidate(header)
+
+    response = await repl.create_env(header, timeout)
+    return response, False
+
+
+async def _save_env(repl, header):
+    """Pickle the environment of a freshly imported header, unless it is already saved.
+
+    Only `_repl_creater` pickles, so that a slow or failed pickling never
+    counts against the timeout of a request nor discards its REPL.
+
+    Returns:
+        bool: False if pickling killed the REPL, which must not be pooled.
+    """
+    temp_path = env_cache.begin_save(header) if repl.header == header else None
+    if temp_path is None:
+        return True
+    success = False
+    try:
+        pickled = await repl.pickle_env(temp_path)
+        success = "message" not in pickled
+        if not success:
+            logger.error(f"Failed to pickle {str([header])[:50]}: {pickled}")
+    except LeanCrashError as e:
+        logger.error(f"Failed to pickle {str([header])[:50]}: {e}")
+        return False
+    finally:
+        env_cache.end_save(header, temp_path, success)
+    return True
 
 
 async def _repl_creater():
+    """Create pre-warmed REPLs as soon as their header is scheduled."""
     while True:
-        await asyncio.sleep(10)
-        if len(repl_cache.create_queue) > 0:
-            repl_to_create = Counter(repl_cache.create_queue)
-            repl_cache.create_queue = []
-
-            for header, amount in tqdm(repl_to_create.items(), desc="Creating REPLs"):
-                tasks = []
-                creating_repls = []
-                try:
-                    for _ in range(amount):
-                        repl = LeanREPL()
-                        creating_repls.append(repl)
-                        tasks.append(asyncio.to_thread(repl.create_env, header, 600))
-
-                    responses = await asyncio.gather(*tasks)
-                    logger.info(
-                        f"Created {len(responses)} {str([header])[:50]} repls with response {str(responses)[:50]}"
-                    )
-                except LeanCrashError:
-                    for repl in creating_repls:
-                        repl_cache.close_queue.put(repl)
+        header, predecessor = await repl_cache.create_queue.get()
+        repl = None
+        latency = None
+        try:
+            start_time = time.time()
+            repl = await AsyncLeanREPL.spawn()
+            response, restored = await _import_header(repl, header, 600)
+            import_time = time.time() - start_time
+            if not restored:
+                import_latency.observe(import_time)
+                if not await _save_env(repl, header):
+                    raise LeanCrashError("Lean process died while pickling")
+            latency = import_time
+            logger.info(
+                f"Created {str([header])[:50]} repl in {latency:.2f}s with response {str(response)[:50]}"
+            )
+        except (LeanCrashError, OSError) as e:
+            logger.error(f"Failed to create {str([header])[:50]} repl: {e}")
+            _count_failure(e)
+            if repl is not None:
+                repl_cache.close_queue.put((None, repl))
+            if predecessor is not None:
+                repl_cache.successor_failed(predecessor)
+        finally:
+            repl_cache.create_queue.done(header, latency)
+
+        # put the repl in the cache
+        if latency is not None:
+            await repl_cache.put(header, repl, predecessor)
+
+
+async def _clean_repl_spawner():
+    """Keep the pool of clean REPLs filled."""
+    while True:
+        await clean_repl_pool.reserve()
+        repl = None
+        try:
+            repl = await AsyncLeanREPL.spawn()
+        except OSError as e:
+            logger.error(f"Failed to spawn a clean repl: {e}")
+            await asyncio.sleep(1)
+        finally:
+            clean_repl_pool.put(repl)
+
+
+async def _lease_clean_repl(timing: Timing | None = None):
+    """Lease a REPL from the clean pool, or spawn one if the pool is empty."""
+    since = time.perf_counter()
+    while (repl := clean_repl_pool.get()) is not None:
+        # Skip the processes which died while waiting in the pool
+        if repl.process.returncode is None:
+            break
+        repl_cache.close_queue.put((None, repl))
+    else:
+        repl = await AsyncLeanREPL.spawn()
+    if timing is not None:
+        timing.add("cache_lookup", since)
+    return repl
 
-                # put the repls in the cache
-                for repl in creating_repls:
-                    await repl_cache.put(header, repl)
+
+def _count_failure(error):
+    """Count a timed out or crashed REPL in the cache statistics."""
+    if isinstance(error, LeanTimeoutError):
+        repl_cache.stats["timeouts"] += 1
+    else:
+        repl_cache.stats["crashes"] += 1
+
+
+async def _discard_repl(header, id, repl, error):
+    """Kill a crashed or timed out REPL, a pooled one is replaced through the cache."""
+    _count_failure(error)
+    repl.kill()
+    await repl_cache.destroy(header, id, repl)
 
 
 async def _repl_cleaner():
@@ -61,52 +215,78 @@ async def _repl_cleaner():
         await asyncio.sleep(1)
         while not repl_cache.close_queue.empty():
             id, repl = repl_cache.close_queue.get()
-            await asyncio.to_thread(repl.close)
+            await repl.close()
             logger.info(f"Closed {id} repl")
 
 
-async def _stat_printer():
-    update_interval = 15
+async def _memory_monitor():
+    """Measure the resident memory of the pooled REPLs and enforce the memory limits."""
+    update_interval = 5
     while True:
         await asyncio.sleep(update_interval)
-        await repl_cache.print_status(update_interval)
+        repls = [(id, repl) for id, (_, repl) in repl_cache.global_repl_pool.items()]
+        rss_by_id = await asyncio.to_thread(
+            lambda: {id: repl.rss() for id, repl in repls}
+        )
+        repl_cache.update_memory(rss_by_id)
+        repl_cache.evict_for_memory()
+
+
+async def _result_cache_flusher():
+    """Write the cached results to disk in batches, off the event loop."""
+    while True:
+        await asyncio.sleep(1)
+        await result_cache.aflush()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """App lifespan context manager"""
-    app.state.executor = ThreadPoolExecutor(max_workers=5000)
-    asyncio.get_running_loop().set_default_executor(app.state.executor)
-
+    global job_store
     # Repl cache manager tasks
     relp_cache_tasks = [
         asyncio.create_task(_repl_cleaner()),
-        asyncio.create_task(_repl_creater()),
-        asyncio.create_task(_stat_printer()),
     ]
+    if repl_cache.max_memory is not None or repl_cache.max_memory_growth is not None:
+        relp_cache_tasks.append(asyncio.create_task(_memory_monitor()))
+    if result_cache.db is not None:
+        relp_cache_tasks.append(asyncio.create_task(_result_cache_flusher()))
+    relp_cache_tasks.extend(
+        asyncio.create_task(_repl_creater())
+        for _ in range(settings.MAX_CONCURRENT_CREATES)
+    )
+    relp_cache_tasks.extend(
+        asyncio.create_task(_clean_repl_spawner())
+        for _ in range(min(settings.CLEAN_REPLS, settings.MAX_CONCURRENT_CREATES))
+    )
 
     # Prefill repl_cache, The pre-filled amount should not be greater than settings.MAX_REPLS.
-    # repl_cache.create_queue.extend(["import Mathlib"] * int(settings.MAX_REPLS / 2))
+    # repl_cache.create("import Mathlib", int(settings.MAX_REPLS / 2))
     # TODO: Make it an initialization parameter.
     import os
     if 'optlib' in os.getenv("REPL_WORKING_PATH"):
         print('cache optlib')
-        repl_cache.create_queue.extend(
-            ["import Optlib"] * int(settings.MAX_REPLS)
-        )
+        repl_cache.create("import Optlib", int(settings.MAX_REPLS))
     elif 'lean-rademacher' in os.getenv("REPL_WORKING_PATH"):
         print('cache foml')
-        repl_cache.create_queue.extend(
-            ["import FoML"] * int(settings.MAX_REPLS)
-        )
+        repl_cache.create("import FoML", int(settings.MAX_REPLS))
     else:
-        repl_cache.create_queue.extend(
-            ["import Mathlib\nimport Aesop"] * int(settings.MAX_REPLS)
-        )
+        repl_cache.create("import Mathlib\nimport Aesop", int(settings.MAX_REPLS))
+
+    # Open the job store, and resume the jobs interrupted by the last shutdown
+    if settings.JOB_STORE_PATH is not None:
+        job_store = await asyncio.to_thread(JobStore, settings.JOB_STORE_PATH)
+        for job_id in await asyncio.to_thread(job_store.unfinished):
+            _start_job(job_id)
 
     try:
         yield
     finally:
+        # Stop the jobs first, they resume from their stored results on restart
+        for task in list(job_tasks.values()):
+            task.cancel()
+        await asyncio.gather(*job_tasks.values(), return_exceptions=True)
+
         # Cancel cache manager task
         for task in relp_cache_tasks:
             task.cancel()
@@ -115,11 +295,23 @@ async def lifespan(app: FastAPI):
             except asyncio.CancelledError:
                 pass
 
-        # Close thread pools
-        app.state.executor.shutdown(wait=True)
+        for repl in clean_repl_pool.drain():
+            await repl.close()
+        result_cache.close()
+        if job_store is not None:
+            job_store.close()
+            job_store = None
 
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(
+    CompressionMiddleware, max_body_size=settings.MAX_REQUEST_MB * 2**20
+)
+app.state.repl_cache = repl_cache
+app.state.clean_repl_pool = clean_repl_pool
+app.state.result_cache = result_cache
+app.state.env_cache = env_cache
+app.state.scheduler = scheduler
 
 
 # ------ Dependencies ------
@@ -138,28 +330,50 @@ def validate_api_access(request: Request, authorization: str = Header(None)) ->
         raise HTTPException(status_code=403, detail="Invalid API Key")
 
 
+async def teardown_repls(repl):
+    """Destroy the REPLs still leased by a request that failed."""
+    for _, id_and_repl in repl.items():
+        if id_and_repl is None:
+            continue
+        id, repl_instance = id_and_repl
+        if id is not None:
+            assert repl_instance.header is not None
+            await repl_cache.destroy(repl_instance.header, id, repl_instance)
+            logger.info("teardown_request:", id, id in repl_cache.global_repl_pool)
+        repl_cache.close_queue.put((id, repl_instance))
+    repl.clear()
+
+
 async def get_repl(request: Request):
     repl = {}
 
     try:
         yield repl
     except Exception as ex:
-        for _, id_and_repl in repl.items():
-            if id_and_repl is None:
-                continue
-            id, repl_instance = id_and_repl
-            if id is not None:
-                assert repl_instance.header is not None
-                await repl_cache.destroy(repl_instance.header, id, repl_instance)
-                repl_cache.create_queue.append(repl_instance.header)
-                logger.info("teardown_request:", id, id in repl_cache.global_repl_pool)
-            repl_cache.close_queue.put((id, repl_instance))
-
+        await teardown_repls(repl)
         raise ex
 
 
+def get_tenant(
+    request: Request,
+    authorization: str = Header(None),
+    x_client_id: str = Header(None),
+) -> str:
+    """Identify who a request is scheduled for: client id, else API key, else address."""
+    if x_client_id:
+        return x_client_id
+    if authorization is not None and authorization.startswith("Bearer "):
+        api_key = authorization.split(" ", 1)[1]
+        if api_key:
+            return api_key
+    return request.client.host if request.client is not None else ""
+
+
 require_access_dep = Annotated[None, Depends(validate_api_access)]
-lean_repl_dep = Annotated[dict[str, tuple[str, LeanREPL | None]], Depends(get_repl)]
+tenant_dep = Annotated[str, Depends(get_tenant)]
+lean_repl_dep = Annotated[
+    dict[str, tuple[str, AsyncLeanREPL | None]], Depends(get_repl)
+]
 
 
 # ------ Schemas ------
@@ -177,6 +391,8 @@ class VerifyRequestBody(BaseModel):
     timeout: int = 300
     infotree_type: str | None = None
     disable_cache: bool = False
+    include_timing: bool = False  # Add the latency breakdown of each result
+    priority: int = 0  # Higher priorities are scheduled first
 
 
 # ------ Endpoint ------
@@ -190,35 +406,299 @@ async def verify(
     body: VerifyRequestBody,
     lean_repl: lean_repl_dep,
     access: require_access_dep,
+    tenant: tenant_dep,
 ):
     """verify the proof code."""
+    results = [None] * len(body.codes)
+    async with aclosing(iter_verify_results(body, lean_repl, tenant)) as results_iter:
+        async for idx, result in results_iter:
+            results[idx] = result
+
+    return {"results": results}
+
+
+@app.post("/verify/stream")
+async def verify_stream(
+    body: VerifyRequestBody,
+    access: require_access_dep,
+    tenant: tenant_dep,
+):
+    """verify the proof code, streaming each result as NDJSON as soon as it completes."""
+    # The REPLs are tracked here since the stream outlives the request dependencies
+    lean_repl: dict[str, tuple[str, AsyncLeanREPL | None]] = {}
+
+    async def stream_results():
+        try:
+            async with aclosing(
+                iter_verify_results(body, lean_repl, tenant)
+            ) as results_iter:
+                async for _, result in results_iter:
+                    yield json.dumps(result, ensure_ascii=False) + "\n"
+        except BaseException:
+            await teardown_repls(lean_repl)
+            raise
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+
+@app.post("/jobs")
+async def submit_job(
+    body: VerifyRequestBody,
+    access: require_access_dep,
+    tenant: tenant_dep,
+):
+    """Store a verification job and run it in the background, returning its id."""
+    options = body.model_dump(exclude={"codes"})
+    codes = [code.model_dump(exclude_none=True) for code in body.codes]
+    job_id = await asyncio.to_thread(_jobs().create, codes, options, tenant)
+    _start_job(job_id)
+    return {"job_id": job_id, "total": len(codes)}
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str, access: require_access_dep):
+    """Get the status and the progress of a job."""
+    job = await asyncio.to_thread(_jobs().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    del job["tenant"]
+    return job
+
+
+@app.post("/jobs/{job_id}/retry")
+async def retry_job(job_id: str, access: require_access_dep):
+    """Resume a failed job from its stored results."""
+    job = await asyncio.to_thread(_jobs().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] == "failed" and job_id not in job_tasks:
+        await asyncio.to_thread(_jobs().set_status, job_id, "queued")
+        _start_job(job_id)
+        job["status"] = "queued"
+    del job["tenant"]
+    return job
+
+
+@app.get("/jobs/{job_id}/results")
+async def job_results(
+    job_id: str,
+    access: require_access_dep,
+    offset: int = 0,
+    limit: int = 1000,
+):
+    """Get a page of the results of a job in code order, null for the pending codes."""
+    job = await asyncio.to_thread(_jobs().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    results = await asyncio.to_thread(_jobs().results, job_id, offset, limit)
+    next_offset = offset + len(results)
+    return {
+        "job_id": job_id,
+        "status": job["status"],
+        "offset": offset,
+        "results": results,
+        "next_offset": next_offset if next_offset < job["total"] else None,
+    }
+
+
+def _start_job(job_id):
+    task = asyncio.create_task(_run_job(job_id))
+    job_tasks[job_id] = task
+    task.add_done_callback(lambda _: job_tasks.pop(job_id, None))
+
+
+async def _run_job(job_id):
+    """Verify the pending codes of a job, storing the results in batches as they complete.
+
+    Up to `JOB_WINDOW` chunks of the job are verified at once, and the next
+    chunk starts as soon as any of them completes.
+    """
+    store = _jobs()
+    job = await asyncio.to_thread(store.get, job_id)
+    await asyncio.to_thread(store.set_status, job_id, "running")
+    lean_repl = {}
+    completed = []
+    last_save = time.time()
+    running: set[asyncio.Task] = set()
+
+    async def run_chunk(pending):
+        nonlocal last_save
+        indices = [idx for idx, _ in pending]
+        body = VerifyRequestBody(codes=[code for _, code in pending], **job["options"])
+        async with aclosing(
+            iter_verify_results(body, lean_repl, job["tenant"])
+        ) as results_iter:
+            async for i, result in results_iter:
+                completed.append((indices[i], result))
+                if (
+                    len(completed) >= JOB_SAVE_BATCH_SIZE
+                    or time.time() - last_save >= JOB_SAVE_INTERVAL
+                ):
+                    last_save = time.time()
+                    await _save_job_results(job_id, completed)
+
+    try:
+        after = -1
+        while True:
+            while len(running) < JOB_WINDOW and (
+                pending := await asyncio.to_thread(
+                    store.pending, job_id, JOB_CHUNK_SIZE, after
+                )
+            ):
+                after = pending[-1][0]
+                running.add(asyncio.create_task(run_chunk(pending)))
+            if not running:
+                break
+            done, running = await asyncio.wait(
+                running, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                task.result()
+            await _save_job_results(job_id, completed)
+        await asyncio.to_thread(store.set_status, job_id, "completed")
+        logger.info(f"Completed job {job_id}")
+    except Exception as e:
+        # The job is resumed from its stored results by `POST /jobs/{job_id}/retry` or on restart
+        logger.error(f"Job {job_id} failed: {e}")
+        await _cancel_chunks(running)
+        await _save_job_results(job_id, completed)
+        await asyncio.to_thread(store.set_status, job_id, "failed")
+        await teardown_repls(lean_repl)
+    except BaseException:
+        # Keep the results verified so far, the job resumes after them on restart
+        await asyncio.shield(_cancel_chunks(running))
+        await asyncio.shield(_save_job_results(job_id, completed))
+        await teardown_repls(lean_repl)
+        raise
+
+
+async def _cancel_chunks(tasks):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _save_job_results(job_id, completed):
+    if completed:
+        results = completed[:]
+        completed.clear()
+        await asyncio.to_thread(_jobs().save_results, job_id, results)
+
+
+def _jobs() -> JobStore:
+    """Return the job store, unless the jobs are disabled by an empty `LEANSERVER_JOB_STORE_PATH`."""
+    if job_store is None:
+        raise HTTPException(status_code=501, detail="Jobs are disabled")
+    return job_store
+
+
+async def iter_verify_results(
+    body: VerifyRequestBody, lean_repl: lean_repl_dep, tenant: str = ""
+):
+    """Verify the codes of a request, yielding `(index, result)` as soon as each one completes."""
     codes = body.codes
     timeout = body.timeout
     infotree_type = body.infotree_type
     disable_cache = body.disable_cache
 
-    tasks = [
-        process_one_code_with_repl_fast(
-            code, timeout, infotree_type, lean_repl, disable_cache=disable_cache
-        )
-        for code in codes
-    ]
-
-    # Await the results of all the tasks concurrently
-    results_data = await asyncio.gather(*tasks)
+    completed: asyncio.Queue[tuple[int, dict] | Exception] = asyncio.Queue()
+    cache_keys = [None] * len(codes)
+    timings = [Timing() for _ in codes]
 
-    results = []
-    for result in results_data:
+    def on_result(idx, result):
         custom_id, error, response = result
-        results.append(
-            {
-                "custom_id": custom_id,
-                "error": error,
-                "response": response,
-            }
+        if cache_keys[idx] is not None and error is None and response is not None:
+            result_cache.put(cache_keys[idx], response)
+        item = {"custom_id": custom_id, "error": error, "response": response}
+        if body.include_timing:
+            item["timing"] = timings[idx].to_dict()
+        completed.put_nowait((idx, item))
+
+    # Look up the results already verified with the same header, body and timeout class
+    since = time.perf_counter()
+    split_proofs = []
+    for idx, code in enumerate(codes):
+        proof = code.get_proof_content()
+        proof_header, proof_body = (
+            split_proof_header(proof) if proof is not None else ("", "")
         )
+        split_proofs.append((proof_header, proof_body))
+        if proof is not None and not disable_cache:
+            cache_keys[idx] = result_cache.key(
+                proof_header, proof_body, timeout, infotree_type
+            )
+    cached = await result_cache.aget_many([key for key in cache_keys if key])
+    lookup_time = time.perf_counter() - since
+
+    # Group the codes by header, so that a group is pipelined through warm REPLs
+    groups: dict[str, list[int]] = {}
+    one_pass_indices = []
+    for idx, code in enumerate(codes):
+        proof_header, _ = split_proofs[idx]
+        if cache_keys[idx] is not None:
+            timings[idx].phases["cache_lookup"] += lookup_time
+            response = cached.get(cache_keys[idx])
+            if response is not None:
+                timings[idx].result_cache_hit = True
+                cache_keys[idx] = None
+                on_result(idx, (code.custom_id, None, response))
+                continue
 
-    return {"results": results}
+        if len(proof_header.strip()) == 0 or disable_cache:
+            one_pass_indices.append(idx)
+        else:
+            groups.setdefault(proof_header, []).append(idx)
+
+    async def run_one_pass(idx):
+        result = await process_one_code_with_repl_fast(
+            codes[idx],
+            timeout,
+            infotree_type,
+            lean_repl,
+            disable_cache=disable_cache,
+            timing=timings[idx],
+            tenant=tenant,
+            priority=body.priority,
+        )
+        on_result(idx, result)
+
+    async def run_group(proof_header, indices):
+        await process_header_group(
+            proof_header,
+            [codes[idx] for idx in indices],
+            timeout,
+            infotree_type,
+            lean_repl,
+            on_result=lambda i, result: on_result(indices[i], result),
+            timings=[timings[idx] for idx in indices],
+            tenant=tenant,
+            priority=body.priority,
+        )
+
+    async def run(coro):
+        # Forward failures to the consumer instead of leaving it waiting
+        try:
+            await coro
+        except Exception as e:
+            completed.put_nowait(e)
+
+    tasks = [asyncio.create_task(run(run_one_pass(idx))) for idx in one_pass_indices]
+    tasks.extend(
+        asyncio.create_task(run(run_group(proof_header, indices)))
+        for proof_header, indices in groups.items()
+    )
+
+    try:
+        for _ in range(len(codes)):
+            item = await completed.get()
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Stop the remaining work if the consumer went away or a task failed
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
 
 async def process_one_code_with_repl_fast(
@@ -227,72 +707,208 @@ async def process_one_code_with_repl_fast(
     infotree_type: str | None,
     repl: lean_repl_dep,
     disable_cache: bool = False,
+    timing: Timing | None = None,
+    tenant: str = "",
+    priority: int = 0,
 ):
-    # Throttle the incoming request
-    async with semaphore:
-        error_msg = None
-        response = None
-        grepl_id = str(uuid.uuid4())
-
-        custom_id = code.custom_id
-        proof = code.get_proof_content()
+    custom_id = code.custom_id
+    proof = code.get_proof_content()
+
+    if proof is None:
+        return custom_id, "No code provided", None
+
+    proof_header, _ = split_proof_header(proof)
+
+    # Codes with a header go through the REPL cache
+    if len(proof_header.strip()) > 0 and not disable_cache:
+        (result,) = await process_header_group(
+            proof_header,
+            [code],
+            timeout,
+            infotree_type,
+            repl,
+            timings=[timing],
+            tenant=tenant,
+            priority=priority,
+        )
+        return result
 
-        if proof is None:
-            return custom_id, "No code provided", response
+    if timing is None:
+        timing = Timing()
 
-        proof_header, proof_body = split_proof_header(proof)
+    # Throttle the incoming request, sharing the capacity fairly between tenants
+    async with scheduler.slot(tenant, priority):
+        timing.dequeued()
+        error_msg = None
+        response = None
 
-        # if we can not found the proof header, create a new repl
-        if len(proof_header.strip()) == 0 or disable_cache:
-            lean_repl = LeanREPL()
-            try:
-                response = await asyncio.to_thread(
-                    lean_repl.one_pass_verify, proof, timeout, infotree_type
-                )
-            except LeanCrashError as e:
-                error_msg = str(e)
-            finally:
-                del lean_repl
-            return custom_id, error_msg, response
+        # if we can not found the proof header, use a fresh repl
+        lean_repl = await _lease_clean_repl(timing)
+        start_time = time.perf_counter()
+        try:
+            response = await lean_repl.one_pass_verify(proof, timeout, infotree_type)
+        except LeanCrashError as e:
+            error_msg = str(e)
+            _count_failure(e)
+        finally:
+            verify_latency.observe(timing.command("elaboration", lean_repl, start_time))
+            await lean_repl.close()
+        return custom_id, error_msg, response
 
-        # Get lean repl instance from the lrucache
-        repl[grepl_id] = await repl_cache.get(proof_header)
 
-        # If we can not get the repl from the lrucache, we will create a new repl
-        if repl[grepl_id][0] is None:
-            repl[grepl_id] = None, LeanREPL()
+async def process_header_group(
+    proof_header: str,
+    codes: list[Code],
+    timeout: int,
+    infotree_type: str | None,
+    repl: lean_repl_dep,
+    on_result: Callable[[int, tuple], None] | None = None,
+    timings: list[Timing | None] | None = None,
+    tenant: str = "",
+    priority: int = 0,
+):
+    """
+    Verify codes sharing `proof_header` by pipelining them through a few REPLs.
+
+    Each worker leases a REPL only once it holds a scheduler slot, and returns
+    it to the cache before releasing the slot, so that workers waiting for a
+    slot never hold warm REPLs the other requests of the header could use.
+    A header missing from the cache is imported by one worker, the others
+    wait for it without a slot, so that a burst on a new header imports it
+    once and pre-warms the other REPLs instead of importing it in every slot.
+    `on_result` is called with the index and the result of each code as soon as
+    it completes, and `timings` collect the latency breakdown of each code.
+    """
+    results: list[tuple | None] = [None] * len(codes)
+    pending = deque(enumerate(codes))
+    if timings is None:
+        timings = [None] * len(codes)
+    timings = [timing or Timing() for timing in timings]
+    n_workers = min(len(codes), settings.MAX_CONCURRENT_REQUESTS)
+
+    async def worker():
+        grepl_id = str(uuid.uuid4())
+        repl[grepl_id] = None
 
-            # And import the proof header
-            try:
-                response = await asyncio.to_thread(
-                    repl[grepl_id][1].create_env, proof_header, timeout
+        while pending:
+            await repl_cache.wait_for_repl(proof_header)
+            if not pending:
+                break
+            idx, code = pending.popleft()
+            _, proof_body = split_proof_header(code.get_proof_content())
+            timing = timings[idx]
+
+            # Throttle the incoming request, sharing the capacity fairly between tenants
+            async with scheduler.slot(tenant, priority):
+                timing.dequeued()
+                leased, error_msg = await _lease_header_repl(
+                    proof_header, repl, grepl_id, timeout, timing, len(pending) + 1
                 )
-            except LeanCrashError as e:
-                error_msg = str(e)
-                return custom_id, error_msg, response
-
+                if not leased and error_msg is None:
+                    # Another request started importing the header meanwhile
+                    pending.appendleft((idx, code))
+                    continue
+                if error_msg is not None:
+                    response = None
+                else:
+                    error_msg, response = await process_body_with_repl(
+                        proof_header,
+                        proof_body,
+                        timeout,
+                        infotree_type,
+                        repl,
+                        grepl_id,
+                        timing,
+                    )
+                await _return_repl(proof_header, repl, grepl_id)
+            results[idx] = code.custom_id, error_msg, response
+            if on_result is not None:
+                on_result(idx, results[idx])
+
+    await asyncio.gather(*(worker() for _ in range(n_workers)))
+    return results
+
+
+async def _return_repl(proof_header, repl, grepl_id):
+    """Release the REPL leased under `grepl_id` back to the cache, if it is still alive."""
+    if repl[grepl_id] is not None:
+        id, lean_repl = repl[grepl_id]
+        await repl_cache.release(proof_header, id, lean_repl)
+    repl[grepl_id] = None
+
+
+async def _lease_header_repl(proof_header, repl, grepl_id, timeout, timing, demand=1):
+    """Lease a warm REPL of the header under `grepl_id`, or import the header on a clean one.
+
+    Returns:
+        tuple: (whether a REPL is leased, the error of a failed header import). With
+            neither, another request imports the header: wait for one of its REPLs.
+    """
+    since = time.perf_counter()
+    lease = await repl_cache.acquire(proof_header, demand)
+    timing.add("cache_lookup", since)
+    if lease is None:
+        return False, None
+    id, lean_repl = lease
+    if id is not None:
+        timing.cache_hit = True
+        repl[grepl_id] = id, lean_repl
+        return True, None
+
+    # Import the header on the request path, the REPL joins the cache once imported
+    timing.cache_hit = False
+    try:
+        lean_repl = await _lease_clean_repl(timing)
+        start_time = time.perf_counter()
         try:
-            response = await asyncio.to_thread(
-                repl[grepl_id][1].extend_env,
-                0,
-                proof_body,
-                timeout,
-                infotree_type,
-            )
+            _, restored = await _import_header(lean_repl, proof_header, timeout)
         except LeanCrashError as e:
-            error_msg = str(e)
-            if repl[grepl_id][0] is None:
-                await repl_cache.destroy(proof_header, *repl[grepl_id])
-            return custom_id, error_msg, response
+            await _discard_repl(proof_header, None, lean_repl, e)
+            return False, str(e)
+        latency = timing.command("header_import", lean_repl, start_time)
+        if not restored:
+            import_latency.observe(latency)
+            # Pre-warm a REPL to pickle the environment, off the request path
+            if env_cache.enabled and not repl_cache.create_queue.pending[proof_header]:
+                repl_cache.create(proof_header)
+        repl[grepl_id] = repl_cache.put_leased(proof_header, lean_repl), lean_repl
+    finally:
+        repl_cache.end_import(proof_header)
+    return True, None
 
-        # Successfully extended the context, release the REPL back to the cache
-        if repl[grepl_id][0] is None:
-            await repl_cache.put(proof_header, repl[grepl_id][1])
-        else:
-            await repl_cache.release(proof_header, *repl[grepl_id])
 
+async def process_body_with_repl(
+    proof_header: str,
+    proof_body: str,
+    timeout: int,
+    infotree_type: str | None,
+    repl: lean_repl_dep,
+    grepl_id: str,
+    timing: Timing | None = None,
+):
+    """Verify a proof body on the REPL leased under `grepl_id`."""
+    response = None
+    if timing is None:
+        timing = Timing()
+
+    lean_repl = repl[grepl_id][1]
+    start_time = time.perf_counter()
+    try:
+        response = await lean_repl.extend_env(
+            lean_repl.header_env,
+            proof_body,
+            timeout,
+            infotree_type,
+        )
+    except LeanCrashError as e:
+        verify_latency.observe(timing.command("elaboration", lean_repl, start_time))
+        # The REPL is dead or poisoned, a pooled one gets replaced to keep the pool size
+        await _discard_repl(proof_header, *repl[grepl_id], e)
         repl[grepl_id] = None
-        return custom_id, error_msg, response
+        return str(e), response
+
+    verify_latency.observe(timing.command("elaboration", lean_repl, start_time))
+    return None, response
 
 
 @app.post("/one_pass_verify_batch")
@@ -300,9 +916,11 @@ async def one_pass_verify_batch(
     body: VerifyRequestBody,
     lean_repl: lean_repl_dep,
     access: require_access_dep,
+    tenant: tenant_dep,
 ):
     """Backward compatible endpoint: accepts both 'proof' / 'code' fields."""
-    return await verify(body, lean_repl, access)
+    return await verify(body, lean_repl, access, tenant)
 
 
 app.include_router(router)
+app.include_router(metrics_router)
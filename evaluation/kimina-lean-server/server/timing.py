@@ -0,0 +1,40 @@
+import time
+
+PHASES = ["queue_wait", "cache_lookup", "header_import", "elaboration", "serialization"]
+
+
+class Timing:
+    """Latency breakdown of the verification of one code, in seconds."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.cache_hit = False  # Whether the REPL already had the header imported
+        self.result_cache_hit = False  # Whether the result was served from the cache
+
+    def add(self, phase, since):
+        """Add the time elapsed since `since` to a phase, and return the current time."""
+        now = time.perf_counter()
+        self.phases[phase] += now - since
+        return now
+
+    def dequeued(self):
+        """Account the time since arrival that no other phase explains as queue wait."""
+        other = sum(t for phase, t in self.phases.items() if phase != "queue_wait")
+        self.phases["queue_wait"] = max(0.0, time.perf_counter() - self.start - other)
+
+    def command(self, phase, repl, since):
+        """Split the time of a REPL command between `phase` and serialization."""
+        elapsed = time.perf_counter() - since
+        serialization = min(repl.serialization_time, elapsed)
+        self.phases["serialization"] += serialization
+        self.phases[phase] += elapsed - serialization
+        return elapsed
+
+    def to_dict(self):
+        return {
+            **self.phases,
+            "total": time.perf_counter() - self.start,
+            "cache_hit": self.cache_hit,
+            "result_cache_hit": self.result_cache_hit,
+        }
@@ -3,7 +3,9 @@ import pytest
 from client import Lean4Client
 
 
-@pytest.fixture(scope="module", autouse=True)
+# Only the tests which take the fixture need a server running
+@pytest.fixture(scope="module")
 def lean4client():
     client = Lean4Client(base_url="http://127.0.0.1:12332")
-    return client
+    yield client
+    client.close()
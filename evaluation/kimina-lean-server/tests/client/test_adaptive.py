@@ -0,0 +1,56 @@
+import time
+
+from client.adaptive import AIMDController
+
+
+def test_additive_increase_multiplicative_decrease():
+    controller = AIMDController(max_batch_size=64, max_concurrency=8, timeout=60)
+    assert controller.next_batch_size() == 16
+    assert controller.max_in_flight() == 2
+
+    for _ in range(100):
+        controller.on_batch(time.monotonic(), 1.0)
+    assert controller.next_batch_size() == 64
+    assert controller.max_in_flight() == 8
+
+    # A batch slower than the timeout halves the window once per congestion episode
+    started = time.monotonic()
+    controller.on_batch(started, 90.0)
+    controller.on_batch(started, 90.0)
+    assert controller.next_batch_size() == 32
+    assert controller.max_in_flight() == 4
+
+    # Requests refused by an overloaded server are congestion
+    controller.on_batch(time.monotonic(), 1.0, overloaded=True)
+    assert controller.next_batch_size() == 16
+    controller.on_batch(time.monotonic(), 1.0)
+    assert controller.next_batch_size() == 17
+
+
+def test_server_queue_pauses_growth():
+    controller = AIMDController(max_batch_size=64, max_concurrency=8, timeout=60)
+    controller.on_queue(waiting=10, active=8)
+    controller.on_batch(time.monotonic(), 1.0)
+    assert controller.next_batch_size() == 16
+
+    controller.on_queue(waiting=20, active=8)
+    assert controller.next_batch_size() == 8
+    # The next polls wait a round trip for the decrease to drain the queue
+    controller.on_queue(waiting=20, active=8)
+    assert controller.next_batch_size() == 8
+    controller.last_decrease -= controller.rtt
+    controller.on_queue(waiting=20, active=8)
+    assert controller.next_batch_size() == 4
+
+    controller.on_queue(waiting=0, active=8)
+    controller.on_batch(time.monotonic(), 1.0)
+    assert controller.next_batch_size() == 5
+
+
+def test_queue_decrease_waits_for_a_poll_interval():
+    controller = AIMDController(
+        max_batch_size=64, max_concurrency=8, timeout=60, status_interval=5
+    )
+    controller.on_queue(waiting=20, active=8)
+    controller.on_queue(waiting=20, active=8)
+    assert controller.stats["decreases"] == 1
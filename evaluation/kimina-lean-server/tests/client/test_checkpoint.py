@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+from client.checkpoint import ResultCheckpoint
+from client.client import batch_verify_proof
+
+from .test_dedup import FakeClient
+
+
+class CrashingClient(FakeClient):
+    """Fails after verifying `limit` batches, like a server going down mid-run."""
+
+    def __init__(self, limit):
+        super().__init__()
+        self.limit = limit
+
+    async def async_verify(self, codes, timeout, infotree_type=None):
+        if self.limit == 0:
+            raise RuntimeError("server went away")
+        self.limit -= 1
+        return await super().async_verify(codes, timeout, infotree_type)
+
+
+def _samples(n):
+    return [
+        {"custom_id": str(i), "proof": f"theorem t{i} : {i} = {i} := rfl"}
+        for i in range(n)
+    ]
+
+
+def test_resume_skips_checkpointed_results(tmp_path):
+    path = tmp_path / "run.jsonl"
+    samples = _samples(6)
+
+    with pytest.raises(Exception):
+        batch_verify_proof(
+            CrashingClient(limit=2),
+            samples,
+            num_proc=1,
+            batch_size=2,
+            checkpoint=str(path),
+        )
+    checkpoint = ResultCheckpoint(str(path))
+    checkpointed = set(checkpoint.results)
+    checkpoint.close()
+    assert len(checkpointed) == 4
+
+    client = FakeClient()
+    received = []
+    results = batch_verify_proof(
+        client,
+        samples,
+        num_proc=1,
+        batch_size=2,
+        on_result=received.append,
+        checkpoint=str(path),
+    )
+    assert sorted(client.verified) == sorted(set("012345") - checkpointed)
+    assert [result["custom_id"] for result in results] == list("012345")
+    assert sorted(result["custom_id"] for result in received) == list("012345")
+
+
+def test_truncated_line_is_ignored(tmp_path):
+    path = tmp_path / "run.jsonl"
+    path.write_text('{"custom_id": "a", "error": null}\n{"custom_id": "b", "err')
+
+    checkpoint = ResultCheckpoint(str(path))
+    assert "a" in checkpoint and "b" not in checkpoint
+    checkpoint.append({"custom_id": "b", "error": None})
+    checkpoint.append({"custom_id": "b", "error": "ignored"})
+    checkpoint.close()
+
+    checkpoint = ResultCheckpoint(str(path))
+    assert sorted(checkpoint.results) == ["a", "b"]
+    assert checkpoint.results["b"]["error"] is None
+    checkpoint.close()
+
+
+def test_repl_failures_are_verified_again(tmp_path):
+    path = tmp_path / "run.jsonl"
+    crashed = {"custom_id": "b", "error": "Lean process encountered an error: oom"}
+    path.write_text(
+        json.dumps({"custom_id": "a", "error": None})
+        + "\n"
+        + json.dumps(crashed)
+        + "\n"
+    )
+
+    checkpoint = ResultCheckpoint(str(path))
+    assert "a" in checkpoint and "b" not in checkpoint
+    checkpoint.append({**crashed, "custom_id": "c"})
+    assert "c" not in checkpoint
+    checkpoint.close()
+
+    client = FakeClient()
+    samples = [{"custom_id": c, "proof": f"def {c} := 0"} for c in "abc"]
+    results = batch_verify_proof(client, samples, checkpoint=str(path))
+    assert client.verified == ["b", "c"]
+    assert [result["error"] for result in results] == [None] * 3
+    checkpoint = ResultCheckpoint(str(path))
+    assert sorted(checkpoint.results) == ["a", "b", "c"]
+    checkpoint.close()
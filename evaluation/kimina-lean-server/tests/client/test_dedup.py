@@ -0,0 +1,61 @@
+import asyncio
+
+from client.client import batch_verify_proof
+
+
+class FakeClient:
+    """Records the verified codes instead of sending them to a server."""
+
+    def __init__(self):
+        self.verified = []
+
+    def _run(self, coro):
+        return asyncio.run(coro)
+
+    async def async_verify(self, codes, timeout, infotree_type=None):
+        self.verified.extend(code["custom_id"] for code in codes)
+        return {
+            "results": [
+                {"custom_id": code["custom_id"], "error": None, "response": {}}
+                for code in codes
+            ]
+        }
+
+
+def test_copies_are_verified_once():
+    proof = "theorem x : True := by\n  trivial"
+    samples = [
+        {"custom_id": "a", "proof": proof},
+        {"custom_id": "b", "proof": proof + "  \n\n"},
+        {"custom_id": "c", "proof": proof.replace("by", "by -- note")},
+        {"custom_id": "d", "proof": "theorem y : 1 = 1 := rfl"},
+    ]
+    received = []
+
+    client = FakeClient()
+    results = batch_verify_proof(client, samples, on_result=received.append)
+    assert client.verified == ["a", "c", "d"]
+    assert [result["custom_id"] for result in results] == ["a", "b", "c", "d"]
+    assert sorted(result["custom_id"] for result in received) == ["a", "b", "c", "d"]
+
+    client = FakeClient()
+    results = batch_verify_proof(client, samples, strip_comments=True)
+    assert client.verified == ["a", "d"]
+    assert len(results) == 4
+
+    client = FakeClient()
+    batch_verify_proof(client, samples, dedup=False)
+    assert sorted(client.verified) == ["a", "b", "c", "d"]
+
+
+def test_results_follow_the_samples_order():
+    proof = "theorem x : True := by\n  trivial"
+    samples = [
+        {"custom_id": "a", "proof": proof},
+        {"custom_id": "d", "proof": "theorem y : 1 = 1 := rfl"},
+        {"custom_id": "e", "proof": "theorem z : 2 = 2 := rfl"},
+        {"custom_id": "b", "proof": proof},
+    ]
+    # The batches complete in any order, the copy of "a" comes after "e"
+    results = batch_verify_proof(FakeClient(), samples, batch_size=1)
+    assert [result["custom_id"] for result in results] == ["a", "d", "e", "b"]
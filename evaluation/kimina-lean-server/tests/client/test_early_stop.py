@@ -0,0 +1,46 @@
+from client.client import batch_verify_early_stop
+
+from .test_dedup import FakeClient
+
+
+def _problem(name):
+    return [
+        {"custom_id": f"{name}_{i}", "proof": f"theorem {name}{i} : True := trivial"}
+        for i in range(8)
+    ]
+
+
+def _is_passed(result):
+    # Problem a passes at its first candidate, b at its 6th and 7th, c never
+    return result["custom_id"] in {"a_0", "b_5", "b_6"}
+
+
+def test_problems_stop_at_their_first_pass():
+    problems = [_problem("a"), _problem("b"), _problem("c")]
+
+    client = FakeClient()
+    results, stats = batch_verify_early_stop(
+        client, problems, wave_size=2, is_passed=_is_passed
+    )
+    # Wave 1 sends 2 candidates per problem, wave 2 the next 4 of b and c
+    assert sorted(client.verified) == sorted(
+        ["a_0", "a_1"] + [f"b_{i}" for i in range(6)] + [f"c_{i}" for i in range(8)]
+    )
+    assert len(results) == len(client.verified)
+    assert stats == {
+        "candidates": 24,
+        "verified": 16,
+        "skipped": 8,
+        "saved_ratio": 1 / 3,
+        "waves": 3,
+    }
+
+
+def test_required_passes():
+    problems = [_problem("b")]
+
+    client = FakeClient()
+    _, stats = batch_verify_early_stop(
+        client, problems, passes=2, wave_size=2, is_passed=_is_passed
+    )
+    assert stats["verified"] == 8
@@ -0,0 +1,184 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+from client.client import Lean4Client
+from client.retry import (
+    LEAN_ERROR,
+    OVERLOAD,
+    REPL_FAILURE,
+    TRANSPORT,
+    RetryPolicy,
+    classify_exception,
+    classify_result,
+)
+
+CRASH = "Lean process encountered an error: killed"
+
+
+def _error(status):
+    return aiohttp.ClientResponseError(None, (), status=status)
+
+
+def test_classification():
+    assert classify_exception(aiohttp.ServerDisconnectedError()) == TRANSPORT
+    assert classify_exception(_error(503)) == OVERLOAD
+    assert classify_exception(_error(500)) == TRANSPORT
+    assert classify_exception(_error(401)) is None
+    assert classify_exception(ValueError()) is None
+
+    assert classify_result({"error": CRASH}) == REPL_FAILURE
+    assert classify_result({"error": "Lean process timed out"}) == LEAN_ERROR
+    assert classify_result({"error": "No code provided"}) == LEAN_ERROR
+    messages = [{"severity": "error", "data": "unknown identifier"}]
+    assert classify_result({"error": None, "response": {"messages": messages}}) == (
+        LEAN_ERROR
+    )
+    assert classify_result({"error": None, "response": {"env": 0}}) is None
+
+
+def test_budget_per_code_and_class():
+    policy = RetryPolicy({REPL_FAILURE: 1, TRANSPORT: 2})
+    assert policy.retry("a", REPL_FAILURE)
+    assert not policy.retry("a", REPL_FAILURE)
+    assert policy.retry("b", REPL_FAILURE)
+    assert policy.retry_all(["a", "b"], TRANSPORT)
+    assert policy.retry_all(["a", "b"], TRANSPORT)
+    assert not policy.retry_all(["a", "b"], TRANSPORT)
+    assert policy.stats == {TRANSPORT: 4, OVERLOAD: 0, REPL_FAILURE: 2}
+
+
+class FlakyClient(Lean4Client):
+    """Answers `/verify` and `/verify/stream` from a script of failures instead of a server."""
+
+    def __init__(self, script, retries=None):
+        # A step of the script is an exception to raise, a response without results,
+        # or the error of each custom id
+        super().__init__("http://lean", test_connection=False, retries=retries)
+        self.script = script
+        self.sent = []
+
+    async def _request(self, method, endpoint, json_data=None):
+        codes = json_data["codes"]
+        self.sent.append([code["custom_id"] for code in codes])
+        failure = self.script.pop(0)
+        if isinstance(failure, Exception):
+            raise failure
+        if "detail" in failure:
+            return failure
+        return {
+            "results": [
+                {
+                    "custom_id": code["custom_id"],
+                    "error": failure.get(code["custom_id"]),
+                    "response": {"env": 0},
+                }
+                for code in codes
+            ]
+        }
+
+    async def _stream_verify(self, codes, timeout, infotree_type=None):
+        self.sent.append([code["custom_id"] for code in codes])
+        # Answers the first code, then fails if the script says so
+        failure = self.script.pop(0)
+        yield {"custom_id": codes[0]["custom_id"], "error": None, "response": {}}
+        if isinstance(failure, Exception):
+            raise failure
+        for code in codes[1:]:
+            yield {"custom_id": code["custom_id"], "error": None, "response": {}}
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(RetryPolicy, "delay", lambda self, attempt: 0)
+
+
+def test_only_failed_codes_are_retried():
+    codes = [{"custom_id": c, "proof": ""} for c in "abc"]
+    client = FlakyClient(
+        [
+            aiohttp.ServerDisconnectedError(),
+            {"b": CRASH, "c": "No code provided"},
+            {},
+        ]
+    )
+    response = client.verify(codes, timeout=60)
+    client.close()
+
+    assert client.sent == [["a", "b", "c"], ["a", "b", "c"], ["b"]]
+    assert [result["error"] for result in response["results"]] == [
+        None,
+        None,
+        "No code provided",
+    ]
+    assert client.retry_stats == {TRANSPORT: 3, OVERLOAD: 0, REPL_FAILURE: 1}
+
+
+def test_exhausted_budget():
+    codes = [{"custom_id": "a", "proof": ""}]
+    client = FlakyClient([{"a": CRASH}] * 2, retries={REPL_FAILURE: 1})
+    response = client.verify(codes, timeout=60)
+    assert response["results"][0]["error"] == CRASH
+
+    client.script = [_error(503), _error(401)]
+    with pytest.raises(aiohttp.ClientResponseError):
+        client.verify(codes, timeout=60)
+    client.close()
+    assert client.sent[-2:] == [["a"], ["a"]]
+
+
+def test_stream_resends_unanswered_codes():
+    codes = [{"custom_id": c, "proof": ""} for c in "abc"]
+    client = FlakyClient([aiohttp.ClientPayloadError(), {}])
+
+    async def collect():
+        return [
+            result["custom_id"]
+            async for result in client.async_verify_stream(codes, timeout=60)
+        ]
+
+    assert sorted(client._run(collect())) == ["a", "b", "c"]
+    client.close()
+    assert client.sent == [["a", "b", "c"], ["b", "c"]]
+
+
+def test_timeouts_are_not_retried():
+    codes = [{"custom_id": "a", "proof": ""}]
+    client = FlakyClient([{"a": "Lean process timed out"}])
+    response = client.verify(codes, timeout=60)
+    client.close()
+    assert response["results"][0]["error"] == "Lean process timed out"
+    assert client.sent == [["a"]]
+
+
+def test_error_response_of_a_retry_keeps_the_results():
+    codes = [{"custom_id": c, "proof": ""} for c in "ab"]
+    client = FlakyClient([{"b": CRASH}, {"detail": "Invalid API key"}])
+    response = client.verify(codes, timeout=60)
+    assert [result["error"] for result in response["results"]] == [
+        None,
+        "Invalid API key",
+    ]
+
+    # The error response of the first round is returned as is
+    client.script = [{"detail": "Invalid API key"}]
+    assert client.verify(codes, timeout=60) == {"detail": "Invalid API key"}
+    client.close()
+
+
+def test_sync_calls_from_a_running_loop_share_one_session():
+    client = Lean4Client("http://localhost:1", test_connection=False)
+
+    async def session():
+        return client._get_session()
+
+    async def notebook():
+        # As in Jupyter, where the synchronous methods run from a running loop
+        return client._run(session()), client._run(session())
+
+    first, second = asyncio.run(notebook())
+    assert first is second
+    assert client._run(session()) is first
+    client.close()
+    assert first.closed
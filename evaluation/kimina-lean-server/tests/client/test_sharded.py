@@ -0,0 +1,150 @@
+from collections import Counter
+
+import aiohttp
+import pytest
+from multidict import CIMultiDict
+from yarl import URL
+
+from client.client import Lean4Client, batch_verify_proof
+
+from client.retry import OVERLOAD, TRANSPORT
+from client.sharded import HashRing, ShardedLean4Client
+
+
+def test_hash_ring_moves_few_keys():
+    endpoints = [f"http://lean{i}:12332" for i in range(4)]
+    ring = HashRing(endpoints)
+    keys = [f"import Mathlib\nimport Header{i}" for i in range(1000)]
+    owners = {key: ring.preference(key)[0] for key in keys}
+
+    # Every endpoint owns a fair share of the headers
+    assert min(Counter(owners.values()).values()) > 150
+    assert sorted(ring.preference(keys[0])) == endpoints
+
+    # Removing an endpoint only moves its own headers
+    smaller = HashRing(endpoints[:3])
+    moved = [key for key in keys if smaller.preference(key)[0] != owners[key]]
+    assert all(owners[key] == endpoints[3] for key in moved)
+
+
+class FakeShards:
+    """Answers the requests of the endpoint clients instead of Lean servers."""
+
+    def __init__(self, down=(), waiting=0):
+        self.down = set(down)
+        self.refused = set()  # Endpoints answering the verifications with a 503
+        self.waiting = waiting
+        self.verified = {}  # custom_ids verified by endpoint
+
+    async def request(self, client, method, endpoint, json_data=None):
+        if client.url in self.down:
+            raise aiohttp.ClientConnectionError(f"{client.url} is down")
+        if endpoint == "/health":
+            return {"status": "healthy"}
+        if endpoint == "/status":
+            return {"scheduler": {"waiting": self.waiting, "active": 0}}
+        if client.url in self.refused:
+            url = URL(client.url + endpoint)
+            request_info = aiohttp.RequestInfo(url, method.upper(), CIMultiDict(), url)
+            raise aiohttp.ClientResponseError(request_info, (), status=503)
+        codes = json_data["codes"]
+        self.verified.setdefault(client.url, []).extend(
+            code["custom_id"] for code in codes
+        )
+        return {
+            "results": [
+                {"custom_id": code["custom_id"], "error": None, "response": {"env": 0}}
+                for code in codes
+            ]
+        }
+
+
+@pytest.fixture
+def shards(monkeypatch):
+    shards = FakeShards()
+
+    async def request(client, method, endpoint, json_data=None):
+        return await shards.request(client, method, endpoint, json_data)
+
+    monkeypatch.setattr(Lean4Client, "_request", request)
+    return shards
+
+
+def test_sharded_client_skips_unavailable_endpoints(shards):
+    shards.down.add("http://lean1:12332")
+    client = ShardedLean4Client(["http://lean0:12332", "http://lean1:12332"])
+    assert client.healthy == {"http://lean0:12332"}
+
+    samples = [
+        {"custom_id": str(i), "proof": f"import Mathlib\n\ndef f := {i}"}
+        for i in range(4)
+    ]
+    results = batch_verify_proof(client, samples, timeout=60, batch_size=2)
+    client.close()
+    assert sorted(r["custom_id"] for r in results) == ["0", "1", "2", "3"]
+    assert all(r["error"] is None for r in results)
+    assert list(shards.verified) == ["http://lean0:12332"]
+
+
+def test_results_keep_the_order_of_identical_codes(shards):
+    shards.waiting = 7
+    urls = [f"http://lean{i}:12332" for i in range(3)]
+    client = ShardedLean4Client(urls)
+    code = {"custom_id": "same", "proof": "import Mathlib\n\ndef f := 0"}
+    codes = [code, {"custom_id": "other", "proof": "def g := 0"}, code]
+
+    results = client.verify(codes, timeout=60)["results"]
+    client.close()
+    assert [r["custom_id"] for r in results] == ["same", "other", "same"]
+    # The queue depth of the endpoints is refreshed after each batch
+    assert all(client.queue_depth[url] == 7 for url in shards.verified)
+    assert all(load == 0 for load in client.in_flight.values())
+
+
+def test_overloaded_endpoint_hands_codes_over(shards):
+    urls = ["http://lean0:12332", "http://lean1:12332"]
+    client = ShardedLean4Client(urls)
+
+    code = {"custom_id": "0", "proof": "import Mathlib\n\ndef f := 0"}
+    owner = client.route(code)
+    client.queue_depth[owner] = 100
+    assert client.route(code) != owner
+    client.close()
+
+
+def test_stream_answers_every_code_once(shards):
+    async def fake_stream(client, codes, timeout, infotree_type=None):
+        response = await shards.request(client, "post", "/verify", {"codes": codes})
+        for result in response["results"]:
+            yield result
+
+    client = ShardedLean4Client(["http://lean0:12332", "http://lean1:12332"])
+    for endpoint in client.clients.values():
+        endpoint._stream_verify = fake_stream.__get__(endpoint)
+    codes = [
+        {"custom_id": str(i), "proof": f"import Header{i}\n\ndef f := 0"}
+        for i in range(6)
+    ]
+
+    async def verify():
+        return [r async for r in client.async_verify_stream(codes, timeout=60)]
+
+    results = client._run(verify())
+    client.close()
+    assert sorted(r["custom_id"] for r in results) == list("012345")
+    assert len(shards.verified) == 2
+
+
+def test_refused_codes_count_as_overload(shards):
+    shards.refused.add("http://lean1:12332")
+    client = ShardedLean4Client(["http://lean0:12332", "http://lean1:12332"])
+    codes = [
+        {"custom_id": str(i), "proof": f"import Mathlib\nimport Header{i}"}
+        for i in range(20)
+    ]
+    results = client.verify(codes, timeout=60)["results"]
+    client.close()
+    assert all(r["error"] is None for r in results)
+    # The codes first routed to the refusing endpoint were rerouted as overloaded
+    assert 0 < client.retry_stats[OVERLOAD] < 20
+    assert client.retry_stats[TRANSPORT] == 0
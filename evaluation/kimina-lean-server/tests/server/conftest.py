@@ -1,10 +1,16 @@
 import pytest
 from fastapi.testclient import TestClient
 
+import server.server as srv
 from server import app
+from utils.job_store import JobStore
 
 
 @pytest.fixture(scope="module", autouse=True)
-def test_client():
+def test_client(tmp_path_factory):
+    # The lifespan, which opens the job store, does not run outside a `with` block
+    srv.job_store = JobStore(str(tmp_path_factory.mktemp("jobs") / "jobs.sqlite"))
     tc = TestClient(app)
     yield tc
+    srv.job_store.close()
+    srv.job_store = None
@@ -1,11 +1,20 @@
+import asyncio
+import json
 import os
 import textwrap
 import time
 import uuid
 
 import psutil
-
-from server.leanrepl import LeanREPL
+import pytest
+
+from server.leanrepl import (
+    AsyncLeanREPL,
+    LeanREPL,
+    LeanTimeoutError,
+    StderrBuffer,
+    is_fatal_stderr,
+)
 from utils.proof_utils import has_error_response, parse_client_response
 
 
@@ -36,6 +45,113 @@ class TestLeanServer:
         assert response.status_code == 200
         assert all(r["error"] is None for r in response.json()["results"]) is True
 
+    def test_verify_mixed_headers_keeps_order(self, test_client):
+        """verifying a batch whose codes are grouped by header returns results in request order."""
+        headers = ["import Mathlib", "import Mathlib\nimport Aesop", ""]
+        codes = [
+            {
+                "custom_id": str(i),
+                "proof": f"{headers[i % 3]}\n\ndef f := {i}\nexample : f = {i} := rfl",
+            }
+            for i in range(9)
+        ]
+
+        response = test_client.post(
+            "/verify", json={"codes": codes, "timeout": self.timeout}, headers=self.headers
+        )
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert [r["custom_id"] for r in results] == [c["custom_id"] for c in codes]
+        assert all(r["error"] is None for r in results)
+        assert not any(has_error_response(r["response"]) for r in results)
+
+    def test_verify_stream(self, test_client):
+        """streaming a batch returns one NDJSON result per code."""
+        codes = [
+            {
+                "custom_id": str(i),
+                "proof": f"import Mathlib\n\ndef f := {i}\nexample : f = {i} := rfl",
+            }
+            for i in range(5)
+        ]
+
+        response = test_client.post(
+            "/verify/stream",
+            json={"codes": codes, "timeout": self.timeout},
+            headers=self.headers,
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        results = [json.loads(line) for line in response.text.splitlines() if line]
+        assert sorted(r["custom_id"] for r in results) == [c["custom_id"] for c in codes]
+        assert all(r["error"] is None for r in results)
+
+    def test_job(self, test_client):
+        """a job is verified in the background and its results are paged in code order."""
+        codes = [
+            {"custom_id": str(i), "proof": f"import Mathlib\n\ndef f := {i}"}
+            for i in range(3)
+        ]
+        response = test_client.post(
+            "/jobs", json={"codes": codes, "timeout": self.timeout}, headers=self.headers
+        )
+        job_id = response.json()["job_id"]
+
+        for _ in range(self.timeout):
+            status = test_client.get(f"/jobs/{job_id}", headers=self.headers).json()
+            if status["status"] == "completed":
+                break
+            time.sleep(1)
+        assert status["done"] == status["total"] == 3
+
+        page = test_client.get(
+            f"/jobs/{job_id}/results?limit=2", headers=self.headers
+        ).json()
+        assert [r["custom_id"] for r in page["results"]] == ["0", "1"]
+        assert page["next_offset"] == 2
+        page = test_client.get(
+            f"/jobs/{job_id}/results?offset=2", headers=self.headers
+        ).json()
+        assert [r["custom_id"] for r in page["results"]] == ["2"]
+        assert page["next_offset"] is None
+
+        assert test_client.get("/jobs/unknown", headers=self.headers).status_code == 404
+
+    def test_verify_timing(self, test_client):
+        """results carry a latency breakdown only when requested."""
+        code = {"custom_id": "0", "proof": "import Mathlib\n\ndef f := 4"}
+        data = {"codes": [code], "timeout": self.timeout, "include_timing": True}
+
+        response = test_client.post("/verify", json=data, headers=self.headers)
+        timing = response.json()["results"][0]["timing"]
+        phases = ["queue_wait", "cache_lookup", "header_import", "elaboration"]
+        assert sum(timing[phase] for phase in phases) <= timing["total"]
+        assert isinstance(timing["cache_hit"], bool)
+
+        data["include_timing"] = False
+        response = test_client.post("/verify", json=data, headers=self.headers)
+        assert "timing" not in response.json()["results"][0]
+
+    def test_metrics_are_cumulative(self, test_client):
+        """metrics are exposed as counters which are not reset on read."""
+        data = {
+            "codes": [{"custom_id": "0", "proof": "import Mathlib\n\ndef f := 3"}],
+            "timeout": self.timeout,
+            "disable_cache": True,
+        }
+        test_client.post("/verify", json=data, headers=self.headers)
+
+        status = test_client.get("/status").json()
+        assert status["verify_latency"]["count"] >= 1
+        assert test_client.get("/status").json()["repl_cache"]["cache_hits"] == (
+            status["repl_cache"]["cache_hits"]
+        )
+
+        response = test_client.get("/metrics")
+        assert response.status_code == 200
+        assert "leanserver_verify_latency_seconds_count" in response.text
+        assert "# TYPE leanserver_repl_timeouts_total counter" in response.text
+
     def test_verify_warning(self, test_client):
         """Test a proof with warnings."""
         proof_code = textwrap.dedent(
@@ -255,3 +371,60 @@ class TestLeanServer:
             # Verify the process has terminated
             assert repl.process.poll() is not None
             assert not psutil.pid_exists(pid)
+
+    def test_async_repl_extend_env_and_close(self):
+        """Test the asyncio REPL driver runs commands concurrently and closes its process group."""
+
+        async def run():
+            repls = [await AsyncLeanREPL.spawn() for _ in range(2)]
+            pids = [repl.process.pid for repl in repls]
+
+            responses = await asyncio.gather(
+                *(repl.one_pass_verify("def f := 2", timeout=60) for repl in repls)
+            )
+            assert all("env" in response for response in responses)
+
+            response = await repls[0].extend_env(
+                0, "example : f = 2 := rfl", timeout=60
+            )
+            assert not has_error_response(response)
+            assert "time" in response
+
+            for repl in repls:
+                await repl.close()
+                assert repl.process.returncode is not None
+            return pids
+
+        pids = asyncio.run(run())
+        time.sleep(0.5)
+        for pid in pids:
+            assert not psutil.pid_exists(pid)
+
+    def test_async_repl_timeout_kills_process(self):
+        """Test that a timed out command kills the REPL process group instead of leaving it running."""
+
+        async def run():
+            repl = await AsyncLeanREPL.spawn()
+            pid = repl.process.pid
+            with pytest.raises(LeanTimeoutError):
+                await repl.one_pass_verify(
+                    "example : True := by\n  sleep 100000\n  trivial", timeout=5
+                )
+            await repl.process.wait()
+            return pid
+
+        pid = asyncio.run(run())
+        time.sleep(0.5)
+        assert not psutil.pid_exists(pid)
+
+    def test_stderr_is_attributed_per_command(self):
+        """Test that stderr output is consumed incrementally and only fatal output marks a crash."""
+        buffer = StderrBuffer()
+        buffer.feed("warning: manifest out of date\n".encode())
+        buffer.feed("\xe2\x9c".encode("latin-1"))  # Split UTF-8 character
+        buffer.feed(b"\x93\n")
+        assert buffer.take() == "warning: manifest out of date\n✓\n"
+        assert buffer.take() == ""
+
+        assert not is_fatal_stderr("warning: manifest out of date\n")
+        assert is_fatal_stderr("INTERNAL PANIC: unreachable code has been reached\n")
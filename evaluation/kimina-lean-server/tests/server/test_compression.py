@@ -0,0 +1,43 @@
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from server.compression import CompressionMiddleware
+from utils.compression import compress
+
+
+async def echo(request):
+    body = await request.body()
+    return JSONResponse({"size": len(body)})
+
+
+def make_client(max_body_size):
+    app = Starlette(routes=[Route("/echo", echo, methods=["POST"])])
+    app.add_middleware(CompressionMiddleware, max_body_size=max_body_size)
+    return TestClient(app)
+
+
+def test_request_bodies_decompressed_up_to_the_limit():
+    client = make_client(max_body_size=2**20)
+    body = b"0" * 2**20
+    response = client.post(
+        "/echo", content=compress(body, "gzip"), headers={"Content-Encoding": "gzip"}
+    )
+    assert response.status_code == 200
+    assert response.json() == {"size": len(body)}
+
+    response = client.post(
+        "/echo",
+        content=compress(body + b"0", "gzip"),
+        headers={"Content-Encoding": "gzip"},
+    )
+    assert response.status_code == 413
+
+
+def test_unsupported_request_coding():
+    response = make_client(max_body_size=2**20).post(
+        "/echo", content=b"body", headers={"Content-Encoding": "br"}
+    )
+    assert response.status_code == 415
+    assert "gzip" in response.headers["Accept-Encoding"]
@@ -0,0 +1,42 @@
+import asyncio
+
+import server.server as srv
+from server.leanrepl import LeanTimeoutError
+from utils.env_cache import EnvSnapshotCache
+
+HEADER = "import Mathlib\n"
+
+
+class FakeREPL:
+    """REPL importing any header, whose pickling times out."""
+
+    header = None
+    pickled = 0
+
+    async def create_env(self, header, timeout):
+        self.header = header
+        return {"env": 0}
+
+    async def pickle_env(self, path, timeout=150):
+        self.pickled += 1
+        raise LeanTimeoutError("Lean process timed out")
+
+
+def test_header_import_does_not_pickle(monkeypatch, tmp_path):
+    monkeypatch.setattr(srv, "env_cache", EnvSnapshotCache(str(tmp_path)))
+    repl = FakeREPL()
+    assert asyncio.run(srv._import_header(repl, HEADER, 60)) == ({"env": 0}, False)
+    assert repl.pickled == 0
+
+
+def test_failed_pickling_is_logged_and_dropped(monkeypatch, tmp_path):
+    cache = EnvSnapshotCache(str(tmp_path))
+    monkeypatch.setattr(srv, "env_cache", cache)
+    repl = FakeREPL()
+    repl.header = HEADER
+    # The timed out REPL was killed, it must not be pooled
+    assert asyncio.run(srv._save_env(repl, HEADER)) is False
+    assert repl.pickled == 1
+    assert cache.stats["failures"] == 1
+    # Another REPL may pickle the header later
+    assert cache.begin_save(HEADER) is not None
@@ -0,0 +1,106 @@
+import asyncio
+
+import server.server as srv
+from server.server import Code, process_header_group
+from server.timing import Timing
+from utils.repl_cache import LRUReplCache
+from utils.scheduler import FairScheduler
+
+HEADER = "import Mathlib\n"
+
+
+class FakeREPL:
+    """Warm REPL answering every proof after a short elaboration."""
+
+    header_env = 0
+    num_commands = 0
+    elaboration_time = 0.0
+    serialization_time = 0.0
+
+    async def extend_env(self, env, proof_body, timeout, infotree_type=None):
+        await asyncio.sleep(0.005)
+        return {"env": env + 1}
+
+
+def test_small_tenant_gets_a_warm_repl_of_a_shared_header(monkeypatch):
+    async def cold_lease(timing=None):
+        raise AssertionError("No REPL should be created cold")
+
+    async def run():
+        cache = LRUReplCache()
+        for _ in range(2):
+            await cache.put(HEADER, FakeREPL())
+        monkeypatch.setattr(srv, "repl_cache", cache)
+        monkeypatch.setattr(srv, "scheduler", FairScheduler(capacity=2))
+        monkeypatch.setattr(srv, "_lease_clean_repl", cold_lease)
+        # More workers than slots, as when MAX_CONCURRENT_REQUESTS exceeds the warm REPLs
+        monkeypatch.setattr(srv.settings, "MAX_CONCURRENT_REQUESTS", 8)
+
+        codes = [
+            Code(custom_id=i, proof=f"{HEADER}theorem t{i} : True := trivial")
+            for i in range(40)
+        ]
+        bulk = asyncio.create_task(
+            process_header_group(HEADER, codes, 60, None, {}, tenant="bulk")
+        )
+        await asyncio.sleep(0.02)
+
+        timing = Timing()
+        (result,) = await process_header_group(
+            HEADER, codes[:1], 60, None, {}, timings=[timing], tenant="small"
+        )
+        assert result[1] is None
+        assert timing.cache_hit
+        assert not bulk.done()
+
+        assert all(error is None for _, error, _ in await bulk)
+        assert cache.snapshot()["idle"] == 2
+
+    asyncio.run(run())
+
+
+def test_burst_on_a_new_header_imports_it_once(monkeypatch):
+    imports = {"running": 0, "max": 0, "total": 0}
+
+    async def clean_lease(timing=None):
+        return FakeREPL()
+
+    async def import_header(repl, header, timeout):
+        imports["running"] += 1
+        imports["total"] += 1
+        imports["max"] = max(imports["max"], imports["running"])
+        await asyncio.sleep(0.05)
+        imports["running"] -= 1
+        return {"env": 0}, False
+
+    async def creater(cache):
+        while True:
+            header, predecessor = await cache.create_queue.get()
+            await asyncio.sleep(0.05)
+            cache.create_queue.done(header, 0.05)
+            await cache.put(header, FakeREPL(), predecessor)
+
+    async def run():
+        cache = LRUReplCache(max_size=16)
+        monkeypatch.setattr(srv, "repl_cache", cache)
+        monkeypatch.setattr(srv, "scheduler", FairScheduler(capacity=16))
+        monkeypatch.setattr(srv, "_lease_clean_repl", clean_lease)
+        monkeypatch.setattr(srv, "_import_header", import_header)
+        monkeypatch.setattr(srv.settings, "MAX_CONCURRENT_REQUESTS", 16)
+        creater_task = asyncio.create_task(creater(cache))
+
+        codes = [
+            Code(custom_id=i, proof=f"{HEADER}theorem t{i} : True := trivial")
+            for i in range(128)
+        ]
+        results = await process_header_group(HEADER, codes, 60, None, {})
+        creater_task.cancel()
+
+        assert all(error is None for _, error, _ in results)
+        # One worker imports the header, the others lease the pre-warmed REPLs
+        assert imports["max"] == 1
+        assert imports["total"] == 1
+        assert len(cache.global_repl_pool) + len(cache.create_queue) <= 16
+        assert len(cache.idle_lru) == len(cache.global_repl_pool)
+
+    asyncio.run(run())
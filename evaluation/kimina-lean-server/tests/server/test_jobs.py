@@ -0,0 +1,35 @@
+import asyncio
+
+import server.server as srv
+from utils.job_store import JobStore
+
+
+def test_slow_chunk_does_not_hold_back_the_job(monkeypatch, tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite"))
+    monkeypatch.setattr(srv, "job_store", store)
+    monkeypatch.setattr(srv, "JOB_CHUNK_SIZE", 2)
+    monkeypatch.setattr(srv, "JOB_WINDOW", 2)
+    slow = asyncio.Event()
+
+    async def verify(body, lean_repl, tenant=""):
+        for i, code in enumerate(body.codes):
+            # The first code hangs until all the others are verified
+            if code.custom_id == "0":
+                await slow.wait()
+            yield i, {"custom_id": code.custom_id, "error": None, "response": {}}
+
+    async def run():
+        monkeypatch.setattr(srv, "iter_verify_results", verify)
+        codes = [{"custom_id": str(i), "proof": "def f := 1"} for i in range(10)]
+        job_id = store.create(codes, {"timeout": 60})
+        task = asyncio.create_task(srv._run_job(job_id))
+        while store.get(job_id)["done"] < 8:
+            await asyncio.sleep(0.01)
+        assert [idx for idx, _ in store.pending(job_id, 10)] == [0, 1]
+        slow.set()
+        await task
+        assert store.get(job_id)["status"] == "completed"
+        assert store.get(job_id)["done"] == 10
+
+    asyncio.run(run())
+    store.close()
@@ -0,0 +1,86 @@
+import zlib
+
+import pytest
+
+from client import client as client_module
+from utils import compression
+from utils.compression import (
+    Compressor,
+    DecompressedSizeError,
+    Decompressor,
+    negotiate,
+)
+
+
+def test_negotiate():
+    assert negotiate("gzip, deflate") == "gzip"
+    assert negotiate("identity") is None
+    assert negotiate(None) is None
+    assert negotiate("gzip;q=0") is None
+    assert negotiate("*") == compression.ENCODINGS[0]
+
+
+def test_streamed_chunks_decode_at_once():
+    compressor = Compressor("gzip")
+    decompressor = Decompressor("gzip")
+    lines = [b'{"custom_id": "%d", "error": null}\n' % i for i in range(3)]
+    # Each flushed chunk decodes to its whole line without the next one
+    for line in lines[:-1]:
+        assert decompressor.decompress(compressor.compress(line)) == line
+    assert (
+        decompressor.decompress(compressor.compress(lines[-1], final=True)) == lines[-1]
+    )
+
+
+def test_round_trip():
+    body = b'{"infotree": [' + b'{"node": "tactic"},' * 1000 + b"{}]}"
+    compressed = compression.compress(body, "gzip")
+    assert len(compressed) < len(body) / 10
+    assert zlib.decompress(compressed, 31) == body
+    assert compression.decompress(compressed, "gzip") == body
+    assert compression.decompress(body, None) == body
+
+
+zstd = pytest.mark.skipif(
+    compression.zstandard is None, reason="zstandard is not installed"
+)
+
+
+@zstd
+def test_zstd_round_trip_and_preference():
+    body = b'{"infotree": [' + b'{"node": "tactic"},' * 1000 + b"{}]}"
+    compressed = compression.compress(body, "zstd")
+    assert len(compressed) < len(body) / 10
+    assert compression.decompress(compressed, "zstd") == body
+    assert negotiate("gzip, zstd") == "zstd"
+    assert negotiate("zstd;q=0.5, gzip") == "gzip"
+
+
+@pytest.mark.parametrize("encoding", ["gzip", pytest.param("zstd", marks=zstd)])
+def test_capped_decompression_stops_early(encoding):
+    bomb = compression.compress(b"\0" * 2**24, encoding)
+    decompressor = Decompressor(encoding, max_size=2**20)
+    with pytest.raises(DecompressedSizeError):
+        decompressor.decompress(bomb)
+    # The bomb is not expanded in full
+    assert decompressor.size < 2**22
+
+    body = b"x" * 2**20
+    assert (
+        Decompressor(encoding, 2**20).decompress(compression.compress(body, encoding))
+        == body
+    )
+
+
+def test_client_without_zstd_negotiates_gzip(monkeypatch):
+    monkeypatch.setattr(compression, "ENCODINGS", ["gzip"])
+    monkeypatch.setattr(client_module, "ENCODINGS", ["gzip"])
+    client = client_module.Lean4Client("http://lean", test_connection=False)
+    headers = {}
+    client._encode_request(headers, None)
+    assert headers["Accept-Encoding"] == "gzip"
+    # Nor does the server pick zstd when it can not decode it
+    assert negotiate("zstd, gzip") == "gzip"
+    assert negotiate("zstd") is None
+    with pytest.raises(ValueError):
+        Decompressor("zstd" if compression.zstandard is None else "br")
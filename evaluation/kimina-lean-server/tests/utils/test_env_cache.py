@@ -0,0 +1,43 @@
+from utils.env_cache import EnvSnapshotCache
+
+
+def test_snapshots_are_published_atomically(tmp_path):
+    cache = EnvSnapshotCache(str(tmp_path), revision="a")
+    assert cache.lookup("import Mathlib") is None
+
+    temp_path = cache.begin_save("import Mathlib")
+    # The header is pickled by one REPL at a time
+    assert cache.begin_save("import Mathlib") is None
+    assert cache.lookup("import Mathlib") is None
+
+    with open(temp_path, "wb") as f:
+        f.write(b"olean")
+    cache.end_save("import Mathlib", temp_path, success=True)
+    assert cache.lookup("import Mathlib") == cache.path("import Mathlib")
+    assert cache.begin_save("import Mathlib") is None
+    assert cache.stats == {"hits": 1, "misses": 2, "saved": 1, "failures": 0}
+
+    # Snapshots of another revision are not shared
+    assert (
+        EnvSnapshotCache(str(tmp_path), revision="b").lookup("import Mathlib") is None
+    )
+
+    cache.invalidate("import Mathlib")
+    assert cache.lookup("import Mathlib") is None
+
+
+def test_failed_save_is_dropped(tmp_path):
+    cache = EnvSnapshotCache(str(tmp_path))
+    temp_path = cache.begin_save("import FoML")
+    with open(temp_path, "wb") as f:
+        f.write(b"partial")
+    cache.end_save("import FoML", temp_path, success=False)
+    assert list(tmp_path.iterdir()) == []
+    assert cache.stats["failures"] == 1
+
+
+def test_disabled_without_directory():
+    cache = EnvSnapshotCache()
+    assert cache.lookup("import Mathlib") is None
+    assert cache.begin_save("import Mathlib") is None
+    assert cache.stats["misses"] == 0
@@ -0,0 +1,54 @@
+from utils.job_store import JobStore
+
+
+def test_job_resumes_from_stored_results(tmp_path):
+    path = str(tmp_path / "jobs.sqlite")
+    store = JobStore(path)
+    codes = [{"custom_id": i, "proof": f"def f := {i}"} for i in range(5)]
+    job_id = store.create(codes, {"timeout": 60}, tenant="eval")
+    store.set_status(job_id, "running")
+
+    assert [idx for idx, _ in store.pending(job_id, 2)] == [0, 1]
+    store.save_result(job_id, 1, {"custom_id": 1, "error": None})
+    # A result is stored once
+    store.save_result(job_id, 1, {"custom_id": 1, "error": "again"})
+    store.close()
+
+    store = JobStore(path)
+    assert store.unfinished() == [job_id]
+    job = store.get(job_id)
+    assert (job["status"], job["done"], job["total"]) == ("running", 1, 5)
+    assert job["options"] == {"timeout": 60}
+    assert [idx for idx, _ in store.pending(job_id, 10)] == [0, 2, 3, 4]
+    assert store.pending(job_id, 1)[0][1] == codes[0]
+
+    for idx, code in store.pending(job_id, 10):
+        store.save_result(job_id, idx, {"custom_id": code["custom_id"], "error": None})
+    store.set_status(job_id, "completed")
+    assert store.unfinished() == []
+    assert store.get(job_id)["finished_at"] is not None
+
+    page = store.results(job_id, offset=1, limit=2)
+    assert page == [{"custom_id": 1, "error": None}, {"custom_id": 2, "error": None}]
+    assert store.get("unknown") is None
+    store.close()
+
+
+def test_job_codes_inserted_in_chunks(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite"), chunk_size=2)
+    codes = [{"custom_id": i, "proof": f"def f := {i}"} for i in range(5)]
+    job_id = store.create(codes, {}, tenant="eval")
+    assert store.get(job_id)["status"] == "queued"
+    assert store.pending(job_id, 10) == list(enumerate(codes))
+
+    store.save_results(job_id, [(3, {"custom_id": 3}), (0, {"custom_id": 0})])
+    store.save_results(job_id, [(3, {"custom_id": 3, "error": "again"})])
+    assert store.get(job_id)["done"] == 2
+    assert [idx for idx, _ in store.pending(job_id, 10)] == [1, 2, 4]
+
+    # A failed job is resumed, a job whose codes are still being inserted is not
+    store.set_status(job_id, "failed")
+    other = store.create(codes, {}, tenant="eval")
+    store.set_status(other, "submitting")
+    assert store.unfinished() == [job_id]
+    store.close()
@@ -0,0 +1,44 @@
+from utils.metrics import Histogram, PrometheusWriter
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram([1, 5, 0.5])
+    for value in [0.1, 0.5, 3, 100]:
+        histogram.observe(value)
+
+    assert histogram.cumulative() == [(0.5, 2), (1, 2), (5, 3), (float("inf"), 4)]
+    assert histogram.to_dict() == {
+        "buckets": {"0.5": 2, "1": 2, "5": 3, "+Inf": 4},
+        "sum": 103.6,
+        "count": 4,
+    }
+
+
+def test_prometheus_text_format():
+    histogram = Histogram([1])
+    histogram.observe(0.5)
+
+    writer = PrometheusWriter("leanserver")
+    writer.counter("repl_timeouts", "Commands killed on timeout.", 3)
+    writer.metric(
+        "repl_pool_size",
+        "gauge",
+        "Idle pooled REPLs per header.",
+        [({"header": 'import Mathlib\nimport "A"'}, 2)],
+    )
+    writer.histogram("verify_latency_seconds", "Proof verification latency.", histogram)
+
+    assert writer.render().splitlines() == [
+        "# HELP leanserver_repl_timeouts_total Commands killed on timeout.",
+        "# TYPE leanserver_repl_timeouts_total counter",
+        "leanserver_repl_timeouts_total 3",
+        "# HELP leanserver_repl_pool_size Idle pooled REPLs per header.",
+        "# TYPE leanserver_repl_pool_size gauge",
+        'leanserver_repl_pool_size{header="import Mathlib\\nimport \\"A\\""} 2',
+        "# HELP leanserver_verify_latency_seconds Proof verification latency.",
+        "# TYPE leanserver_verify_latency_seconds histogram",
+        'leanserver_verify_latency_seconds_bucket{le="1"} 1',
+        'leanserver_verify_latency_seconds_bucket{le="+Inf"} 1',
+        "leanserver_verify_latency_seconds_sum 0.5",
+        "leanserver_verify_latency_seconds_count 1",
+    ]
@@ -0,0 +1,294 @@
+import asyncio
+
+from utils.repl_cache import CleanReplPool, LRUReplCache
+
+
+class FakeREPL:
+    def __init__(self, header=None):
+        self.header = header
+        self.num_commands = 0
+        self.elaboration_time = 0.0
+
+
+def test_create_queue_depth_and_latency():
+    async def run():
+        cache = LRUReplCache(max_size=4)
+        cache.create("import Mathlib", 2)
+        assert len(cache.create_queue) == 2
+
+        header, _ = await cache.create_queue.get()
+        assert header == "import Mathlib"
+        # Still counted while the creation is in flight
+        assert len(cache.create_queue) == 2
+
+        cache.create_queue.done(header, 1.5)
+        assert len(cache.create_queue) == 1
+        assert cache.create_queue.import_latency[header]["count"] == 1
+        assert cache.create_queue.import_latency[header]["max"] == 1.5
+
+        # Failed creations do not record a latency
+        header, _ = await cache.create_queue.get()
+        cache.create_queue.done(header)
+        assert len(cache.create_queue) == 0
+        assert cache.create_queue.import_latency[header]["count"] == 1
+
+    asyncio.run(run())
+
+
+def test_clean_pool_refills_leased_repls():
+    async def run():
+        pool = CleanReplPool(max_size=2)
+        for _ in range(2):
+            await pool.reserve()
+        # Full once the spawns are reserved
+        waiter = asyncio.create_task(pool.reserve())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+
+        first, second = FakeREPL(), FakeREPL()
+        pool.put(first)
+        pool.put(second)
+        assert pool.get() is first
+        await asyncio.wait_for(waiter, 1)
+        assert pool.pending == 1
+
+        # A failed spawn releases its reservation
+        pool.put(None)
+        assert len(pool) == 1 and pool.pending == 0
+        assert pool.get() is second
+        assert pool.get() is None
+        assert pool.stats == {"hits": 2, "misses": 1}
+
+    asyncio.run(run())
+
+
+def test_consuming_last_idle_repl_schedules_replacement():
+    async def run():
+        cache = LRUReplCache(max_size=4)
+        await cache.put("import Mathlib", FakeREPL("import Mathlib"))
+
+        id, repl = await cache.get("import Mathlib")
+        assert id is not None
+        assert cache.create_queue.pending["import Mathlib"] == 1
+
+        # A second miss does not pile up creations for the same header
+        await cache.get("import Mathlib")
+        assert cache.create_queue.pending["import Mathlib"] == 1
+
+    asyncio.run(run())
+
+
+def test_destroy_schedules_replacement():
+    async def run():
+        cache = LRUReplCache(max_size=4)
+        for _ in range(2):
+            await cache.put("import Mathlib", FakeREPL("import Mathlib"))
+
+        leased = [await cache.get("import Mathlib") for _ in range(2)]
+        # Draining the pool scheduled one replacement already
+        assert len(cache.create_queue) == 1
+
+        for id, repl in leased:
+            await cache.destroy("import Mathlib", id, repl)
+        assert cache.size() == 0
+        assert len(cache.create_queue) == 3
+        assert cache.close_queue.qsize() == 2
+
+        # REPLs that were never pooled are not replaced
+        await cache.destroy("import Mathlib", None, FakeREPL())
+        assert len(cache.create_queue) == 3
+        assert cache.stats["destroyed"] == 3
+
+    asyncio.run(run())
+
+
+def test_replacements_are_bounded_by_max_size():
+    async def run():
+        cache = LRUReplCache(max_size=1)
+        await cache.put("import Mathlib", FakeREPL("import Mathlib"))
+        await cache.get("import Mathlib")
+        assert len(cache.create_queue) == 0
+
+    asyncio.run(run())
+
+
+def test_eviction_skips_leased_repls():
+    async def run():
+        cache = LRUReplCache(max_size=2)
+        await cache.put("import Mathlib", FakeREPL())
+        await cache.put("import Aesop", FakeREPL())
+        leased_id, leased = await cache.get("import Mathlib")
+
+        # The oldest REPL is leased, so the idle one is evicted instead
+        await cache.put("import FoML", FakeREPL())
+        assert cache.size() == 2
+        assert leased_id in cache.global_repl_pool
+        assert not cache.cache["import Aesop"]
+        assert cache.close_queue.qsize() == 1
+        assert cache.stats["evictions"] == 1
+
+        # Releasing while over capacity evicts the least recently used idle REPL
+        cache.max_size = 1
+        await cache.release("import Mathlib", leased_id, leased)
+        assert cache.size() == 1
+        assert leased_id in cache.global_repl_pool
+        assert cache.stats["evictions"] == 2
+
+    asyncio.run(run())
+
+
+def test_snapshot():
+    async def run():
+        cache = LRUReplCache(max_size=8)
+        for _ in range(3):
+            await cache.put("import Mathlib", FakeREPL())
+        await cache.put("import FoML", FakeREPL())
+        await cache.get("import Mathlib")
+        await cache.get("import Optlib")
+
+        snapshot = cache.snapshot()
+        assert snapshot["total"] == 4
+        assert snapshot["idle"] == 3
+        assert snapshot["leased"] == 1
+        assert snapshot["headers"] == {"import Mathlib": 2, "import FoML": 1}
+        assert snapshot["cache_hits"] == 1
+        assert snapshot["cache_misses"] == 1
+
+    asyncio.run(run())
+
+
+def test_memory_budget_evicts_heaviest_repls():
+    async def run():
+        cache = LRUReplCache(max_size=8, max_memory=100)
+        for _ in range(4):
+            await cache.put("import Mathlib", FakeREPL())
+        ids = list(cache.global_repl_pool)
+        leased_id, leased = await cache.get("import Mathlib")
+
+        cache.update_memory({id: 40 if id == ids[1] else 30 for id in ids})
+        assert cache.memory_usage() == 130
+
+        # The heaviest idle REPL is evicted first
+        cache.evict_for_memory()
+        assert ids[1] not in cache.global_repl_pool
+        assert cache.memory_usage() == 90
+        assert cache.stats["memory_evictions"] == 1
+
+        # Idle REPLs go first, then the leased ones are evicted once released
+        cache.update_memory({ids[0]: 5, ids[2]: 5, leased_id: 120})
+        cache.evict_for_memory()
+        assert cache.size() == 1
+        assert leased_id in cache.evict_on_release
+        # No replacement is scheduled while the pool is over its memory budget
+        assert len(cache.create_queue) == 0
+
+        await cache.release("import Mathlib", leased_id, leased)
+        assert cache.size() == 0
+        assert cache.memory_usage() == 0
+        assert cache.stats["memory_evictions"] == 4
+
+    asyncio.run(run())
+
+
+def test_recycle_prewarms_successor_before_retiring():
+    async def run():
+        cache = LRUReplCache(max_size=2, max_commands=3)
+        await cache.put("import Mathlib", FakeREPL())
+        await cache.put("import FoML", FakeREPL())
+
+        id, repl = await cache.get("import Mathlib")
+        repl.num_commands = 3
+        await cache.release("import Mathlib", id, repl)
+
+        # The old REPL stays usable while its successor is created
+        assert cache.retiring == {id: "import Mathlib"}
+        assert cache.create_queue.pending["import Mathlib"] == 1
+        assert await cache.get("import Mathlib") == (id, repl)
+        await cache.release("import Mathlib", id, repl)
+
+        # Putting the successor retires the old REPL without evicting other headers
+        header, predecessor = await cache.create_queue.get()
+        assert predecessor == id
+        await cache.put(header, FakeREPL(), predecessor)
+        assert id not in cache.global_repl_pool
+        assert cache.size() == 2
+        assert cache.cache["import FoML"]
+        assert cache.stats["recycled"] == 1
+
+    asyncio.run(run())
+
+
+def test_recycle_leased_predecessor_on_release():
+    async def run():
+        cache = LRUReplCache(max_size=2, max_elaboration_time=10)
+        await cache.put("import Mathlib", FakeREPL())
+        await cache.put("import FoML", FakeREPL())
+
+        id, repl = await cache.get("import Mathlib")
+        repl.elaboration_time = 12.5
+        await cache.release("import Mathlib", id, repl)
+        assert id in cache.retiring
+
+        # The successor is ready while the old REPL is leased
+        id, repl = await cache.get("import Mathlib")
+        header, predecessor = await cache.create_queue.get()
+        await cache.put(header, FakeREPL(), predecessor)
+        assert cache.size() == 3
+        assert cache.cache["import FoML"]
+
+        await cache.release("import Mathlib", id, repl)
+        assert id not in cache.global_repl_pool
+        assert cache.size() == 2
+        assert cache.stats["recycled"] == 1
+
+    asyncio.run(run())
+
+
+def test_recycle_on_memory_growth():
+    async def run():
+        cache = LRUReplCache(max_size=2, max_memory_growth=50)
+        await cache.put("import Mathlib", FakeREPL())
+        (id,) = cache.global_repl_pool
+
+        cache.update_memory({id: 100})
+        assert not cache.retiring
+        cache.update_memory({id: 160})
+        assert id in cache.retiring
+
+        # A retiring REPL that gets destroyed is not replaced twice
+        await cache.destroy("import Mathlib", id, cache.global_repl_pool[id][1])
+        assert cache.create_queue.pending["import Mathlib"] == 1
+
+    asyncio.run(run())
+
+
+def test_recycle_retried_after_successor_failure():
+    async def run():
+        cache = LRUReplCache(max_size=2, max_commands=3)
+        await cache.put("import Mathlib", FakeREPL())
+
+        id, repl = await cache.get("import Mathlib")
+        repl.num_commands = 3
+        await cache.release("import Mathlib", id, repl)
+        # The replacement of the leased REPL, then the successor of the recycled one
+        assert [await cache.create_queue.get() for _ in range(2)] == [
+            ("import Mathlib", None),
+            ("import Mathlib", id),
+        ]
+        cache.create_queue.done("import Mathlib")
+        cache.create_queue.done("import Mathlib")
+
+        # A cold REPL put by a worker is not the successor
+        await cache.put("import Mathlib", FakeREPL())
+        assert id in cache.global_repl_pool
+
+        # The creation of the successor failed, the next release asks for another one
+        cache.successor_failed(id)
+        assert not cache.retiring
+        leased = [await cache.get("import Mathlib") for _ in range(2)]
+        for leased_id, leased_repl in leased:
+            await cache.release("import Mathlib", leased_id, leased_repl)
+        assert cache.retiring == {id: "import Mathlib"}
+        assert cache.create_queue.pending["import Mathlib"] == 1
+
+    asyncio.run(run())
@@ -0,0 +1,71 @@
+import asyncio
+import os
+
+import pytest
+
+from utils import repl_protocol
+from utils.repl_protocol import FrameReader, ResponseTooLargeError
+
+
+def test_frames_are_split_across_reads():
+    r, w = os.pipe()
+    os.write(
+        w, b'\n{"env": 0}\n\n{"messages":\n [{"data": "' + b"x" * 100 + b'"}]}\n\n'
+    )
+    os.close(w)
+    reader = FrameReader(r, chunk_size=7)
+    assert repl_protocol.loads(reader.read_frame()) == {"env": 0}
+    assert len(repl_protocol.loads(reader.read_frame())["messages"][0]["data"]) == 100
+    assert reader.read_frame() == b""
+    assert reader.eof
+    os.close(r)
+
+
+def test_oversized_response_is_rejected():
+    r, w = os.pipe()
+    os.write(w, b'{"infotree": "' + b"x" * 1000)
+    reader = FrameReader(r, max_size=100, chunk_size=64)
+    with pytest.raises(ResponseTooLargeError):
+        reader.read_frame()
+    os.close(w)
+    os.close(r)
+
+
+def test_async_stream_limit():
+    async def run():
+        stream = asyncio.StreamReader(limit=100)
+        stream.feed_data(b'{"env": 1}\n\n{"env": 2}')
+        stream.feed_eof()
+        assert await repl_protocol.read_frame(stream) == (b'{"env": 1}', False)
+        assert await repl_protocol.read_frame(stream) == (b'{"env": 2}', True)
+
+        stream = asyncio.StreamReader(limit=100)
+        stream.feed_data(b"x" * 1000)
+        with pytest.raises(ResponseTooLargeError):
+            await repl_protocol.read_frame(stream)
+
+    asyncio.run(run())
+
+
+def test_blank_lines_are_skipped_like_the_blocking_reader():
+    output = b'\n\n\n{"env": 0}\n\n\n{"env": 1}\n\n\n\n{"env": 2}'
+    r, w = os.pipe()
+    os.write(w, output)
+    os.close(w)
+    reader = FrameReader(r)
+    frames = [reader.read_frame() for _ in range(3)]
+    os.close(r)
+
+    async def run():
+        stream = asyncio.StreamReader()
+        stream.feed_data(output)
+        stream.feed_eof()
+        return [await repl_protocol.read_frame(stream) for _ in range(3)]
+
+    assert frames == [b'{"env": 0}', b'{"env": 1}', b'{"env": 2}']
+    assert [frame for frame, _ in asyncio.run(run())] == frames
+
+
+def test_dumps_keeps_unicode():
+    assert repl_protocol.dumps({"cmd": "∀ x, x = x"}).endswith(b"\n\n")
+    assert repl_protocol.loads(repl_protocol.dumps({"cmd": "∀ x"})) == {"cmd": "∀ x"}
@@ -0,0 +1,118 @@
+import asyncio
+
+from utils.result_cache import ResultCache, project_revision, timeout_class
+
+
+def test_key_depends_on_content_timeout_class_and_revision():
+    cache = ResultCache(revision="a")
+    key = cache.key("import Mathlib", "example : 1 = 1 := rfl", 60)
+
+    assert key == cache.key("import Mathlib", "example : 1 = 1 := rfl", 50)
+    assert key != cache.key("import Mathlib", "example : 1 = 1 := rfl", 300)
+    assert key != cache.key("import Mathlib", "example : 2 = 2 := rfl", 60)
+    assert key != cache.key("import Mathlib", "example : 1 = 1 := rfl", 60, "original")
+    assert key != ResultCache(revision="b").key(
+        "import Mathlib", "example : 1 = 1 := rfl", 60
+    )
+    assert timeout_class(60) == timeout_class(64) != timeout_class(65)
+
+
+def test_memory_lru():
+    cache = ResultCache(max_size=2)
+    for key in ["a", "b", "c"]:
+        cache.put(key, {"env": 0, "key": key})
+
+    assert cache.get("a") is None
+    assert cache.get("c") == {"env": 0, "key": "c"}
+    assert cache.stats == {"hits": 1, "disk_hits": 0, "misses": 1}
+
+    # Callers get a copy of the cached response
+    cache.get("c")["time"] = 1.0
+    assert "time" not in cache.get("c")
+
+
+def test_results_survive_restart(tmp_path):
+    path = str(tmp_path / "results.sqlite")
+    cache = ResultCache(path=path)
+    cache.put("key", {"env": 0, "messages": [{"severity": "error", "data": "ℝ"}]})
+    cache.close()
+
+    cache = ResultCache(path=path)
+    assert cache.get("key") == {
+        "env": 0,
+        "messages": [{"severity": "error", "data": "ℝ"}],
+    }
+    assert cache.stats["disk_hits"] == 1
+    # The second lookup is served by the in-memory front
+    cache.get("key")
+    assert cache.stats["disk_hits"] == 1
+    cache.close()
+
+
+def test_writes_are_batched_off_the_event_loop(tmp_path):
+    path = str(tmp_path / "results.sqlite")
+    cache = ResultCache(path=path)
+    for key in ["a", "b"]:
+        cache.put(key, {"env": 0, "key": key})
+    # A second cache on the same file reads the disk only
+    reader = ResultCache(path=path, max_size=0)
+    assert reader.get("a") is None
+
+    asyncio.run(cache.aflush())
+    assert not cache.pending
+    assert reader.get("b") == {"env": 0, "key": "b"}
+    reader.close()
+    cache.close()
+
+
+def test_lookups_are_batched_off_the_event_loop(tmp_path):
+    cache = ResultCache(path=str(tmp_path / "results.sqlite"), max_size=1)
+    for key in ["a", "b", "c"]:
+        cache.put(key, {"env": 0, "key": key})
+    cache.flush()
+
+    async def run():
+        # The lookups use their own connection, they never wait for the writer
+        with cache.lock:
+            return await cache.aget_many(["a", "b", "c", "d"])
+
+    assert asyncio.run(run()) == {
+        "a": {"env": 0, "key": "a"},
+        "b": {"env": 0, "key": "b"},
+        "c": {"env": 0, "key": "c"},
+    }
+    assert cache.stats == {"hits": 3, "disk_hits": 2, "misses": 1}
+    cache.close()
+
+
+def test_disk_keeps_the_latest_results(tmp_path):
+    cache = ResultCache(path=str(tmp_path / "results.sqlite"), max_disk_size=2)
+    for key in ["a", "b", "c"]:
+        cache.put(key, {"env": 0, "key": key})
+        cache.flush()
+    cache.memory.clear()
+    assert cache.get("a") is None
+    assert asyncio.run(cache.aget_many(["b", "c"])).keys() == {"b", "c"}
+    cache.close()
+
+
+def test_incomplete_responses_are_not_cached():
+    cache = ResultCache()
+    undecodable = {
+        "messages": [
+            {"severity": "error", "data": "error decoding json response in leanrepl"}
+        ]
+    }
+    cache.put("a", undecodable)
+    cache.put("b", {"message": "Unknown environment."})
+    assert cache.get("a") is None
+    assert cache.get("b") is None
+
+
+def test_project_revision(tmp_path):
+    empty = project_revision(str(tmp_path))
+    (tmp_path / "lean-toolchain").write_text("leanprover/lean4:v4.15.0\n")
+    v15 = project_revision(str(tmp_path))
+    (tmp_path / "lean-toolchain").write_text("leanprover/lean4:v4.18.0\n")
+
+    assert len({empty, v15, project_revision(str(tmp_path))}) == 3
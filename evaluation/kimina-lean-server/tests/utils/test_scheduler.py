@@ -0,0 +1,99 @@
+import asyncio
+
+from utils.scheduler import FairScheduler
+
+
+def test_small_tenant_is_served_next_under_bulk_load():
+    async def run():
+        scheduler = FairScheduler(capacity=2)
+        grants = []  # Tenants in the order their slots were granted
+
+        async def verify(tenant):
+            async with scheduler.slot(tenant):
+                grants.append(tenant)
+                await asyncio.sleep(0.001)
+
+        bulk = [asyncio.create_task(verify("bulk")) for _ in range(500)]
+        await asyncio.sleep(0.01)
+
+        # A FIFO semaphore would make each one wait for the whole bulk backlog
+        for _ in range(3):
+            queued_at = len(grants)
+            await verify("interactive")
+            # At most the slots already granted to bulk waiters go first
+            position = grants.index("interactive", queued_at)
+            assert position - queued_at <= scheduler.capacity
+        assert scheduler.waiting() > 400
+
+        for task in bulk:
+            task.cancel()
+        await asyncio.gather(*bulk, return_exceptions=True)
+        assert scheduler.active == 0
+        assert scheduler.waiting() == 0
+
+    asyncio.run(run())
+
+
+def test_weighted_fair_share():
+    async def run():
+        scheduler = FairScheduler(capacity=1, weights={"heavy": 2})
+        order = []
+
+        async def job(tenant):
+            async with scheduler.slot(tenant):
+                order.append(tenant)
+                await asyncio.sleep(0)
+
+        # Hold the only slot so that every job queues up
+        await scheduler.acquire("other")
+        tasks = [asyncio.create_task(job("heavy")) for _ in range(20)]
+        tasks += [asyncio.create_task(job("light")) for _ in range(20)]
+        await asyncio.sleep(0)
+        scheduler.release()
+        await asyncio.gather(*tasks)
+
+        first = order[:15]
+        assert first.count("heavy") == 10
+        assert first.count("light") == 5
+
+    asyncio.run(run())
+
+
+def test_priority_levels_are_served_first():
+    async def run():
+        scheduler = FairScheduler(capacity=1)
+        order = []
+
+        async def job(tenant, priority):
+            async with scheduler.slot(tenant, priority):
+                order.append((tenant, priority))
+
+        await scheduler.acquire("bulk")
+        tasks = [asyncio.create_task(job("bulk", -1)) for _ in range(3)]
+        tasks.append(asyncio.create_task(job("bulk", 0)))
+        tasks.append(asyncio.create_task(job("user", 1)))
+        await asyncio.sleep(0)
+        scheduler.release()
+        await asyncio.gather(*tasks)
+
+        assert order[:2] == [("user", 1), ("bulk", 0)]
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiters_do_not_leak_slots():
+    async def run():
+        scheduler = FairScheduler(capacity=1)
+        await scheduler.acquire("a")
+        waiter = asyncio.create_task(scheduler.acquire("b"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert scheduler.waiting() == 0
+
+        scheduler.release()
+        assert scheduler.active == 0
+        await asyncio.wait_for(scheduler.acquire("c"), 1)
+        assert scheduler.active == 1
+
+    asyncio.run(run())
@@ -0,0 +1,128 @@
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # type: ignore[assignment]
+
+# Content codings in order of preference, zstd needs the zstandard package
+ENCODINGS = ["zstd", "gzip"] if zstandard is not None else ["gzip"]
+
+GZIP_LEVEL = 5
+ZSTD_LEVEL = 3
+# Compressed bytes decoded at once when the output is capped, a zstd block
+# of a few bytes can decode to 128 KiB
+ZSTD_CAPPED_INPUT = 64
+
+
+class DecompressedSizeError(ValueError):
+    """The decompressed body is larger than the size allowed."""
+
+
+class Compressor:
+    """Incremental compressor of a body in the `gzip` or `zstd` content coding."""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == "zstd":
+            self.compressobj = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        else:
+            # wbits 31 writes the gzip header and trailer
+            self.compressobj = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data, final=False):
+        """Compress the next chunk, flushed so that the receiver can decode it at once."""
+        if self.encoding == "zstd":
+            mode = (
+                zstandard.COMPRESSOBJ_FLUSH_FINISH
+                if final
+                else zstandard.COMPRESSOBJ_FLUSH_BLOCK
+            )
+        else:
+            mode = zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH
+        return self.compressobj.compress(data) + self.compressobj.flush(mode)
+
+
+class Decompressor:
+    """Incremental decompressor of a body in the `gzip`, `zstd` or `identity` content coding.
+
+    With a `max_size`, the output is decoded piecewise and a body decompressing
+    to more bytes raises `DecompressedSizeError` without being expanded in full.
+    """
+
+    def __init__(self, encoding, max_size=None):
+        self.max_size = max_size
+        self.size = 0  # Bytes decompressed so far
+        encoding = (encoding or "identity").strip().lower()
+        self.encoding = encoding
+        if encoding == "zstd" and zstandard is not None:
+            self.decompressobj = zstandard.ZstdDecompressor().decompressobj()
+        elif encoding in ("gzip", "x-gzip"):
+            self.decompressobj = zlib.decompressobj(31)
+        elif encoding == "identity":
+            self.decompressobj = None
+        else:
+            raise ValueError(f"Unsupported content encoding {encoding!r}")
+
+    def decompress(self, data):
+        if self.decompressobj is None:
+            output = data
+        elif self.max_size is None:
+            output = self.decompressobj.decompress(data)
+        elif self.encoding == "zstd":
+            chunks = []
+            size = self.size
+            for start in range(0, len(data), ZSTD_CAPPED_INPUT):
+                chunk = self.decompressobj.decompress(
+                    data[start : start + ZSTD_CAPPED_INPUT]
+                )
+                size += len(chunk)
+                self._check(size)
+                chunks.append(chunk)
+            output = b"".join(chunks)
+        else:
+            # Decode one byte past the limit at most
+            output = self.decompressobj.decompress(data, self.max_size - self.size + 1)
+        self.size += len(output)
+        self._check(self.size)
+        return output
+
+    def _check(self, size):
+        if self.max_size is not None and size > self.max_size:
+            raise DecompressedSizeError(
+                f"The decompressed body is larger than {self.max_size} bytes"
+            )
+
+
+def compress(data, encoding):
+    return Compressor(encoding).compress(data, final=True)
+
+
+def decompress(data, encoding):
+    return Decompressor(encoding).decompress(data)
+
+
+def negotiate(accept_encoding):
+    """Pick the preferred supported coding of an `Accept-Encoding` header, or None."""
+    accepted = {}
+    for item in (accept_encoding or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    candidates = [
+        encoding
+        for encoding in ENCODINGS
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0
+    ]
+    if not candidates:
+        return None
+    return max(
+        candidates, key=lambda encoding: accepted.get(encoding, accepted.get("*"))
+    )
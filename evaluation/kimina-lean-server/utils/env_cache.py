@@ -0,0 +1,77 @@
+import hashlib
+import json
+import os
+import uuid
+
+
+class EnvSnapshotCache:
+    """
+    Directory of pickled header environments.
+
+    The environment of a header imported once is pickled to an `.olean` file,
+    which the later REPLs restore instead of importing the header again. The
+    files are keyed by header and by Lean toolchain and project revision.
+    """
+
+    def __init__(self, directory=None, revision=""):
+        self.directory = None if directory is None else os.path.abspath(directory)
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+        self.revision = revision  # Lean toolchain and project revision
+        self.saving = set()  # Headers being pickled
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "saved": 0,
+            "failures": 0,
+        }
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def path(self, header):
+        """Path of the snapshot of the header."""
+        key = hashlib.sha256(json.dumps([header, self.revision]).encode()).hexdigest()
+        return os.path.join(self.directory, f"{key}.olean")
+
+    def lookup(self, header):
+        """Return the path of the snapshot of the header, or None on a miss."""
+        if not self.enabled:
+            return None
+        path = self.path(header)
+        if os.path.isfile(path):
+            self.stats["hits"] += 1
+            return path
+        self.stats["misses"] += 1
+        return None
+
+    def begin_save(self, header):
+        """Return a temporary path to pickle the header to, or None if it is not needed."""
+        if (
+            not self.enabled
+            or header in self.saving
+            or os.path.isfile(self.path(header))
+        ):
+            return None
+        self.saving.add(header)
+        return f"{self.path(header)}.{uuid.uuid4().hex}.tmp.olean"
+
+    def end_save(self, header, temp_path, success):
+        """Publish the snapshot pickled to `temp_path`, or drop it if pickling failed."""
+        self.saving.discard(header)
+        if success and os.path.isfile(temp_path):
+            # Readers never see a partially written snapshot
+            os.replace(temp_path, self.path(header))
+            self.stats["saved"] += 1
+            return
+        self.stats["failures"] += 1
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    def invalidate(self, header):
+        """Remove the snapshot of the header, after it failed to restore."""
+        self.stats["failures"] += 1
+        path = self.path(header)
+        if os.path.exists(path):
+            os.remove(path)
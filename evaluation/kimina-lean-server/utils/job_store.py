@@ -0,0 +1,161 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class JobStore:
+    """
+    Durable store of verification jobs and of their results.
+
+    A job keeps the codes and the options of a `/verify` request, and each
+    code gets its result as soon as it is verified. After a restart, the
+    unfinished jobs resume from the codes which have no result yet, so no
+    result is ever computed twice.
+
+    The methods block on SQLite, the server calls them from worker threads.
+    """
+
+    def __init__(self, path, chunk_size=10000):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.chunk_size = chunk_size  # Codes inserted per transaction
+        self.lock = threading.Lock()  # Serializes the database between threads
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                options TEXT NOT NULL,
+                tenant TEXT NOT NULL,
+                total INTEGER NOT NULL,
+                done INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                finished_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS job_codes (
+                job_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                code TEXT NOT NULL,
+                result TEXT,
+                PRIMARY KEY (job_id, idx)
+            );
+            """)
+        self.db.commit()
+
+    def create(self, codes, options, tenant=""):
+        """Store a new job, and return its id.
+
+        The codes are inserted in chunks, so that the other threads are not
+        held back by a large job. The job stays "submitting", and is never
+        resumed, until all its codes are stored.
+        """
+        job_id = str(uuid.uuid4())
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO jobs (id, status, options, tenant, total, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    job_id,
+                    "submitting",
+                    json.dumps(options),
+                    tenant,
+                    len(codes),
+                    time.time(),
+                ),
+            )
+            self.db.commit()
+        for start in range(0, len(codes), self.chunk_size):
+            with self.lock:
+                self.db.executemany(
+                    "INSERT INTO job_codes (job_id, idx, code) VALUES (?, ?, ?)",
+                    (
+                        (job_id, idx, json.dumps(code, ensure_ascii=False))
+                        for idx, code in enumerate(
+                            codes[start : start + self.chunk_size], start
+                        )
+                    ),
+                )
+                self.db.commit()
+        self.set_status(job_id, "queued")
+        return job_id
+
+    def get(self, job_id):
+        """Return the status and the progress of a job, or None if it does not exist."""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT id, status, options, tenant, total, done, created_at, finished_at FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row[0],
+            "status": row[1],
+            "options": json.loads(row[2]),
+            "tenant": row[3],
+            "total": row[4],
+            "done": row[5],
+            "created_at": row[6],
+            "finished_at": row[7],
+        }
+
+    def unfinished(self):
+        """Return the ids of the jobs to resume, failed ones included, oldest first."""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT id FROM jobs WHERE status NOT IN ('completed', 'submitting') ORDER BY created_at"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def pending(self, job_id, limit, after=-1):
+        """Return up to `limit` `(index, code)` of the job past `after` which have no result yet."""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT idx, code FROM job_codes WHERE job_id = ? AND idx > ? AND result IS NULL ORDER BY idx LIMIT ?",
+                (job_id, after, limit),
+            ).fetchall()
+        return [(idx, json.loads(code)) for idx, code in rows]
+
+    def set_status(self, job_id, status):
+        finished_at = time.time() if status == "completed" else None
+        with self.lock:
+            self.db.execute(
+                "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ?",
+                (status, finished_at, job_id),
+            )
+            self.db.commit()
+
+    def save_result(self, job_id, idx, result):
+        """Store the result of the code `idx` of the job."""
+        self.save_results(job_id, [(idx, result)])
+
+    def save_results(self, job_id, results):
+        """Store the `(index, result)` of several codes of the job in one transaction."""
+        done = 0
+        with self.lock:
+            for idx, result in results:
+                cursor = self.db.execute(
+                    "UPDATE job_codes SET result = ? WHERE job_id = ? AND idx = ? AND result IS NULL",
+                    (json.dumps(result, ensure_ascii=False), job_id, idx),
+                )
+                done += cursor.rowcount
+            if done > 0:
+                self.db.execute(
+                    "UPDATE jobs SET done = done + ? WHERE id = ?", (done, job_id)
+                )
+            self.db.commit()
+
+    def results(self, job_id, offset=0, limit=1000):
+        """Return the results of the job in code order, None for the codes still pending."""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT result FROM job_codes WHERE job_id = ? ORDER BY idx LIMIT ? OFFSET ?",
+                (job_id, limit, offset),
+            ).fetchall()
+        return [json.loads(row[0]) if row[0] is not None else None for row in rows]
+
+    def close(self):
+        self.db.close()
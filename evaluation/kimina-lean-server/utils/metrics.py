@@ -0,0 +1,89 @@
+import bisect
+
+
+class Histogram:
+    """Cumulative latency histogram, in the Prometheus bucket layout."""
+
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets)  # Upper bounds in seconds, +Inf is implicit
+        self.counts = [0] * (len(self.buckets) + 1)  # Observations per bucket
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Record an observation."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Return the (upper bound, cumulative count) pairs, ending with +Inf."""
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + [float("inf")], self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def to_dict(self):
+        return {
+            "buckets": {
+                _format_value(bound): count for bound, count in self.cumulative()
+            },
+            "sum": self.sum,
+            "count": self.count,
+        }
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape_label(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return (
+        "{"
+        + ",".join(f'{k}="{_escape_label(str(v))}"' for k, v in labels.items())
+        + "}"
+    )
+
+
+class PrometheusWriter:
+    """Build a metrics page in the Prometheus text exposition format."""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.lines = []
+
+    def metric(self, name, kind, help, samples):
+        """Write a gauge or counter from a list of (labels, value) samples."""
+        name = f"{self.prefix}_{name}"
+        self.lines.append(f"# HELP {name} {help}")
+        self.lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            self.lines.append(f"{name}{_labels(labels)} {_format_value(value)}")
+
+    def gauge(self, name, help, value, labels=None):
+        self.metric(name, "gauge", help, [(labels, value)])
+
+    def counter(self, name, help, value, labels=None):
+        self.metric(f"{name}_total", "counter", help, [(labels, value)])
+
+    def histogram(self, name, help, histogram):
+        name = f"{self.prefix}_{name}"
+        self.lines.append(f"# HELP {name} {help}")
+        self.lines.append(f"# TYPE {name} histogram")
+        for bound, count in histogram.cumulative():
+            self.lines.append(f'{name}_bucket{{le="{_format_value(bound)}"}} {count}')
+        self.lines.append(f"{name}_sum {_format_value(histogram.sum)}")
+        self.lines.append(f"{name}_count {histogram.count}")
+
+    def render(self):
+        return "\n".join(self.lines) + "\n"
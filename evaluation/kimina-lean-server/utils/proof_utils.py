@@ -226,3 +226,31 @@ def analyze(result: List[dict]):
         print(
             f"Average verification time: {avg_time:.2f} seconds per successful verification"
         )
+
+    analyze_timing(result)
+
+
+def analyze_timing(result: List[dict]):
+    """Summarize the latency breakdown of the results requested with `include_timing`."""
+    timings = [sample["timing"] for sample in result if sample.get("timing")]
+    if len(timings) == 0:
+        return None
+
+    df = pandas.DataFrame(timings)
+    phases = [
+        "queue_wait",
+        "cache_lookup",
+        "header_import",
+        "elaboration",
+        "serialization",
+        "total",
+    ]
+    summary = df[phases].quantile([0.5, 0.9, 0.99]).T
+    summary.columns = ["p50", "p90", "p99"]
+    summary["mean"] = df[phases].mean()
+
+    print(f"Latency breakdown over {len(df)} results (seconds):")
+    print(summary.round(3).to_string())
+    print(f"REPL cache hits: {100 * df['cache_hit'].mean():.2f} %")
+    print(f"Result cache hits: {100 * df['result_cache_hit'].mean():.2f} %")
+    return summary
@@ -1,105 +1,481 @@
 import asyncio
 import uuid
-from collections import OrderedDict, deque
+from collections import Counter, OrderedDict, deque
 from queue import Queue
 
+from loguru import logger
 
-def safe_rm(queue, id, repl):
-    """Safely remove a REPL instance from the queue."""
-    try:
-        queue.remove((id, repl))
-        return True
-    except ValueError:
-        return False
+# Seconds between two checks of a worker waiting for a REPL, should a wakeup be missed
+WAIT_INTERVAL = 1
+
+
+class ReplCreateQueue:
+    """
+    Awaitable queue of headers waiting for a pre-warmed REPL.
+
+    A REPL created to succeed a recycled one carries the id of its predecessor.
+    """
+
+    def __init__(self, on_done=None):
+        self.on_done = on_done  # Called with the header of each finished creation
+        self.queue = asyncio.Queue()
+        self.pending = Counter()  # Queued or in-flight creations per header
+        self.import_latency = {}  # Import latency statistics per header
+
+    def put(self, header, amount=1, predecessor=None):
+        """Schedule `amount` REPL creations for the given header."""
+        for _ in range(amount):
+            self.queue.put_nowait((header, predecessor))
+        self.pending[header] += amount
+
+    async def get(self):
+        """Wait for the next REPL to create, and return its header and predecessor id."""
+        return await self.queue.get()
+
+    def done(self, header, latency=None):
+        """Mark a creation as finished, recording its import latency if it succeeded."""
+        self.pending[header] -= 1
+        if self.pending[header] <= 0:
+            del self.pending[header]
+        if latency is not None:
+            stats = self.import_latency.setdefault(
+                header, {"count": 0, "total": 0.0, "max": 0.0, "last": 0.0}
+            )
+            stats["count"] += 1
+            stats["total"] += latency
+            stats["max"] = max(stats["max"], latency)
+            stats["last"] = latency
+        self.queue.task_done()
+        if self.on_done is not None:
+            self.on_done(header)
+
+    def __len__(self):
+        """Number of creations queued or in progress."""
+        return sum(self.pending.values())
+
+
+class CleanReplPool:
+    """
+    Pool of spawned REPL processes which have not run any command yet.
+
+    One-shot verifications lease a REPL from it to skip the process spawn and
+    the `lake env` resolution, while staying isolated from any other proof.
+    """
+
+    def __init__(self, max_size=0):
+        self.repls = deque()  # Clean REPLs, oldest first
+        self.max_size = max_size  # Number of clean REPLs to keep ready
+        self.pending = 0  # Spawns in flight
+        self.wakeup = asyncio.Event()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+        }
+
+    def get(self):
+        """Lease a clean REPL, or return None if the pool is empty."""
+        self.wakeup.set()
+        if self.repls:
+            self.stats["hits"] += 1
+            return self.repls.popleft()
+        self.stats["misses"] += 1
+        return None
+
+    async def reserve(self):
+        """Wait until the pool misses a REPL, and reserve the spawn of one."""
+        while len(self.repls) + self.pending >= self.max_size:
+            self.wakeup.clear()
+            await self.wakeup.wait()
+        self.pending += 1
+
+    def put(self, repl):
+        """Add a REPL spawned after a `reserve`, or cancel the spawn if None."""
+        self.pending -= 1
+        if repl is not None:
+            self.repls.append(repl)
+        else:
+            # Let the other spawners retry
+            self.wakeup.set()
+
+    def drain(self):
+        """Remove and return all the clean REPLs."""
+        repls = list(self.repls)
+        self.repls.clear()
+        return repls
+
+    def __len__(self):
+        return len(self.repls)
 
 
 class LRUReplCache:
-    def __init__(self, max_size=500):
-        self.cache = {}  # The cache that will store REPL pools
+    """
+    Pool of REPLs keyed by proof header with a global LRU eviction policy.
+
+    Each header has its own pool of idle REPLs, and the idle REPLs of all the
+    headers are also tracked in a global LRU order so that eviction is O(1).
+    All the operations run on the event loop without awaiting, so they need
+    no lock and never serialize unrelated headers.
+
+    A header missing from the cache is imported on the request path by at
+    most `max_cold_imports` requests at once, the others wait for one of its
+    REPLs to be released or pre-warmed instead of all importing it.
+    """
+
+    def __init__(
+        self,
+        max_size=500,
+        max_memory=None,
+        max_commands=None,
+        max_elaboration_time=None,
+        max_memory_growth=None,
+        max_cold_imports=1,
+    ):
+        self.cache = {}  # Idle REPLs per header, most recently released last
         self.global_repl_pool = (
             OrderedDict()
-        )  # A list to track all REPLs globally for LRU eviction
+        )  # All REPLs (idle or leased) globally, least recently used first
+        self.idle_lru = OrderedDict()  # Idle REPLs globally for LRU eviction
         self.max_size = max_size  # Max number of REPLs globally
-        self.lock = asyncio.Lock()  # Lock to ensure exclusive access to each REPL
+        self.max_memory = max_memory  # Max resident memory of the REPLs in bytes
+        self.memory = {}  # Last measured resident memory per REPL id
+        self.base_memory = {}  # First measured resident memory per REPL id
+        self.evict_on_release = set()  # Leased REPLs to evict once released
+        # Recycling policy, a REPL over any limit is replaced by a fresh one
+        self.max_commands = max_commands
+        self.max_elaboration_time = max_elaboration_time  # In seconds
+        self.max_memory_growth = max_memory_growth  # In bytes
+        self.retiring = {}  # REPLs waiting for their successor, id -> header
+        self.retire_on_release = set()  # Leased REPLs whose successor is ready
+        self.header_repls = Counter()  # Pooled REPLs (idle or leased) per header
+        # Imports of a header on the request path, for lack of a pooled REPL
+        self.max_cold_imports = max_cold_imports
+        self.cold_imports = Counter()
+        self.waiters = {}  # Wakes the requests waiting for a REPL, per header
         self.close_queue = Queue()  # Queue to store REPLs that need to be closed
-        self.create_queue = []  # Queue to store REPLs that need to be created
+        # Queue of REPLs that need to be created
+        self.create_queue = ReplCreateQueue(on_done=self._notify)
         self.stats = {
             "cache_hits": 0,
             "cache_misses": 0,
+            "timeouts": 0,
+            "crashes": 0,
+            "evictions": 0,
+            "memory_evictions": 0,
+            "destroyed": 0,
+            "recycled": 0,
         }
 
+    def _lease(self, key):
+        """Pop the most recently released idle REPL of the header."""
+        id, repl = self.cache[key].popitem(last=True)
+        del self.idle_lru[id]
+        # Move this REPL to the end of the global LRU list to mark it as recently used
+        self.global_repl_pool.move_to_end(id)
+        return id, repl
+
+    def _remove(self, id):
+        """Remove a REPL from the cache, returning its header and the REPL."""
+        key, repl = self.global_repl_pool.pop(id)
+        self.header_repls[key] -= 1
+        if self.header_repls[key] <= 0:
+            del self.header_repls[key]
+        if id in self.idle_lru:
+            del self.idle_lru[id]
+            del self.cache[key][id]
+        self.memory.pop(id, None)
+        self.base_memory.pop(id, None)
+        self.evict_on_release.discard(id)
+        self.retiring.pop(id, None)
+        self.retire_on_release.discard(id)
+        self._notify(key)
+        return key, repl
+
     async def get(self, key):
         """Get a REPL instance for the given header key."""
-        async with self.lock:  # Ensure thread-safety
-            if key in self.cache and self.cache[key]:
-                id, repl = self.cache[key].pop()
-                # Move this REPL to the global LRU list to mark it as recently used
-                assert id in self.global_repl_pool
-                self.global_repl_pool.move_to_end(id)
-                self.stats["cache_hits"] += 1
-                return id, repl
-            self.stats["cache_misses"] += 1
-            return None, None
-
-    async def put(self, key, repl):
-        """Put a new REPL instance into the cache for a specific header."""
-        async with self.lock:
-            if key not in self.cache:
-                self.cache[key] = deque()
-
-            # Add the new REPL to the list for that header
-            id = uuid.uuid4()
-            self.cache[key].append((id, repl))
-            # Also add it to the global LRU list
-            self.global_repl_pool[id] = (key, repl)
-            self._evict_if_needed()
+        if self.cache.get(key):
+            id, repl = self._lease(key)
+            self.stats["cache_hits"] += 1
+            # Pre-warm a replacement as soon as the last idle REPL is consumed
+            if not self.cache[key] and not self.create_queue.pending[key]:
+                self._schedule_replacement(key)
+            return id, repl
+        self.stats["cache_misses"] += 1
+        return None, None
+
+    def _can_import(self, key):
+        """Whether a request may import the header itself, for lack of any of its REPLs."""
+        return (
+            self.cold_imports[key]
+            + self.header_repls[key]
+            + self.create_queue.pending[key]
+            < self.max_cold_imports
+        )
+
+    async def _wait(self, key):
+        waiter = self.waiters.setdefault(key, asyncio.Event())
+        try:
+            await asyncio.wait_for(waiter.wait(), WAIT_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+    async def wait_for_repl(self, key):
+        """Wait while the header has no REPL yet, as another request imports it or one is created.
+
+        Requests wait here without a scheduler slot, then lease with `acquire`.
+        """
+        while (
+            not self.header_repls[key]
+            and not self.cache.get(key)
+            and not self._can_import(key)
+        ):
+            await self._wait(key)
+
+    async def acquire(self, key, demand=1):
+        """Lease an idle REPL of the header, for a caller holding a scheduler slot.
+
+        While every REPL of the header is leased, waits for one to be released,
+        which takes at most one proof as the REPLs are only leased in a slot,
+        and pre-warms one more REPL for the header in demand. A header missing
+        from the cache is imported by one request at a time, whose first import
+        also pre-warms REPLs for the rest of the `demand`.
+
+        Returns:
+            tuple | None: (id, repl) of the leased REPL; (None, None) if the caller
+                imports the header itself, and calls `end_import` once done; None if
+                another request imports it, to wait for with `wait_for_repl`.
+        """
+        while True:
+            if self.cache.get(key):
+                return await self.get(key)
+            if self._can_import(key):
+                self.stats["cache_misses"] += 1
+                self.cold_imports[key] += 1
+                self._prewarm(key, demand - 1)
+                return None, None
+            if not self.header_repls[key]:
+                return None
+            if not self.create_queue.pending[key]:
+                self._schedule_replacement(key)
+            await self._wait(key)
+
+    def end_import(self, key):
+        """End an import reserved by `acquire`, the imported REPL is added with `put_leased` first."""
+        self.cold_imports[key] -= 1
+        if self.cold_imports[key] <= 0:
+            del self.cold_imports[key]
+        self._notify(key)
+
+    def _prewarm(self, key, amount):
+        """Schedule up to `amount` REPLs of the header, within the room left by the leased REPLs."""
+        leased = len(self.global_repl_pool) - len(self.idle_lru)
+        room = (
+            self.max_size
+            - leased
+            - len(self.create_queue)
+            - sum(self.cold_imports.values())
+        )
+        if self.max_memory is not None and self.memory_usage() >= self.max_memory:
+            return
+        if min(amount, room) > 0:
+            self.create(key, min(amount, room))
+
+    def _notify(self, key):
+        """Wake the requests waiting for a REPL of the header."""
+        waiter = self.waiters.pop(key, None)
+        if waiter is not None:
+            waiter.set()
+
+    async def put(self, key, repl, predecessor=None):
+        """Put a new REPL instance into the cache for a specific header.
+
+        A REPL created as the successor of a recycled one retires its `predecessor`.
+        """
+        id = uuid.uuid4()
+        self.global_repl_pool[id] = (key, repl)
+        self.header_repls[key] += 1
+        self._add_idle(key, id, repl)
+        if predecessor is not None:
+            self._retire(predecessor)
+        self._evict_if_needed()
+
+    def put_leased(self, key, repl):
+        """Add a REPL imported on the request path, leased by the caller, and return its id."""
+        id = uuid.uuid4()
+        self.global_repl_pool[id] = (key, repl)
+        self.header_repls[key] += 1
+        self._evict_if_needed()
+        return id
+
+    def _add_idle(self, key, id, repl):
+        if key not in self.cache:
+            self.cache[key] = OrderedDict()
+        self.cache[key][id] = repl
+        self.idle_lru[id] = key
+        self._notify(key)
 
     def _evict_if_needed(self):
-        """Evict the least recently used REPLs globally if the cache size exceeds the max size."""
-        if len(self.global_repl_pool) > self.max_size:
-            # Pop the oldest item from the global LRU list (least recently used)
-            while len(self.global_repl_pool) > self.max_size:
-                id, (header_key, repl) = self.global_repl_pool.popitem(
-                    last=False
-                )  # Pop the oldest item
-
-                # Evict the REPL instance from the cache as well
-                if self.cache[header_key] and safe_rm(self.cache[header_key], id, repl):
-                    print(
-                        f"Succesfully evicted header {str([header_key])[:30]} with id {str(id)}"
-                    )
-                    self.close_queue.put((id, repl))
-                else:
-                    print(
-                        f"Failed to evict header {str([header_key])[:30]} with id {str(id)}, putting it back"
-                    )
-                    self.global_repl_pool[id] = (header_key, repl)
+        """Evict the least recently used idle REPLs globally if the cache size exceeds the max size."""
+        # Leased REPLs are never evicted, they are evicted once released if still needed.
+        # Successors of leased retiring REPLs do not count, their predecessor leaves soon.
+        max_size = self.max_size + len(self.retire_on_release)
+        while len(self.global_repl_pool) > max_size and self.idle_lru:
+            id = next(iter(self.idle_lru))
+            header_key, repl = self._remove(id)
+            self.stats["evictions"] += 1
+            logger.debug(f"Evicted header {str([header_key])[:30]} with id {str(id)}")
+            self.close_queue.put((id, repl))
 
     async def destroy(self, key, id, repl):
         """Close a REPL instance and remove it from the cache."""
-        print(f"Destroying header {str([key])[:30]} with id {str(id)}")
-        async with self.lock:
-            # Remove the REPL from the cache
-            if key in self.cache:
-                safe_rm(self.cache[key], id, repl)
-
-            # Remove the REPL from the global LRU list
-            if id in self.global_repl_pool:
-                del self.global_repl_pool[id]
-            # Close the REPL instance
-            self.close_queue.put((id, repl))
+        self.stats["destroyed"] += 1
+        logger.info(f"Destroying header {str([key])[:30]} with id {str(id)}")
+        # Remove the REPL from the cache, and replace it if it was pooled
+        if id in self.global_repl_pool:
+            retiring = id in self.retiring
+            self._remove(id)
+            # A retiring REPL already has a successor on the way
+            if not retiring:
+                self._schedule_replacement(key)
+        # Close the REPL instance
+        self.close_queue.put((id, repl))
 
     async def release(self, key, id, repl):
         """Release a REPL back to the cache, marking it as recently used."""
-        async with self.lock:
-            # Remove and then re-add the REPL to mark it as recently used
-            if key in self.cache:
-                self.cache[key].append((id, repl))
-                self.global_repl_pool.move_to_end(id)
+        if id not in self.global_repl_pool:
+            # The REPL was removed from the cache while leased
+            self.close_queue.put((id, repl))
+            return
+        if id in self.evict_on_release:
+            # The REPL was selected for eviction by the memory budget while leased
+            self._remove(id)
+            self.stats["memory_evictions"] += 1
+            self.close_queue.put((id, repl))
+            return
+        if id in self.retire_on_release:
+            # The successor of this REPL is already in the pool
+            self._remove(id)
+            self.stats["recycled"] += 1
+            self.close_queue.put((id, repl))
+            return
+        self.global_repl_pool.move_to_end(id)
+        self._add_idle(key, id, repl)
+        self._recycle_if_needed(key, id, repl)
+        self._evict_if_needed()
 
-    def create(self, header):
-        """Create a new REPL instance for a specific header."""
-        self.create_queue.append(header)
+    def _needs_recycle(self, id, repl):
+        """Check whether a REPL exceeds any limit of the recycling policy."""
+        if self.max_commands is not None and repl.num_commands >= self.max_commands:
+            return True
+        if (
+            self.max_elaboration_time is not None
+            and repl.elaboration_time >= self.max_elaboration_time
+        ):
+            return True
+        if (
+            self.max_memory_growth is not None
+            and id in self.memory
+            and self.memory[id] - self.base_memory[id] >= self.max_memory_growth
+        ):
+            return True
+        return False
+
+    def _recycle_if_needed(self, key, id, repl):
+        """
+        Pre-warm a successor for a REPL over the recycling policy limits.
+
+        The REPL stays usable until its successor is put in the cache, so that
+        recycling never turns into a cache miss.
+        """
+        if id in self.retiring or not self._needs_recycle(id, repl):
+            return
+        self.retiring[id] = key
+        self.create(key, predecessor=id)
+
+    def _retire(self, id):
+        """Retire a REPL whose successor is ready, or as soon as it is released."""
+        if id not in self.retiring:
+            # The REPL was removed from the cache while its successor was created
+            return
+        if id in self.idle_lru:
+            _, repl = self._remove(id)
+            self.stats["recycled"] += 1
+            self.close_queue.put((id, repl))
+        else:
+            self.retire_on_release.add(id)
+
+    def successor_failed(self, predecessor):
+        """Let a REPL be recycled again after the creation of its successor failed."""
+        self.retiring.pop(predecessor, None)
+
+    def create(self, header, amount=1, predecessor=None):
+        """Create new REPL instances for a specific header."""
+        self.create_queue.put(header, amount, predecessor)
+
+    def _schedule_replacement(self, header):
+        """Schedule a new REPL for the header unless the pool is already full."""
+        if len(self.global_repl_pool) + len(self.create_queue) >= self.max_size:
+            return
+        if self.max_memory is not None and self.memory_usage() >= self.max_memory:
+            return
+        self.create(header)
+
+    def update_memory(self, rss_by_id):
+        """Record the resident memory measured for the pooled REPLs."""
+        for id, rss in rss_by_id.items():
+            # Skip the REPLs removed from the cache while they were measured
+            if id in self.global_repl_pool:
+                self.memory[id] = rss
+                self.base_memory.setdefault(id, rss)
+                # Idle REPLs which grew too much are recycled right away
+                if id in self.idle_lru:
+                    key, repl = self.global_repl_pool[id]
+                    self._recycle_if_needed(key, id, repl)
+
+    def memory_usage(self):
+        """Get the last measured resident memory of the pooled REPLs in bytes."""
+        return sum(self.memory.values())
+
+    def evict_for_memory(self):
+        """Evict the heaviest REPLs while the pool exceeds its memory budget."""
+        if self.max_memory is None:
+            return
+        excess = self.memory_usage() - self.max_memory
+        if excess <= 0:
+            return
+
+        # Idle REPLs are evicted right away, heaviest first
+        idle = sorted(
+            (id for id in self.idle_lru if id in self.memory),
+            key=self.memory.get,
+            reverse=True,
+        )
+        for id in idle:
+            if excess <= 0:
+                return
+            excess -= self.memory[id]
+            header_key, repl = self._remove(id)
+            self.stats["memory_evictions"] += 1
+            logger.info(
+                f"Evicted header {str([header_key])[:30]} with id {str(id)} over memory budget"
+            )
+            self.close_queue.put((id, repl))
+
+        # Leased REPLs are evicted once released, heaviest first
+        leased = sorted(
+            (
+                id
+                for id in self.memory
+                if id not in self.idle_lru and id not in self.evict_on_release
+            ),
+            key=self.memory.get,
+            reverse=True,
+        )
+        excess -= sum(self.memory[id] for id in self.evict_on_release)
+        for id in leased:
+            if excess <= 0:
+                return
+            self.evict_on_release.add(id)
+            excess -= self.memory[id]
 
     def size(self):
         """Get the current size of the cache."""
@@ -107,74 +483,23 @@ class LRUReplCache:
 
     async def clean_cache_entry(self):
         """Clean cache entry with empty queue."""
-        deleted_headers = []
-        async with self.lock:
-            for header in list(self.cache.keys()):
-                if not self.cache[header]:
-                    del self.cache[header]
-                    deleted_headers.append(header)
-        print("[Clean cache entry] Num deleted headers: ", len(deleted_headers))
-
-    async def print_status(self, update_interval=5):
-        """Print the current status of the cache."""
-        # Print the header
-        print("=" * 65)
-        print(f"{'Idx':<5} | {'Header':<45} | {'Pool Size':<10}")
-        print("-" * 65)
-
-        idx = 1
-        idle_count = 0
-
-        async with self.lock:
-            # Print the cache status
-            proof_headers = list(self.cache.keys())
-            qsizes = [len(self.cache[header]) for header in proof_headers]
-        proof_headers_and_qsizes = sorted(
-            zip(proof_headers, qsizes), key=lambda x: x[1], reverse=True
-        )
+        deleted_headers = [header for header, pool in self.cache.items() if not pool]
+        for header in deleted_headers:
+            del self.cache[header]
+        logger.debug(f"Cleaned {len(deleted_headers)} empty header entries")
 
-        for header, qsize in proof_headers_and_qsizes:
-            proof_header = str([header])[:43]
-            if idx < 30:
-                print(f"{idx:<5} | {proof_header:<45} | {qsize:<10}")
-            elif idx == 30:
-                print(f"{'...':<5} | {'...':<45} | {'...':<10}")
-            idx += 1
-            idle_count += qsize
-
-        print("-" * 65)
-        # print top 10 global LRU pool
-        print("Top 10 global LRU repl:")
-        print("-" * 65)
-        print(f"{'Idx':<5} | {'Header':<45} | {'ID':<10}")
-        print("-" * 65)
-
-        # reverse iteration on global_repl_pool
-        async with self.lock:
-            for idx, (id, (header, _)) in enumerate(
-                reversed(list(self.global_repl_pool.items()))
-            ):
-                header = str([header])[:43]
-                if idx < 10:
-                    print(f"{idx + 1:<5} | {header:<45} | {str(id)[:8]:<10}")
-                elif idx == 10:
-                    print(f"{'...':<5} | {'...':<45} | {'...':<10}")
-                    break
-
-        print("-" * 65)
-        print(f"{'':<5} | {'Total':<45} | {len(self.global_repl_pool):<10}")
-        print(f"{'':<5} | {'Idle':<45} | {idle_count:<10}")
-        print(f"{'':<5} | {'Create Queue':<45} | {len(self.create_queue):<10}")
-        print(f"{'':<5} | {'Close Queue':<45} | {self.close_queue.qsize():<10}")
-        print(f"{'':<5} | {'Cache Hits':<45} | {self.stats['cache_hits']:<10}")
-        print(f"{'':<5} | {'Cache Misses':<45} | {self.stats['cache_misses']:<10}")
-        print(
-            f"{'':<5} | {'Cache ratio':<45} | {self.stats['cache_hits'] / (self.stats['cache_hits'] + self.stats['cache_misses'] + 1):<10.2f}"
-        )
-        print(
-            f"{'':<5} | {'its':<45} | {(self.stats['cache_hits'] + self.stats['cache_misses']) / update_interval:<10}"
-        )
-        print("=" * 65)
-
-        self.stats["cache_hits"] = 0
-        self.stats["cache_misses"] = 0
+    def snapshot(self):
+        """Summarize the cache state without copying the REPL pools."""
+        total = len(self.global_repl_pool)
+        idle = len(self.idle_lru)
+        return {
+            "total": total,
+            "idle": idle,
+            "leased": total - idle,
+            "headers": {header: len(pool) for header, pool in self.cache.items()},
+            "create_queue": len(self.create_queue),
+            "close_queue": self.close_queue.qsize(),
+            "memory": self.memory_usage(),
+            "retiring": len(self.retiring),
+            **self.stats,
+        }
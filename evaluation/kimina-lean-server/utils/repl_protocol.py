@@ -0,0 +1,100 @@
+import asyncio
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore[assignment]
+
+# Separator of two REPL responses
+SEPARATOR = b"\n\n"
+# Default upper bound of a REPL response, infotrees can be large
+MAX_RESPONSE_SIZE = 2**30
+
+
+class ResponseTooLargeError(Exception):
+    """A REPL response exceeded the maximum response size."""
+
+
+def loads(data):
+    """Decode a JSON document, with orjson if it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj):
+    """Encode a REPL command, framed by its separator, to bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj) + SEPARATOR
+    return (json.dumps(obj, ensure_ascii=False) + "\n\n").encode()
+
+
+class FrameReader:
+    """
+    Blocking reader of the blank-line framed responses of a REPL.
+
+    The output is read in bulk chunks from a file descriptor and only
+    scanned for the separator once, so a response of several megabytes
+    costs a few reads instead of one call per line. A response larger than
+    `max_size` raises a ResponseTooLargeError instead of exhausting memory.
+    """
+
+    def __init__(self, fd, max_size=MAX_RESPONSE_SIZE, chunk_size=2**16):
+        self.fd = fd
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.eof = False  # The process closed its output
+
+    def read_frame(self):
+        """Return the next response without its separator, or the partial output at EOF."""
+        scanned = 0
+        while True:
+            # Leading blank lines do not start a response
+            while self.buffer[:1] == b"\n":
+                del self.buffer[:1]
+                scanned = 0
+            end = self.buffer.find(SEPARATOR, max(scanned - 1, 0))
+            if end != -1:
+                frame = bytes(self.buffer[:end])
+                del self.buffer[: end + len(SEPARATOR)]
+                return frame
+            if len(self.buffer) > self.max_size:
+                self.buffer.clear()
+                raise ResponseTooLargeError(
+                    f"REPL response larger than {self.max_size} bytes"
+                )
+            scanned = len(self.buffer)
+            chunk = os.read(self.fd, self.chunk_size)
+            if not chunk:
+                self.eof = True
+                frame = bytes(self.buffer)
+                self.buffer.clear()
+                return frame
+            self.buffer += chunk
+
+
+async def read_frame(stream):
+    """Return the next response of an asyncio stream without its separator.
+
+    The maximum response size is the limit of the stream. Leading blank lines
+    are skipped, like `FrameReader` does.
+
+    Returns:
+        tuple: (response bytes, whether the process closed its output)
+    """
+    while True:
+        try:
+            frame = await stream.readuntil(SEPARATOR)
+        except asyncio.IncompleteReadError as e:
+            # The process exited before completing the response
+            return e.partial.lstrip(b"\n"), True
+        except asyncio.LimitOverrunError as e:
+            raise ResponseTooLargeError(
+                f"REPL response larger than {e.consumed} bytes"
+            ) from e
+        frame = frame[: -len(SEPARATOR)].lstrip(b"\n")
+        if frame:
+            return frame, False
@@ -0,0 +1,215 @@
+import asyncio
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+def timeout_class(timeout):
+    """
+    Bucket a timeout into a power of two class.
+
+    A proof which completed under a large timeout may time out under a smaller
+    one, so results are only shared between requests of the same class.
+    """
+    return math.ceil(math.log2(max(timeout, 1)))
+
+
+def project_revision(project_path):
+    """
+    Identify the Lean toolchain and dependencies of a project.
+
+    Hashes the `lean-toolchain` and `lake-manifest.json` files of the project
+    together with its git HEAD, so that cached results are invalidated when
+    any of them changes.
+    """
+    digest = hashlib.sha256()
+    if project_path is None:
+        return digest.hexdigest()
+
+    for name in ["lean-toolchain", "lake-manifest.json", ".git/HEAD"]:
+        path = os.path.join(project_path, name)
+        if not os.path.isfile(path):
+            continue
+        with open(path, "rb") as f:
+            content = f.read()
+        digest.update(name.encode() + b"\0" + content + b"\0")
+
+        # Resolve the commit of the checked out branch
+        if name == ".git/HEAD" and content.startswith(b"ref: "):
+            ref_path = os.path.join(project_path, ".git", content[5:].decode().strip())
+            if os.path.isfile(ref_path):
+                with open(ref_path, "rb") as f:
+                    digest.update(f.read())
+    return digest.hexdigest()
+
+
+def is_complete(response):
+    """
+    Whether a REPL response is the outcome of an elaborated command.
+
+    The REPL answers every command it elaborated with its environment, the
+    fallback of an undecodable response and the REPL level errors have none.
+    """
+    return isinstance(response, dict) and "env" in response
+
+
+class ResultCache:
+    """
+    Cache of verification results keyed by proof content.
+
+    An in-memory LRU sits in front of an optional SQLite store, so results
+    survive restarts of the server. Only completed verifications are cached:
+    crashes and timeouts are not, while Lean errors in the response are.
+
+    Results are written to disk in batches by `aflush`, in a worker thread, so
+    that caching a result never blocks the event loop on SQLite. The results of
+    a request are looked up together by `aget_many`, in a worker thread too,
+    through a separate connection which never waits for the writer in WAL mode.
+
+    The disk keeps the `max_disk_size` most recently written results.
+    """
+
+    def __init__(self, path=None, max_size=100000, revision="", max_disk_size=None):
+        self.memory = OrderedDict()  # In-memory LRU front, least recently used first
+        self.max_size = max_size  # Max number of results kept in memory
+        self.max_disk_size = max_disk_size  # Max number of results kept on disk
+        self.revision = revision  # Lean toolchain and project revision
+        self.db = None
+        self.reader = None  # Connection of the lookups
+        self.pending = {}  # Results not written to disk yet, by key
+        self.lock = threading.Lock()  # Serializes the writes between threads
+        self.read_lock = threading.Lock()  # Serializes the lookups between threads
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, response TEXT)"
+            )
+            self.db.commit()
+            self.reader = sqlite3.connect(path, check_same_thread=False)
+        self.stats = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+        }
+
+    def key(self, header, body, timeout, infotree_type=None):
+        """Compute the cache key of a proof verification."""
+        content = json.dumps(
+            [header, body, timeout_class(timeout), infotree_type, self.revision],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def get(self, key):
+        """Get the cached response for the key, or None on a miss, reading the disk inline."""
+        found = self._get_memory([key])
+        if key not in found:
+            found = self._get_disk([key], self._read([key]))
+        return found.get(key)
+
+    async def aget_many(self, keys):
+        """Get the cached responses of the keys, reading the disk once in a worker thread.
+
+        Returns:
+            dict: The cached response of each key found, by key.
+        """
+        found = self._get_memory(keys)
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        rows = await asyncio.to_thread(self._read, missing) if missing else []
+        found.update(self._get_disk(missing, rows))
+        return found
+
+    def _get_memory(self, keys):
+        found = {}
+        for key in keys:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.stats["hits"] += 1
+                found[key] = dict(self.memory[key])
+        return found
+
+    def _get_disk(self, missing, rows):
+        found = {}
+        for key, response in rows:
+            response = json.loads(response)
+            self._put_memory(key, response)
+            found[key] = dict(response)
+        self.stats["hits"] += len(found)
+        self.stats["disk_hits"] += len(found)
+        self.stats["misses"] += len(missing) - len(found)
+        return found
+
+    def _read(self, keys):
+        if self.reader is None or not keys:
+            return []
+        rows = []
+        with self.read_lock:
+            # Stay below the SQLite limit of parameters per statement
+            for start in range(0, len(keys), 500):
+                chunk = keys[start : start + 500]
+                placeholders = ", ".join("?" * len(chunk))
+                rows.extend(
+                    self.reader.execute(
+                        f"SELECT key, response FROM results WHERE key IN ({placeholders})",
+                        chunk,
+                    )
+                )
+        return rows
+
+    def put(self, key, response):
+        """Cache the response for the key, unless it is not a completed verification."""
+        if not is_complete(response):
+            return
+        self._put_memory(key, response)
+        if self.db is not None:
+            self.pending[key] = json.dumps(response, ensure_ascii=False)
+
+    async def aflush(self):
+        """Write the pending results to disk in a worker thread."""
+        pending, self.pending = self.pending, {}
+        if pending:
+            await asyncio.to_thread(self._write, pending)
+
+    def flush(self):
+        """Write the pending results to disk."""
+        pending, self.pending = self.pending, {}
+        if pending:
+            self._write(pending)
+
+    def _write(self, pending):
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO results (key, response) VALUES (?, ?)",
+                pending.items(),
+            )
+            if self.max_disk_size is not None:
+                # Rewritten results get a new rowid, so the oldest writes go first
+                self.db.execute(
+                    "DELETE FROM results WHERE rowid <= (SELECT max(rowid) FROM results) - ?",
+                    (self.max_disk_size,),
+                )
+            self.db.commit()
+
+    def _put_memory(self, key, response):
+        if self.max_size <= 0:
+            return
+        self.memory[key] = response
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
+
+    def close(self):
+        """Write the pending results and close the on-disk store."""
+        if self.db is not None:
+            self.flush()
+            self.db.close()
+            self.db = None
+            self.reader.close()
+            self.reader = None
@@ -0,0 +1,115 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+
+
+class FairScheduler:
+    """
+    Concurrency limiter sharing its slots fairly between tenants.
+
+    Waiting requests are grouped by priority level, and the highest level is
+    always served first. Within a level every tenant has its own FIFO queue,
+    and the tenants are served in start-time fair queuing order: each grant
+    advances the virtual time of its tenant by `1 / weight`, and the waiting
+    tenant with the smallest virtual time goes next. A tenant with one proof
+    thus waits for about one slot per active tenant, however many proofs a
+    bulk tenant has queued.
+    """
+
+    def __init__(self, capacity, weights=None):
+        self.capacity = capacity  # Number of concurrent slots
+        self.weights = weights or {}  # Share of each tenant, 1 by default
+        self.active = 0  # Slots currently granted
+        self.queues = {}  # Waiters per priority, then per tenant
+        self.finish = {}  # Virtual finish time per tenant
+        self.virtual_time = 0.0  # Virtual start time of the last grant
+        self.stats = {
+            "granted": 0,
+            "waited": 0,
+        }
+
+    def waiting(self):
+        """Number of requests waiting for a slot."""
+        return sum(
+            len(waiters)
+            for queues in self.queues.values()
+            for waiters in queues.values()
+        )
+
+    def _start(self, tenant):
+        # An idle tenant does not bank credit for the time it did not use
+        return max(self.finish.get(tenant, 0.0), self.virtual_time)
+
+    def _grant(self, tenant):
+        self.active += 1
+        self.stats["granted"] += 1
+        self.virtual_time = self._start(tenant)
+        self.finish[tenant] = self.virtual_time + 1 / self.weights.get(tenant, 1)
+
+    def _dispatch(self):
+        """Grant the free slots to the next waiters."""
+        while self.active < self.capacity and self.queues:
+            priority = max(self.queues)
+            queues = self.queues[priority]
+            tenant = min(queues, key=self._start)
+            waiter = queues[tenant].popleft()
+            if not queues[tenant]:
+                del queues[tenant]
+                if not queues:
+                    del self.queues[priority]
+            if waiter.done():
+                continue
+            self._grant(tenant)
+            waiter.set_result(None)
+
+    async def acquire(self, tenant, priority=0):
+        """Wait for a slot for the tenant."""
+        if self.active < self.capacity and not self.queues:
+            self._grant(tenant)
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.queues.setdefault(priority, {}).setdefault(tenant, deque()).append(waiter)
+        self.stats["waited"] += 1
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was granted while being cancelled
+                self.release()
+            else:
+                waiter.cancel()
+                self._remove(priority, tenant, waiter)
+            raise
+
+    def _remove(self, priority, tenant, waiter):
+        queue = self.queues.get(priority, {}).get(tenant)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        if not queue:
+            del self.queues[priority][tenant]
+            if not self.queues[priority]:
+                del self.queues[priority]
+
+    def release(self):
+        """Release a slot and grant it to the next waiter."""
+        self.active -= 1
+        self._dispatch()
+
+        # Forget the tenants whose virtual time fell behind, they start afresh anyway
+        if len(self.finish) > 2 * max(self.capacity, 64):
+            self.finish = {
+                tenant: finish
+                for tenant, finish in self.finish.items()
+                if finish > self.virtual_time
+            }
+
+    @asynccontextmanager
+    async def slot(self, tenant, priority=0):
+        """Hold a slot for the tenant during the context."""
+        await self.acquire(tenant, priority)
+        try:
+            yield
+        finally:
+            self.release()
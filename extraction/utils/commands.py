@@ -1,6 +1,18 @@
 from typing import Union, Tuple, Dict, List
 import subprocess
 import json
+import os
+import weakref
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Upper bound of a REPL response, infotrees can be large
+MAX_RESPONSE_SIZE = 2**30
+# Output read past the last response of each process, kept for the next read
+_surplus = weakref.WeakKeyDictionary()
 
 def run_lake_build(directory, target_name):
     print(f'{"-"*20} build {target_name} {"-"*20}')
@@ -38,16 +50,34 @@ def run_env_build(math_dir, repl_dir, log_file):
     )
     return process
 
-def read_from_process(stdin) -> dict:
-    s = ""
-    for _ in range(100000000):
-        s = s + stdin.readline()
-        try: 
-            res = json.loads(s)
-        except json.JSONDecodeError as e: 
+def read_from_process(stdin, max_size=MAX_RESPONSE_SIZE) -> dict:
+    # The REPL ends each response with a blank line: read the output in bulk
+    # chunks until the separator and decode the response once, with the same
+    # framing as the kimina lean server (utils/repl_protocol.py)
+    buffer = _surplus.pop(stdin, bytearray())
+    scanned = 0
+    while True:
+        end = buffer.find(b"\n\n", max(scanned - 1, 0))
+        if end != -1:
+            if buffer[:end].strip():
+                break
+            # Leading blank lines do not start a response
+            del buffer[:end + 2]
+            scanned = 0
             continue
-        return res
-    raise json.JSONDecodeError("The JSON object must be read in 100000000 lines", s, 100)
+        if len(buffer) > max_size:
+            raise json.JSONDecodeError(f"The JSON object exceeds {max_size} bytes", "", len(buffer))
+        scanned = len(buffer)
+        chunk = os.read(stdin.fileno(), 2**16)
+        if not chunk:
+            raise json.JSONDecodeError("The process exited before completing the JSON object", buffer.decode(errors="replace"), len(buffer))
+        buffer += chunk
+    frame = bytes(buffer[:end])
+    if len(buffer) > end + 2:
+        _surplus[stdin] = buffer[end + 2:]
+    if orjson is not None:
+        return orjson.loads(frame)
+    return json.loads(frame)
 
 def write_to_process(stdout, obj):
     stdout.write(json.dumps(obj, ensure_ascii=False) + '\n\n')